@@ -3,7 +3,7 @@ from django.contrib.auth.models import User, Group
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
 
-from .models import Profile, Link, Tracker
+from .models import Profile, Link, Tracker, EmailOutbox, JobRun, JobLease
 
 # Change admin page headers
 admin.site.site_header = _("ShortView Administration")
@@ -34,6 +34,7 @@ class TrackerInLine(admin.TabularInline):
     model = Tracker
     extra = 0
     classes=["collapse"]
+    raw_id_fields = ["header_blob"]
 
 
 class LinkAdmin(admin.ModelAdmin):
@@ -42,16 +43,45 @@ class LinkAdmin(admin.ModelAdmin):
     """
     fieldsets = [
         (_("General"), {"fields": ["owner", "description", "destination"]}),
-        (_("Date and time"), {"fields": ["date", "lifetime"]}),
+        (_("Date and time"), {"fields": ["date", "lifetime", "expires_at"]}),
         (_("Email notifications"), {"fields": ["notify_click"]}),
+        (_("Clicks"), {"fields": ["click_count", "first_click_at", "last_click_at"]}),
     ]
+    readonly_fields = ["expires_at", "click_count", "first_click_at", "last_click_at"]
     inlines = [TrackerInLine]
-    list_display = ["description", "owner", "short_destination", "date", "active"]
+    list_display = ["description", "owner", "short_destination", "date", "active", "click_count", "last_click_at"]
     list_filter = ["date", "owner"]
     search_fields = ["description"]
 
 
+class EmailOutboxAdmin(admin.ModelAdmin):
+    """
+    section to monitor the emails waiting to be sent
+    """
+    list_display = ["subject", "recipient", "status", "attempts", "created_at", "next_attempt_at", "sent_at"]
+    list_filter = ["status"]
+    search_fields = ["recipient", "subject"]
+
+
+class JobRunAdmin(admin.ModelAdmin):
+    """
+    section to monitor the background jobs
+    """
+    list_display = ["name", "last_started_at", "last_duration", "last_rows", "runs", "failures", "holder"]
+    readonly_fields = ["name", "holder", "last_started_at", "last_duration", "last_rows", "last_error", "runs", "failures"]
+
+
+class JobLeaseAdmin(admin.ModelAdmin):
+    """
+    section to see which worker runs the background jobs
+    """
+    list_display = ["name", "holder", "acquired_at", "expires_at"]
+
+
 admin.site.unregister(Group)
 admin.site.unregister(User)
 admin.site.register(User, UserAdminCustom)
 admin.site.register(Link, LinkAdmin)
+admin.site.register(EmailOutbox, EmailOutboxAdmin)
+admin.site.register(JobRun, JobRunAdmin)
+admin.site.register(JobLease, JobLeaseAdmin)
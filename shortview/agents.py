@@ -0,0 +1,93 @@
+from django.conf import settings
+
+from collections import Counter
+from functools import lru_cache
+from threading import Lock
+import re
+
+# Detection of the bots and apps fetching a link to build a preview, whose requests are not logged as clicks
+
+# rule name -> lowercase regex searched in the lowercased user agent
+# the rules are tried in order, so the specific ones come before the generic ones
+DEFAULT_PREVIEW_AGENTS = {
+    "imessage": r"facebookexternalhit/\S+ facebot twitterbot",
+    "whatsapp": r"whatsapp",
+    "discord": r"discord",
+    "slack": r"slack",
+    "telegram": r"telegrambot",
+    "twitter": r"twitterbot",
+    "facebook": r"facebookexternalhit|facebot|facebookcatalog|meta-externalagent",
+    "linkedin": r"linkedinbot",
+    "skype": r"skypeuripreview",
+    "viber": r"viber-url-downloader",  # the in-app browser of Viber announces "Viber/<version>", it is a real person
+    "mastodon": r"mastodon/",
+    "bluesky": r"bluesky|cardyb",
+    "pinterest": r"pinterestbot|pinterest/0\.",  # not "[Pinterest/Android]" nor "[Pinterest/iOS]", the in-app browsers
+    "reddit": r"redditbot",
+    "vkontakte": r"vkshare",
+    "embed_services": r"embedly|iframely|outbrain|quora link preview",
+    "google": r"googlebot|google-inspectiontool|googleother|google-read-aloud|mediapartners-google|adsbot-google|feedfetcher-google",
+    "bing": r"bingbot|bingpreview|msnbot",
+    "apple": r"applebot",
+    "yandex": r"yandex(?:bot|images|mobilebot)",
+    "baidu": r"baiduspider",
+    "duckduckgo": r"duckduckbot|duckassistbot",
+    "ai_crawlers": r"gptbot|chatgpt-user|oai-searchbot|claudebot|claude-user|perplexitybot|ccbot|bytespider|amazonbot",
+    "http_clients": r"^(?:curl|wget|python-requests|python-urllib|go-http-client|okhttp|java|apache-httpclient|axios|node-fetch)\b",
+    "generic": r"crawler|spider|headlesschrome|[a-z]bot/|\bbot\b",
+}
+
+EMPTY_RULE = "empty"  # pseudo rule for the requests without user agent, which browsers always send
+MAX_USER_AGENT_LENGTH = 512  # longer user agents are truncated, to bound the memory of the cache
+
+
+class AgentFilter:
+    """
+    a set of compiled signatures, with an LRU cache of the verdict of each user agent
+    and a counter of the requests filtered by each rule
+    """
+    def __init__(self, signatures:dict[str, str], cache_size:int=4096, filter_empty:bool=True):
+        # the re module doesn't optimize large alternations nor case insensitive matching,
+        # separate patterns searched in the lowercased user agent are several times faster than a single one
+        self.rules = [(rule, re.compile(signature)) for rule, signature in signatures.items()]
+        self.filter_empty = filter_empty
+        self.filtered = Counter()
+        self._lock = Lock()
+        self._classify = lru_cache(maxsize=cache_size)(self._classify_uncached)
+
+    def _classify_uncached(self, user_agent:str) -> str | None:
+        if not user_agent:
+            return EMPTY_RULE if self.filter_empty else None
+        user_agent = user_agent.lower()
+        for rule, pattern in self.rules:
+            if pattern.search(user_agent):
+                return rule
+        return None
+
+    def classify(self, user_agent:str=None) -> str | None:
+        """
+        returns the name of the rule matching the user agent, None if it is a regular client
+        """
+        return self._classify((user_agent or "").strip()[:MAX_USER_AGENT_LENGTH])
+
+    def filter(self, user_agent:str=None) -> str | None:
+        """
+        same as classify, and counts the request in the statistics of the matching rule
+        """
+        rule = self.classify(user_agent)
+        if rule is not None:
+            with self._lock:
+                self.filtered[rule] += 1
+        return rule
+
+    def stats(self) -> dict:
+        info = self._classify.cache_info()
+        with self._lock:
+            filtered = dict(self.filtered)
+        return {"filtered": filtered, "cache_hits": info.hits, "cache_misses": info.misses,
+                "cache_size": info.currsize, "cache_max_size": info.maxsize}
+
+
+agent_filter = AgentFilter(getattr(settings, "PREVIEW_AGENTS", DEFAULT_PREVIEW_AGENTS),
+                           cache_size=getattr(settings, "PREVIEW_AGENTS_CACHE_SIZE", 4096),
+                           filter_empty=getattr(settings, "PREVIEW_AGENTS_FILTER_EMPTY", True))
@@ -6,5 +6,10 @@ class ShortviewConfig(AppConfig):
     name = 'shortview'
     
     def ready(self):
+        from . import signals  # connect the signal handlers
+        from .geoip import preload_database
         from .jobs import start_job_scheduler
+        from .linkcache import warm_link_cache
         start_job_scheduler()
+        warm_link_cache()
+        preload_database()
@@ -0,0 +1,258 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .models import Link, Tracker
+from .export import tracker_rows
+
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Iterator
+import datetime
+import gzip
+import json
+import os
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows, only the threads of this process are excluded by archive_lock
+    fcntl = None
+
+# Cold archive of the old trackers, in compressed monthly NDJSON files on local disk
+#
+# each month has a data file made of concatenated gzip members, one per link and archiving chunk,
+# and a json index mapping each link id to the [offset, length, rows] of its members,
+# so that the clicks of a link are read back by decompressing only its own members
+#
+# the clicks of a deleted link are purged: its entries leave the index, then its members are overwritten with zeros,
+# the ranges being overwritten are kept under the DELETED key of the index until it's done
+
+DELETED = "deleted"
+
+_indexes: dict[str, tuple[tuple[int, int], dict]] = {}  # index path -> ((modification time, size), index)
+_indexes_lock = Lock()
+_archive_lock = Lock()
+
+
+def archive_directory() -> Path:
+    return Path(getattr(settings, "TRACKER_ARCHIVE_DIR", settings.BASE_DIR / "archive"))
+
+
+def month_of(date:datetime.datetime) -> str:
+    return date.astimezone(datetime.timezone.utc).strftime("%Y-%m")
+
+
+def data_path(month:str) -> Path:
+    return archive_directory() / f"trackers-{month}.ndjson.gz"
+
+
+def index_path(month:str) -> Path:
+    return archive_directory() / f"trackers-{month}.index.json"
+
+
+def archived_months() -> list[str]:
+    """
+    the months having archived clicks, oldest first
+    """
+    directory = archive_directory()
+    if not directory.is_dir():
+        return []
+    return sorted(path.name[len("trackers-"):-len(".index.json")] for path in directory.glob("trackers-*.index.json"))
+
+
+def load_index(month:str) -> dict[str, list[list[int]]]:
+    """
+    the index of a month, cached until its file changes
+    """
+    path = index_path(month)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return {}
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _indexes_lock:
+        cached = _indexes.get(str(path))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    with open(path, encoding="utf-8") as file:
+        index = json.load(file)
+    with _indexes_lock:
+        _indexes[str(path)] = (version, index)
+    return index
+
+
+@contextmanager
+def archive_lock():
+    """
+    hold the lock of the archive, so that a single process at a time appends to it or rewrites its indexes
+    """
+    archive_directory().mkdir(parents=True, exist_ok=True)
+    with _archive_lock, open(archive_directory() / "archive.lock", "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # released when the file is closed
+        yield
+
+
+def write_index(month:str, index:dict):
+    temporary = index_path(month).with_suffix(".tmp")
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(index, file, separators=(",", ":"))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, index_path(month))
+
+
+def append_rows(month:str, rows_by_link:dict[int, list[dict]]):
+    """
+    append the rows of several links to the archive of a month, one gzip member per link, called with archive_lock held
+    the data is synced before the index is replaced, and the index before the trackers are deleted,
+    so a crash leaves at worst unindexed bytes or rows archived twice, which read_link skips
+    """
+    path = data_path(month)
+    index = dict(load_index(month))
+    with open(path, "ab") as file:
+        offset = file.seek(0, os.SEEK_END)
+        for link_id, rows in rows_by_link.items():
+            member = gzip.compress("".join(json.dumps(row) + "\n" for row in rows).encode("utf-8"), mtime=0)
+            file.write(member)
+            index[str(link_id)] = index.get(str(link_id), []) + [[offset, len(member), len(rows)]]
+            offset += len(member)
+        file.flush()
+        os.fsync(file.fileno())
+    write_index(month, index)
+
+
+def forget_links(link_ids:Iterable[int]):
+    """
+    purge the archived clicks of deleted links, with their addresses and headers
+    """
+    keys = {str(link_id) for link_id in link_ids}
+    for month in archived_months():
+        if not keys & load_index(month).keys():
+            continue
+        with archive_lock():
+            index = dict(load_index(month))
+            index[DELETED] = index.get(DELETED, []) + [entry for key in keys & index.keys() for entry in index.pop(key)]
+            write_index(month, index)  # the clicks can't be read anymore from here
+            purge_deleted(month, index)
+
+
+def purge_deleted(month:str, index:dict):
+    """
+    overwrite the members listed under the DELETED key of the index of a month, called with archive_lock held
+    a month without any other member left is removed
+    """
+    if DELETED not in index:
+        return
+    if index.keys() == {DELETED}:
+        data_path(month).unlink(missing_ok=True)
+        index_path(month).unlink()
+        return
+    with open(data_path(month), "r+b") as file:
+        for offset, length, _ in index[DELETED]:
+            file.seek(offset)
+            while length > 0:
+                length -= file.write(bytes(min(length, 1 << 20)))
+        file.flush()
+        os.fsync(file.fileno())
+    write_index(month, {key: entries for key, entries in index.items() if key != DELETED})
+
+
+def archived_count(link_id:int) -> int:
+    """
+    the number of archived clicks of a link, read from the indexes only
+    """
+    return sum(rows for month in archived_months() for _, _, rows in load_index(month).get(str(link_id), []))
+
+
+def read_link(link_id:int, start:datetime.datetime=None, end:datetime.datetime=None) -> Iterator[dict]:
+    """
+    the archived clicks of a link in chronological order, optionally between two dates, as export rows with headers
+    """
+    seen = set()
+    for month in archived_months():
+        if (start is not None and month < month_of(start)) or (end is not None and month > month_of(end)):
+            continue
+        entries = load_index(month).get(str(link_id))
+        if not entries:
+            continue
+        with open(data_path(month), "rb") as file:
+            for offset, length, _ in entries:
+                file.seek(offset)
+                try:
+                    data = gzip.decompress(file.read(length))
+                except (OSError, EOFError, zlib.error):
+                    continue  # purged since the index was read, the link was deleted
+                rows = [json.loads(line) for line in data.splitlines()]
+                for row in sorted(rows, key=lambda row: (row["date"], row["id"])):
+                    date = datetime.datetime.fromisoformat(row["date"])
+                    if row["id"] in seen or (start is not None and date < start) or (end is not None and date >= end):
+                        continue
+                    seen.add(row["id"])
+                    yield row
+
+
+def expired_trackers(now:datetime.datetime=None, link_batch_size:int=500) -> Iterator[QuerySet]:
+    """
+    the trackers older than the retention of their owner, or than TRACKER_RETENTION_DAYS for the owners without one,
+    as one queryset per batch of links sharing the same retention
+    the links are walked by id, so that each queryset reads the tracker_link_date index of its links only
+    """
+    now = now or timezone.now()
+    default = getattr(settings, "TRACKER_RETENTION_DAYS", None)
+    last_id = 0
+    while True:
+        links = list(Link.objects.filter(id__gt=last_id).order_by("id")
+                     .values_list("id", "owner__profile__tracker_retention")[:link_batch_size])
+        if not links:
+            return
+        last_id = links[-1][0]
+        batches: dict[int, list[int]] = defaultdict(list)
+        for link_id, days in links:
+            days = default if days is None else days
+            if days is not None:
+                batches[days].append(link_id)
+        for days, link_ids in batches.items():
+            yield Tracker.objects.filter(link_id__in=link_ids, date__lt=now - datetime.timedelta(days=days))
+
+
+def archive_trackers(limit:int=None, chunk_size:int=None, now:datetime.datetime=None) -> int:
+    """
+    move the trackers older than their retention to the archive, deleting them one chunk per transaction
+    the click counters and the hourly rollups are kept, so the totals and the charts still include them
+    returns the number of archived trackers, at most limit
+    """
+    chunk_size = chunk_size or getattr(settings, "TRACKER_ARCHIVE_CHUNK_SIZE", 5000)
+    for month in archived_months():
+        if DELETED in load_index(month):  # a purge interrupted by a crash
+            with archive_lock():
+                purge_deleted(month, dict(load_index(month)))
+    archived = 0
+    for expired in expired_trackers(now):
+        # in the order of the index, by link then by date, so that the members of a link hold its clicks in chronological order
+        expired = expired.select_related("header_blob").order_by("link_id", "date", "id")
+        while limit is None or archived < limit:
+            trackers = list(expired[:chunk_size if limit is None else min(chunk_size, limit - archived)])
+            if not trackers:
+                break
+            months: dict[str, dict[int, list[dict]]] = defaultdict(lambda: defaultdict(list))
+            for tracker, row in zip(trackers, tracker_rows(trackers, include_headers=True)):
+                months[month_of(tracker.date)][tracker.link_id].append(row)
+            with archive_lock():  # a single archiver at a time, the appends would interleave
+                for month, rows_by_link in months.items():
+                    append_rows(month, rows_by_link)
+            with transaction.atomic():
+                Tracker.objects.filter(id__in=[tracker.id for tracker in trackers]).delete()
+            # a link deleted while its clicks were archived was purged before they were appended
+            link_ids = {tracker.link_id for tracker in trackers}
+            deleted = link_ids - set(Link.objects.filter(id__in=link_ids).values_list("id", flat=True))
+            if deleted:
+                forget_links(deleted)
+            archived += len(trackers)
+        if limit is not None and archived >= limit:
+            break
+    return archived
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from contextlib import contextmanager
+import tempfile
+import math
+import os
+
+# Helpers shared by the benchmark commands
+
+@contextmanager
+def benchmark_database():
+    """
+    run the benchmark against a throwaway on-disk test database, so that the real data is never touched
+    an on-disk database is used rather than the in-memory test one, so that concurrent writers behave like in production
+    """
+    directory = tempfile.mkdtemp(prefix="shortview_bench_")
+    settings.DATABASES["default"].setdefault("TEST", {})["NAME"] = os.path.join(directory, "bench.sqlite3")
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(values:list[float], pct:float) -> float:
+    """
+    nearest-rank percentile of a list of values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(durations:list[float], elapsed:float) -> dict:
+    """
+    throughput and latency percentiles (in milliseconds) of a run
+    """
+    return {"requests": len(durations),
+            "rps": len(durations) / elapsed if elapsed else 0.0,
+            "mean_ms": sum(durations) / len(durations) * 1000 if durations else 0.0,
+            "p50_ms": percentile(durations, 50) * 1000,
+            "p95_ms": percentile(durations, 95) * 1000,
+            "p99_ms": percentile(durations, 99) * 1000,
+            }
+
+
+def format_summary(name:str, summary:dict) -> str:
+    return (f"{name}: {summary['requests']} requests, {summary['rps']:.1f} req/s, "
+            f"p50 {summary['p50_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms")
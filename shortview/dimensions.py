@@ -0,0 +1,109 @@
+from django.conf import settings
+
+from functools import lru_cache
+from typing import Mapping
+from urllib.parse import urlsplit
+import re
+
+# Dimensions of a click extracted from its request header when it is logged, stored in indexed tracker columns
+
+DIMENSIONS = ("referer_host", "ua_family", "ua_os", "language", "device")
+
+# name -> lowercase regex searched in the lowercased user agent, the first matching rule wins
+# most browsers also announce the engine of the others, so the specific ones come first
+BROWSER_FAMILIES = {
+    "Edge": r"edg(?:e|a|ios)?/",
+    "Opera": r"opr/|opera|opt/",
+    "Samsung Internet": r"samsungbrowser",
+    "Yandex Browser": r"yabrowser",
+    "Vivaldi": r"vivaldi",
+    "Firefox": r"firefox|fxios",
+    "Chrome": r"chrome|crios|chromium",
+    "Safari": r"version/[\d.]+.*safari|mobile/\w+$",
+    "Internet Explorer": r"msie |trident/",
+    "Bot": r"bot\b|crawler|spider|^(?:curl|wget|python|go-http-client|java)\b",
+}
+
+OPERATING_SYSTEMS = {
+    "iOS": r"iphone|ipad|ipod|cpu os ",
+    "Android": r"android",
+    "Windows": r"windows",
+    "ChromeOS": r"cros ",
+    "macOS": r"mac os x|macintosh",
+    "Linux": r"linux|x11",
+}
+
+DEVICES = {
+    "bot": r"bot\b|crawler|spider|^(?:curl|wget|python|go-http-client|java)\b",
+    "tablet": r"ipad|tablet|kindle|silk/|android(?!.*mobile)",
+    "mobile": r"mobi|iphone|ipod|windows phone",
+    "desktop": r"windows nt|macintosh|x11|cros |linux",
+}
+
+LANGUAGE_TAG = re.compile(r"[a-z]{1,8}")
+
+
+class UserAgentParser:
+    """
+    the browser, the operating system and the kind of device announced by a user agent, with an LRU cache of the results
+    """
+    def __init__(self, cache_size:int=4096):
+        self.families, self.systems, self.devices = [[(name, re.compile(pattern)) for name, pattern in rules.items()]
+                                                     for rules in (BROWSER_FAMILIES, OPERATING_SYSTEMS, DEVICES)]
+        self.parse = lru_cache(maxsize=cache_size)(self._parse_uncached)
+
+    def _parse_uncached(self, user_agent:str) -> tuple[str, str, str]:
+        user_agent = user_agent.lower()
+        if not user_agent:
+            return "", "", ""
+        return (self._match(self.families, user_agent, "Other"), self._match(self.systems, user_agent, "Other"),
+                self._match(self.devices, user_agent, ""))
+
+    @staticmethod
+    def _match(rules:list[tuple[str, re.Pattern]], user_agent:str, default:str) -> str:
+        for name, pattern in rules:
+            if pattern.search(user_agent):
+                return name
+        return default
+
+
+user_agent_parser = UserAgentParser(getattr(settings, "USER_AGENT_CACHE_SIZE", 4096))
+
+
+def referer_host(referer:str) -> str:
+    """
+    the host name of the page the link was clicked from, empty if it isn't known
+    """
+    try:
+        return (urlsplit(referer.strip()).hostname or "")[:255]
+    except ValueError:
+        return ""
+
+
+def primary_language(accept_language:str) -> str:
+    """
+    the primary subtag of the language the client prefers, "fr" for "fr-CH, fr;q=0.9, en;q=0.8"
+    """
+    best, best_quality = "", 0.0
+    for item in accept_language.split(","):
+        tag, _, parameters = item.partition(";")
+        quality = 1.0
+        if parameters.strip().startswith("q="):
+            try:
+                quality = float(parameters.strip()[2:])
+            except ValueError:
+                continue
+        language = tag.strip().split("-")[0].lower()
+        if quality > best_quality and LANGUAGE_TAG.fullmatch(language):
+            best, best_quality = language, quality
+    return best
+
+
+def click_dimensions(header:Mapping[str, str]) -> dict[str, str]:
+    """
+    the dimensions of a click from its request header, whose names are matched regardless of their case
+    """
+    header = {name.lower(): value for name, value in header.items()}
+    family, system, device = user_agent_parser.parse(header.get("user-agent", "").strip()[:512])
+    return {"referer_host": referer_host(header.get("referer", "")), "ua_family": family, "ua_os": system,
+            "language": primary_language(header.get("accept-language", "")), "device": device}
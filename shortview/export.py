@@ -0,0 +1,95 @@
+from .models import Tracker
+
+from typing import Iterable, Iterator
+import json
+import csv
+import zlib
+
+# Streaming serialization of the click logs
+
+CSV_COLUMNS = ["id", "date", "ip", "country", "asn"]
+
+
+class _Echo:
+    """
+    a file-like object returning what is written, so that csv.writer can produce lines one by one
+    """
+    def write(self, value:str) -> str:
+        return value
+
+
+def tracker_rows(trackers:Iterable[Tracker], include_headers:bool=False) -> Iterator[dict]:
+    """
+    convert trackers to plain rows, the headers of the same blob are only decoded once
+    """
+    decoded_blobs: dict[int, dict] = {}
+    for tracker in trackers:
+        row = {"id": tracker.id, "date": tracker.date.isoformat(), "ip": tracker.ip, "country": tracker.country, "asn": tracker.asn}
+        if include_headers:
+            if tracker.header_blob_id is None:
+                try:
+                    row["header"] = json.loads(tracker.header) if tracker.header else {}
+                except ValueError:
+                    row["header"] = {"raw": tracker.header}  # legacy inline header which isn't json
+            else:
+                if tracker.header_blob_id not in decoded_blobs:
+                    if len(decoded_blobs) >= 1000:
+                        decoded_blobs.clear()  # keep the memory bounded on exports with many different headers
+                    decoded_blobs[tracker.header_blob_id] = json.loads(tracker.header_blob.canonical_json())
+                row["header"] = decoded_blobs[tracker.header_blob_id]
+        yield row
+
+
+def archived_rows(rows:Iterable[dict], include_headers:bool=False) -> Iterator[dict]:
+    """
+    the rows read from the archive, which always have the headers, in the format of tracker_rows
+    the rows archived before the geolocation was added have no country nor ASN
+    """
+    for row in rows:
+        columns = {column: row.get(column, "" if column == "country" else None) for column in CSV_COLUMNS}
+        if include_headers:
+            columns["header"] = row["header"]
+        yield columns
+
+
+def csv_lines(rows:Iterable[dict], include_headers:bool=False) -> Iterator[str]:
+    columns = CSV_COLUMNS + (["header"] if include_headers else [])
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([json.dumps(row[column]) if column == "header" else row[column] for column in columns])
+
+
+def ndjson_lines(rows:Iterable[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def buffered(lines:Iterable[str], size:int=65536) -> Iterator[bytes]:
+    """
+    group small lines into chunks of about size bytes, to avoid sending one tiny chunk per row
+    """
+    buffer = []
+    length = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzipped(chunks:Iterable[bytes]) -> Iterator[bytes]:
+    """
+    compress a stream of chunks into a gzip stream, without holding more than a chunk in memory
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,180 @@
+from django.conf import settings
+
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from threading import Lock
+import gzip
+import socket
+
+# Offline geolocation of the click addresses, from a local file of IP ranges
+
+# the database is a tab separated file of "range_start range_end AS_number country_code AS_description" lines,
+# as published by https://iptoasn.com (ip2asn-combined.tsv), optionally gzipped
+UNKNOWN = ("", None)  # country and ASN of the addresses which aren't in the database
+IPV4_MAPPED_PREFIX = bytes(10) + b"\xff\xff"
+
+
+def parse_address(ip:str) -> tuple[int, int]:
+    """
+    returns the version and the integer value of an address, several times faster than the ipaddress module
+    raises ValueError if it isn't a valid address
+    """
+    try:
+        if ":" not in ip:
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+        packed = socket.inet_pton(socket.AF_INET6, ip)
+    except (OSError, TypeError):
+        raise ValueError(f"invalid address {ip!r}")
+    if packed.startswith(IPV4_MAPPED_PREFIX):
+        return 4, int.from_bytes(packed[12:], "big")
+    return 6, int.from_bytes(packed, "big")
+
+
+class RangeTable:
+    """
+    sorted, non-overlapping ranges of addresses stored in compact arrays and searched with bisect
+    """
+    def __init__(self, typecode:str, shift:int=0):
+        # the IPv6 ranges are stored by their first 64 bits, the routed prefixes are never longer than /64
+        self.shift = shift
+        self.starts = array(typecode)
+        self.ends = array(typecode)
+        self.countries = array("H")  # index in GeoDatabase.countries
+        self.asns = array("I")
+
+    def append(self, start:int, end:int, country:int, asn:int):
+        self.starts.append(start >> self.shift)
+        self.ends.append(end >> self.shift)
+        self.countries.append(country)
+        self.asns.append(asn)
+
+    def sort(self):
+        """
+        sort the ranges by their start, the published files are already sorted so this usually does nothing
+        """
+        if all(self.starts[index - 1] <= self.starts[index] for index in range(1, len(self.starts))):
+            return
+        order = sorted(range(len(self.starts)), key=self.starts.__getitem__)
+        for name in ("starts", "ends", "countries", "asns"):
+            values = getattr(self, name)
+            setattr(self, name, array(values.typecode, (values[index] for index in order)))
+
+    def find(self, address:int) -> int | None:
+        """
+        returns the position of the range containing the address, None if it isn't in any
+        """
+        address >>= self.shift
+        position = bisect_right(self.starts, address) - 1
+        if position < 0 or address > self.ends[position]:
+            return None
+        return position
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class GeoDatabase:
+    """
+    the IPv4 and IPv6 ranges of a database file, with an LRU cache of the country and ASN of each address
+    """
+    def __init__(self, path:str, cache_size:int=65536):
+        self.path = path
+        self.countries = [""]
+        self.tables = {4: RangeTable("I"), 6: RangeTable("Q", shift=64)}
+        self._load()
+        self.locate = lru_cache(maxsize=cache_size)(self._locate_uncached)
+
+    def _load(self):
+        # the ranges go straight to the arrays, to keep the memory used while loading close to the size of the tables
+        country_ids = {"": 0}
+        opener = gzip.open if str(self.path).endswith(".gz") else open
+        with opener(self.path, "rt", encoding="utf-8") as file:
+            for line in file:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 4:
+                    continue
+                try:
+                    (version, start), (_, end) = parse_address(fields[0]), parse_address(fields[1])
+                    asn = int(fields[2])
+                except ValueError:
+                    continue  # header or malformed line
+                if asn == 0 and fields[3] in ("None", ""):
+                    continue  # not routed, same as missing
+                country = fields[3] if len(fields[3]) == 2 else ""
+                if country not in country_ids:
+                    country_ids[country] = len(self.countries)
+                    self.countries.append(country)
+                self.tables[version].append(start, end, country_ids[country], asn)
+        for table in self.tables.values():
+            table.sort()
+
+    def _locate_uncached(self, ip:str) -> tuple[str, int | None]:
+        try:
+            version, address = parse_address(ip)
+        except ValueError:
+            return UNKNOWN
+        table = self.tables[version]
+        position = table.find(address)
+        if position is None:
+            return UNKNOWN
+        return self.countries[table.countries[position]], table.asns[position] or None
+
+    def stats(self) -> dict:
+        info = self.locate.cache_info()
+        return {"ipv4_ranges": len(self.tables[4]), "ipv6_ranges": len(self.tables[6]),
+                "cache_hits": info.hits, "cache_misses": info.misses, "cache_size": info.currsize}
+
+
+_database: GeoDatabase = None
+_database_lock = Lock()
+_load_failed = False
+
+
+def database() -> GeoDatabase | None:
+    """
+    the database of the GEOIP_DATABASE setting, loaded on first use, None if there is none
+    """
+    global _database, _load_failed
+    if _database is not None or _load_failed:
+        return _database
+    path = getattr(settings, "GEOIP_DATABASE", None)
+    if not path:
+        _load_failed = True
+        return None
+    with _database_lock:
+        if _database is None and not _load_failed:
+            try:
+                _database = GeoDatabase(path, cache_size=getattr(settings, "GEOIP_CACHE_SIZE", 65536))
+            except (OSError, ValueError, EOFError) as e:  # missing, unreadable, not utf-8 or truncated
+                print(f"\n/!\\ Error while loading the geolocation database {path}: {e}")
+                _load_failed = True  # don't retry on every click, the services must be restarted
+    return _database
+
+
+def preload_database():
+    """
+    load the database at startup if there is one, so that the first click of each worker doesn't wait for it
+    """
+    if getattr(settings, "GEOIP_DATABASE", None):
+        database()  # never blocks the startup, a loading error is logged and the clicks stay unlocated
+
+
+def locate(ip:str) -> tuple[str, int | None]:
+    """
+    returns the country code and the ASN of an address, empty and None when they are unknown
+    """
+    geo_database = database()
+    if geo_database is None:
+        return UNKNOWN
+    return geo_database.locate(ip)
+
+
+def reset():
+    """
+    forget the loaded database, so that the next lookup loads the file again
+    """
+    global _database, _load_failed
+    with _database_lock:
+        _database = None
+        _load_failed = False
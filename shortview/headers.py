@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import transaction
+
+from .models import HeaderBlob
+
+from threading import Lock
+import hashlib
+import json
+import zlib
+
+# Content-addressed storage of the request headers logged with each click
+
+_known_blobs: dict[str, int] = {}  # digest to blob id, blobs are never deleted so the ids stay valid
+_known_blobs_lock = Lock()
+KNOWN_BLOBS_MAX_SIZE = 10000
+
+
+def canonical_json(header:dict) -> str:
+    """
+    serialize a header so that identical headers always give the same text
+    the names keep their order, which a client doesn't change between requests, so the header is shown as it was received
+    """
+    return json.dumps(header, separators=(",", ":"), ensure_ascii=False)
+
+
+def header_digest(canonical:str) -> str:
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def make_blob(canonical:str, digest:str=None) -> HeaderBlob:
+    """
+    build an unsaved blob, compressed when the HEADER_COMPRESSION setting is enabled and it makes the blob smaller
+    """
+    data = canonical.encode("utf-8")
+    compressed = False
+    if getattr(settings, "HEADER_COMPRESSION", True):
+        compressed_data = zlib.compress(data, 6)
+        if len(compressed_data) < len(data):
+            data, compressed = compressed_data, True
+    return HeaderBlob(digest=digest or header_digest(canonical), compressed=compressed, data=data)
+
+
+def resolve_blobs(canonicals:list[str]) -> tuple[list[int], int]:
+    """
+    get the blob id of each canonical header, creating the missing blobs
+    returns the ids in the same order, and the number of bytes taken by the new blobs
+    """
+    digests = [header_digest(canonical) for canonical in canonicals]
+    with _known_blobs_lock:
+        ids = {digest: _known_blobs[digest] for digest in digests if digest in _known_blobs}
+    missing = {digest: canonical for digest, canonical in zip(digests, canonicals) if digest not in ids}
+
+    new_bytes = 0
+    if missing:
+        found = dict(HeaderBlob.objects.filter(digest__in=missing).values_list("digest", "id"))
+        ids.update(found)
+        new_blobs = [make_blob(canonical, digest) for digest, canonical in missing.items() if digest not in found]
+        if new_blobs:
+            # another process may create the same blob at the same time, the conflict is ignored and the id read back
+            HeaderBlob.objects.bulk_create(new_blobs, ignore_conflicts=True)
+            new_bytes = sum(len(blob.data) for blob in new_blobs)
+            ids.update(HeaderBlob.objects.filter(digest__in=[blob.digest for blob in new_blobs]).values_list("digest", "id"))
+        # only remember the ids once they are committed, a rolled back blob must not be referenced later
+        transaction.on_commit(lambda: _remember_blobs({digest: ids[digest] for digest in missing}))
+
+    return [ids[digest] for digest in digests], new_bytes
+
+
+def _remember_blobs(blob_ids:dict[str, int]):
+    with _known_blobs_lock:
+        if len(_known_blobs) + len(blob_ids) > KNOWN_BLOBS_MAX_SIZE:
+            _known_blobs.clear()
+        _known_blobs.update(blob_ids)
@@ -0,0 +1,424 @@
+from django.conf import settings
+from django.db import close_old_connections, transaction, DatabaseError, IntegrityError
+from django.db.models import F, Value, Count, Min, Max
+from django.db.models.functions import Coalesce, Greatest
+from django.urls import reverse
+from django.template.loader import render_to_string
+from django.contrib.sites.models import Site
+
+from .models import Link, Tracker, ClickRollup
+from .outbox import enqueue_email
+from .headers import resolve_blobs
+from .metrics import metrics
+from .dimensions import DIMENSIONS
+from .hll import HyperLogLog, DEFAULT_PRECISION
+from . import geoip
+
+from asgiref.sync import sync_to_async
+from collections import deque
+from dataclasses import dataclass, asdict
+from threading import Thread, Condition, Lock
+import datetime
+import itertools
+import traceback
+import atexit
+import json
+import os
+import time
+
+# Ingestion of the clicks logged by the redirect view
+
+@dataclass
+class Click:
+    """
+    a click waiting to be stored as a tracker
+    """
+    link_id: int
+    notify: int  # effective notification mode of the link when it was clicked
+    date: datetime.datetime
+    ip: str
+    header: str  # canonical json, see headers.canonical_json
+    # see dimensions.click_dimensions, empty for the clicks spilled before they were extracted
+    referer_host: str = ""
+    ua_family: str = ""
+    ua_os: str = ""
+    language: str = ""
+    device: str = ""
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["date"] = self.date.isoformat()
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, line:str) -> "Click":
+        data = json.loads(line)
+        data["date"] = datetime.datetime.fromisoformat(data["date"])
+        return cls(**data)
+
+
+def record_click(click:Click):
+    """
+    store a click right away or queue it, depending on the CLICK_INGEST_MODE setting
+    """
+    if getattr(settings, "CLICK_INGEST_MODE", "sync") == "buffered":
+        click_buffer.put(click)
+    else:
+        store_clicks([click])
+
+
+async def arecord_click(click:Click):
+    """
+    async version of record_click, the database writes and the email rendering run in a worker thread
+    """
+    if getattr(settings, "CLICK_INGEST_MODE", "sync") == "buffered":
+        click_buffer.put(click)
+    else:
+        await sync_to_async(store_clicks)([click])
+
+
+def store_clicks(clicks:list[Click]) -> list[Tracker]:
+    """
+    write a batch of clicks and update the link counters in one transaction, then send the notifications they trigger
+    the clicks of the links deleted since they were queued are dropped, a failed notification doesn't fail the batch
+    returns the stored trackers, once this returns the clicks are committed and must not be stored again
+    """
+    # located before the transaction, the first lookup loads the database and must not hold the write lock meanwhile
+    locations = [geoip.locate(click.ip) for click in clicks]
+    with metrics.timer("shortview_click_phase_seconds", (("phase", "tracker_write"),)), transaction.atomic():
+        # the clicked links are locked until the commit, they can't be deleted before their trackers are written
+        sketches = dict(Link.objects.select_for_update().filter(id__in={click.link_id for click in clicks})
+                        .order_by("id").values_list("id", "visitors_sketch"))
+        kept = [index for index, click in enumerate(clicks) if click.link_id in sketches]
+        if len(kept) < len(clicks):
+            clicks, locations = [clicks[index] for index in kept], [locations[index] for index in kept]
+        blob_ids, _ = resolve_blobs([click.header for click in clicks])
+        trackers = Tracker.objects.bulk_create([Tracker(link_id=click.link_id, date=click.date, ip=click.ip, header_blob_id=blob_id,
+                                                        country=country, asn=asn, **{name: getattr(click, name) for name in DIMENSIONS})
+                                                for click, blob_id, (country, asn) in zip(clicks, blob_ids, locations)])
+        first_clicks = update_click_counters(trackers)
+        update_visitor_sketches(trackers, sketches)
+        update_rollups(trackers)
+        schedule_digests([tracker for click, tracker in zip(clicks, trackers) if click.notify == 4])
+
+    # if notify first click and it is, or always notify
+    notified = [tracker for click, tracker in zip(clicks, trackers)
+                if click.notify == 3 or (click.notify == 2 and tracker.id in first_clicks)]
+    if notified:
+        with metrics.timer("shortview_click_phase_seconds", (("phase", "notification_enqueue"),)):
+            for tracker in notified:
+                try:
+                    notify_click(tracker)
+                except Exception:
+                    # the clicks are already committed, the caller must not retry them for a lost email
+                    print(f"\n/!\\ Error while notifying the click {tracker.id}:\n{traceback.format_exc()}")
+    return trackers
+
+
+def update_click_counters(trackers:list[Tracker]) -> set[int]:
+    """
+    add new trackers to the click counters of their links, must run in the transaction that created the trackers
+    returns the ids of the trackers which are the first click of their link
+    """
+    by_link: dict[int, list[Tracker]] = {}
+    for tracker in trackers:
+        by_link.setdefault(tracker.link_id, []).append(tracker)
+
+    first_clicks = set()
+    for link_id, link_trackers in by_link.items():
+        first = min(link_trackers, key=lambda tracker: (tracker.date, tracker.id))
+        last_date = max(tracker.date for tracker in link_trackers)
+        # only one writer can move a link away from zero clicks, so the first click is detected without race
+        if Link.objects.filter(id=link_id, click_count=0).update(click_count=len(link_trackers),
+                                                                  first_click_at=first.date, last_click_at=last_date):
+            first_clicks.add(first.id)
+        else:
+            Link.objects.filter(id=link_id).update(click_count=F("click_count") + len(link_trackers),
+                                                   last_click_at=Greatest(Coalesce("last_click_at", Value(last_date)), Value(last_date)))
+    return first_clicks
+
+
+def update_visitor_sketches(trackers:list[Tracker], sketches:dict[int, bytes]):
+    """
+    add the addresses of new trackers to the visitor sketches of their links, must run in the transaction that created the trackers
+    the sketches must have been read with the links locked until the end of the transaction,
+    so that concurrent writers don't overwrite each other's sketch
+    """
+    ips_by_link: dict[int, set[str]] = {}
+    for tracker in trackers:
+        ips_by_link.setdefault(tracker.link_id, set()).add(tracker.ip)
+
+    precision = getattr(settings, "VISITOR_SKETCH_PRECISION", DEFAULT_PRECISION)
+    for link_id in ips_by_link:
+        sketch = HyperLogLog.from_bytes(sketches[link_id], precision)
+        if sketch.update(ips_by_link[link_id]):  # unchanged when the visitors were already counted
+            Link.objects.filter(id=link_id).update(visitors_sketch=sketch.to_bytes(), unique_visitors=sketch.count())
+
+
+def hour_bucket(date:datetime.datetime) -> datetime.datetime:
+    """
+    returns the start of the UTC hour of a date
+    """
+    return date.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def update_rollups(trackers:list[Tracker]):
+    """
+    add new trackers to the hourly rollups of their links, must run in the transaction that created the trackers
+    """
+    precision = getattr(settings, "ROLLUP_SKETCH_PRECISION", 10)
+    buckets: dict[tuple[int, datetime.datetime], list[Tracker]] = {}
+    for tracker in trackers:
+        buckets.setdefault((tracker.link_id, hour_bucket(tracker.date)), []).append(tracker)
+
+    for (link_id, bucket_start), bucket_trackers in buckets.items():
+        ips = {tracker.ip for tracker in bucket_trackers}
+        # the addresses which already clicked during this hour are not new visitors
+        known_ips = set(Tracker.objects.filter(link_id=link_id, date__gte=bucket_start, date__lt=bucket_start + datetime.timedelta(hours=1),
+                                               ip__in=ips).exclude(id__in=[tracker.id for tracker in bucket_trackers])
+                        .values_list("ip", flat=True).distinct())
+        count, unique_ips = len(bucket_trackers), len(ips - known_ips)
+
+        rollups = ClickRollup.objects.filter(link_id=link_id, bucket_start=bucket_start)
+        # visitors who already clicked during this hour are already in the sketch of the rollup
+        if not unique_ips and rollups.update(count=F("count") + count):
+            continue
+        sketch_data = rollups.select_for_update().values_list("visitors_sketch", flat=True).first()
+        if sketch_data is None:
+            sketch = HyperLogLog(precision)
+            sketch.update(ips)
+            try:
+                with transaction.atomic():
+                    ClickRollup.objects.create(link_id=link_id, bucket_start=bucket_start, count=count, unique_ips=unique_ips,
+                                               visitors_sketch=sketch.to_bytes())
+                continue
+            except IntegrityError:
+                # created by another writer in the meantime
+                sketch_data = rollups.select_for_update().values_list("visitors_sketch", flat=True).first()
+        sketch = HyperLogLog.from_bytes(sketch_data, precision)
+        sketch.update(ips)
+        rollups.update(count=F("count") + count, unique_ips=F("unique_ips") + unique_ips, visitors_sketch=sketch.to_bytes())
+
+
+def schedule_digests(trackers:list[Tracker]):
+    """
+    open a digest window for the clicked links which don't have one yet, the window starts with the first click in it
+    """
+    window = datetime.timedelta(minutes=getattr(settings, "NOTIFY_DIGEST_WINDOW", 60))
+    starts: dict[int, datetime.datetime] = {}
+    for tracker in trackers:
+        starts[tracker.link_id] = min(tracker.date, starts.get(tracker.link_id, tracker.date))
+    for link_id, since in starts.items():
+        Link.objects.filter(id=link_id, digest_due_at__isnull=True).update(digest_since=since, digest_due_at=since + window)
+
+
+def notify_click(tracker:Tracker):
+    """
+    send an email notification to the owner of the clicked link
+    """
+    link_object:Link = Link.objects.select_related("owner").get(id=tracker.link_id)
+    link_page = absolute_url("view_link", link_object.id)
+    tracker_page = absolute_url("view_tracker", link_object.id, tracker.id)
+    preferences_page = absolute_url("preferences")
+
+    text_content = render_to_string("shortview/emails/notify_click.txt",
+                                    context={"link": link_object, "tracker": tracker, "link_page": link_page,
+                                             "tracker_page": tracker_page, "preferences_page": preferences_page,
+                                             "mail_domain": settings.DOMAIN, "username": link_object.owner.username})
+    html_content = render_to_string("shortview/emails/notify_click.html",
+                                    context={"link": link_object, "tracker": tracker, "link_page": link_page,
+                                             "tracker_page": tracker_page, "preferences_page": preferences_page,
+                                             "mail_domain": settings.DOMAIN, "username": link_object.owner.username})
+    enqueue_email(f"ShortView | Your link was clicked | {link_object.description}",
+                  settings.DEFAULT_FROM_EMAIL, link_object.owner.email, text_content, html_content)
+
+
+def notify_digest(link_object:Link, since:datetime.datetime):
+    """
+    send one email summarizing the clicks of a link since a date, built with a single aggregate query
+    """
+    ips = list(Tracker.objects.filter(link=link_object, date__gte=since).values("ip")
+               .annotate(clicks=Count("id"), first=Min("date"), last=Max("date")).order_by("-clicks", "ip"))
+    if not ips:
+        return  # the clicks were deleted in the meantime
+    context = {"link": link_object, "clicks": sum(row["clicks"] for row in ips), "unique_ips": len(ips),
+               "top_ips": ips[:getattr(settings, "NOTIFY_DIGEST_TOP_IPS", 5)],
+               "first_click": min(row["first"] for row in ips), "last_click": max(row["last"] for row in ips),
+               "link_page": absolute_url("view_link", link_object.id), "preferences_page": absolute_url("preferences"),
+               "mail_domain": settings.DOMAIN, "username": link_object.owner.username}
+    text_content = render_to_string("shortview/emails/notify_digest.txt", context=context)
+    html_content = render_to_string("shortview/emails/notify_digest.html", context=context)
+    enqueue_email(f"ShortView | Your link was clicked {context['clicks']} times | {link_object.description}",
+                  settings.DEFAULT_FROM_EMAIL, link_object.owner.email, text_content, html_content)
+
+
+def absolute_url(name:str, *args) -> str:
+    """
+    returns the absolute url of a view, to be used in emails
+    """
+    domain = Site.objects.get_current().domain
+    scheme = "https" if getattr(settings, "SECURE_SSL_REDIRECT", False) else "http"
+    return f"{scheme}://{domain}{reverse(name, args=args)}"
+
+
+class ClickBuffer:
+    """
+    an in-memory write-behind queue of clicks, flushed to the database in batches by a background thread
+    when the queue is full, new clicks are either dropped and counted, or spilled to a file read back later
+    """
+    def __init__(self, batch_size:int=500, flush_interval:float=2, max_size:int=50000,
+                 overflow:str="drop", spill_path:str=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.counters = {"queued": 0, "stored": 0, "dropped": 0, "spilled": 0, "failed_flushes": 0}
+        self._queue: deque[Click] = deque()
+        self._condition = Condition()
+        self._replay_lock = Lock()  # the flusher thread and stop() must not replay the same spill file together
+        self._thread: Thread = None
+        self._stopping = False
+
+    def put(self, click:Click):
+        """
+        queue a click without waiting for the database
+        """
+        with self._condition:
+            self._start()
+            if len(self._queue) >= self.max_size:
+                if self.overflow == "spill" and self.spill_path:
+                    self._spill(click)
+                else:
+                    self.counters["dropped"] += 1
+                return
+            self._queue.append(click)
+            self.counters["queued"] += 1
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self) -> int:
+        """
+        write every queued and spilled click to the database, returns the number of stored clicks
+        """
+        stored = 0
+        while True:
+            with self._condition:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if not batch:
+                break
+            try:
+                trackers = store_clicks(batch)
+            except DatabaseError:
+                # nothing was committed, put the batch back in front of the queue to retry on the next flush
+                print(f"\n/!\\ Error while storing clicks:\n{traceback.format_exc()}")
+                with self._condition:
+                    self.counters["failed_flushes"] += 1
+                    self._queue.extendleft(reversed(batch))
+                break
+            stored += len(trackers)
+            with self._condition:
+                self.counters["stored"] += len(trackers)
+        stored += self._load_spilled()
+        return stored
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"size": len(self._queue), **self.counters}
+
+    def stop(self):
+        """
+        stop the background thread and flush what is left, called on shutdown
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 5)
+        self.flush()
+
+    def _start(self):
+        # start the flusher lazily, so that each forked worker process gets its own thread
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = Thread(target=self._run, name="click-flusher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._stopping:
+                    return
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"\n/!\\ Error in click flusher: {e}:\n{traceback.format_exc()}")
+
+    def _spill(self, click:Click):
+        # called with the lock held, so that concurrent writes to the file don't interleave
+        with open(self.spill_path, "a", encoding="utf-8") as file:
+            file.write(click.to_json() + "\n")
+        self.counters["spilled"] += 1
+
+    def _load_spilled(self) -> int:
+        if not self.spill_path:
+            return 0
+        # the lock of the queue isn't held while the clicks are stored, so that put() never waits for the database
+        with self._replay_lock:
+            loading_path = f"{self.spill_path}.loading"
+            progress_path = f"{loading_path}.offset"
+            with self._condition:
+                if not os.path.exists(loading_path):
+                    if not os.path.exists(self.spill_path):
+                        return 0
+                    if os.path.exists(progress_path):
+                        os.remove(progress_path)  # left by a replay which ended before removing it, the file it tracked is gone
+                    os.replace(self.spill_path, loading_path)  # new spills go to a fresh file while this one is loaded
+            stored = 0
+            with open(loading_path, "rb") as file:
+                file.seek(self._read_progress(progress_path))
+                while True:
+                    lines = [line for line in itertools.islice(file, self.batch_size) if line.strip()]
+                    if not lines:
+                        break
+                    trackers = store_clicks([Click.from_json(line.decode("utf-8")) for line in lines])
+                    # saved after each committed batch, so that a failure resumes after the stored clicks instead of storing them again
+                    self._save_progress(progress_path, file.tell())
+                    stored += len(trackers)
+                    with self._condition:
+                        self.counters["stored"] += len(trackers)
+            os.remove(loading_path)
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
+        return stored
+
+    @staticmethod
+    def _read_progress(progress_path:str) -> int:
+        try:
+            with open(progress_path, encoding="utf-8") as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @staticmethod
+    def _save_progress(progress_path:str, offset:int):
+        # replaced atomically, a crash leaves either the previous offset or the new one
+        with open(f"{progress_path}.tmp", "w", encoding="utf-8") as file:
+            file.write(str(offset))
+        os.replace(f"{progress_path}.tmp", progress_path)
+
+click_buffer = ClickBuffer(batch_size=getattr(settings, "CLICK_BUFFER_BATCH_SIZE", 500),
+                           flush_interval=getattr(settings, "CLICK_BUFFER_FLUSH_INTERVAL", 2),
+                           max_size=getattr(settings, "CLICK_BUFFER_MAX_SIZE", 50000),
+                           overflow=getattr(settings, "CLICK_BUFFER_OVERFLOW", "drop"),
+                           spill_path=getattr(settings, "CLICK_BUFFER_SPILL_PATH", None))
+atexit.register(click_buffer.stop)
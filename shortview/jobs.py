@@ -1,72 +1,216 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.db.models import Case, When, F, Q, Value
+from django.utils import timezone
 
-from .models import Profile
+from .models import Profile, Link, JobLease, JobRun
+from .ingest import notify_digest
+from .outbox import start_outbox_workers
+from .archive import archive_trackers
 
-from threading import Thread
+from threading import Thread, Event
+import datetime
 import os
+import socket
 import time
 import schedule
 import traceback
+import uuid
 
 # Job scheduling
 
-def jobs():
+LEASE_NAME = "jobs"
+
+
+def acquire_lease(holder:str, duration:float, name:str=LEASE_NAME) -> bool:
+    """
+    take or renew the lease of the jobs, returns whether the holder has it for the next duration seconds
+    the lease is taken with a conditional update, so only one worker holds it even across several servers
+    """
+    now = timezone.now()
+    JobLease.objects.get_or_create(name=name)
+    return bool(JobLease.objects.filter(Q(holder=holder) | Q(expires_at__isnull=True) | Q(expires_at__lt=now), name=name).update(
+        holder=holder, expires_at=now + datetime.timedelta(seconds=duration),
+        acquired_at=Case(When(holder=holder, then=F("acquired_at")), default=Value(now))))
+
+
+def release_lease(holder:str, name:str=LEASE_NAME):
+    """
+    give the lease back, so that another worker takes over without waiting for it to expire
+    """
+    JobLease.objects.filter(name=name, holder=holder).update(holder="", expires_at=None)
+
+
+def record_run(name:str, holder:str, started_at:datetime.datetime, duration:float, rows:int, error:str=""):
+    """
+    store the statistics of the last run of a job
+    """
+    JobRun.objects.get_or_create(name=name)
+    JobRun.objects.filter(name=name).update(holder=holder, last_started_at=started_at, last_duration=duration,
+                                            last_rows=rows, last_error=error, runs=F("runs") + 1,
+                                            failures=F("failures") + (1 if error else 0))
+
+
+class JobRunner:
     """
-    background job scheduler that runs scheduled tasks in threads
+    runs the background jobs while holding the lease, the other runners wait for it to be released or to expire
+    each run of a job handles at most batch_size rows, the rest is left to the next run,
+    so that a run always ends well before the lease expires and runs never pile up
     """
-    schedule.every(1).minutes.do(check_profiles)
-    schedule.every(1).minutes.do(delete_expired_links)
+    def __init__(self, interval:float=60, batch_size:int=1000, lease_duration:float=120, holder:str=None):
+        self.batch_size = batch_size
+        self.lease_duration = lease_duration
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.scheduler = schedule.Scheduler()
+        for name, job in JOBS.items():
+            self.scheduler.every(interval).seconds.do(self.run_job, name, job)
+        self._stop = Event()
 
-    while True:
+    def run_job(self, name:str, job) -> int:
+        """
+        run one batch of a job if the lease is still held, and record how it went
+        """
+        if not acquire_lease(self.holder, self.lease_duration):
+            return 0  # another runner took over
+        started_at = timezone.now()
+        start = time.perf_counter()
+        rows, error = 0, ""
         try:
-            schedule.run_pending()
+            rows = job(limit=self.batch_size)
         except Exception as e:
-            print(f"\n/!\\ Error in job scheduler: {e}:\n{traceback.format_exc()}")
+            error = f"{type(e).__name__}: {e}"
+            print(f"\n/!\\ Error in job {name}: {e}:\n{traceback.format_exc()}")
+        record_run(name, self.holder, started_at, time.perf_counter() - start, rows, error)
+        return rows
+
+    def run_all(self) -> bool:
+        """
+        run every job once, returns False if the lease is held by another runner
+        """
+        if not acquire_lease(self.holder, self.lease_duration):
+            return False
+        self.scheduler.run_all()
+        return True
+
+    def run(self):
+        """
+        run the jobs when they are due until stop is called, then release the lease
+        """
+        self._stop.clear()
+        try:
+            while not self._stop.is_set():
+                close_old_connections()
+                try:
+                    if acquire_lease(self.holder, self.lease_duration):
+                        self.scheduler.run_pending()
+                except Exception as e:
+                    print(f"\n/!\\ Error in job scheduler: {e}:\n{traceback.format_exc()}")
+                self._stop.wait(1)
         finally:
-            time.sleep(1)
+            try:
+                release_lease(self.holder)
+            except Exception as e:
+                print(f"\n/!\\ Could not release the jobs lease: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def job_runner() -> JobRunner:
+    """
+    a job runner configured from the settings
+    """
+    return JobRunner(interval=getattr(settings, "JOB_INTERVAL", 60),
+                     batch_size=getattr(settings, "JOB_BATCH_SIZE", 1000),
+                     lease_duration=getattr(settings, "JOB_LEASE_DURATION", 120))
 
 
 def start_job_scheduler():
     """
-    start the job scheduler in a daemon thread when the django app starts
+    start the job runner in a daemon thread with the development server,
+    in production the jobs are run by the runjobs command
     """
     if os.environ.get("RUN_MAIN") != "true":
         return  # prevent starting the scheduler multiple times in development
         
-    job_thread = Thread(target=jobs)
+    job_thread = Thread(target=job_runner().run)
     job_thread.daemon = True  # avoid blocking shutdown
     job_thread.start()
+    start_outbox_workers()
 
 
 # Job workers
 
-def check_profiles(user:User=None):
+def check_profiles(user:User=None, limit:int=None) -> int:
     """
-    make sure that each user has a profile
+    make sure that each user has a profile, new users get theirs from signals.create_profile
+    returns the number of created profiles, at most limit
     """
+    missing = User.objects.filter(profile__isnull=True)
     if user is not None:
-        affected_users = [user]
-    else:
-        affected_users = [affected for affected in User.objects.all()]
-    
-    for affected in affected_users:
-        if not hasattr(affected, "profile"):
-            profile = Profile(user=affected)
-            profile.save()
+        missing = missing.filter(id=user.id)
+    user_ids = list(missing.values_list("id", flat=True)[:limit])
+    Profile.objects.bulk_create([Profile(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+    return len(user_ids)
 
 
-def delete_expired_links(user:User=None):
+def delete_expired_links(user:User=None, chunk_size:int=500, limit:int=None) -> int:
     """
-    depending on the user preferences, deletes expired links
+    depending on the user preferences, deletes expired links, in chunks to keep the transactions short
+    returns the number of deleted links, at most limit
     """
+    expired = Link.objects.expired().filter(owner__profile__delete_expired=True)
     if user is not None:
-        if not user.profile.delete_expired:
-            return  # don't delete anything if the user doesn't want to
-        affected_users = [user]
-    else:
-        affected_users = [affected for affected in User.objects.all() if affected.profile.delete_expired]
-    
-    for affected in affected_users:
-        links = [link for link in affected.link_set.all() if not link.active()]
-        for link in links:
-            link.delete()
+        expired = expired.filter(owner=user)
+
+    deleted = 0
+    while limit is None or deleted < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - deleted)
+        chunk = list(expired.values_list("id", flat=True)[:size])
+        if not chunk:
+            return deleted
+        Link.objects.filter(id__in=chunk).delete()
+        deleted += len(chunk)
+    return deleted
+
+
+def throttled_delete_expired_links(user:User) -> int:
+    """
+    delete the expired links of a user if it wasn't done in the last EXPIRED_CLEANUP_INTERVAL minutes
+    the date of the last run is kept in the cache, so that the cleanup isn't paid on every page load
+    """
+    interval = getattr(settings, "EXPIRED_CLEANUP_INTERVAL", 5) * 60
+    if not cache.add(f"shortview:expired_cleanup:{user.id}", timezone.now().timestamp(), timeout=interval):
+        return 0  # already done recently
+    return delete_expired_links(user)
+
+
+def send_click_digests(limit:int=None) -> int:
+    """
+    send the click digests whose window is over, the oldest first
+    returns the number of sent digests, at most limit
+    """
+    now = timezone.now()
+    sent = 0
+    for link_id in Link.objects.filter(digest_due_at__lte=now).order_by("digest_due_at").values_list("id", flat=True)[:limit]:
+        with transaction.atomic():
+            # the link stays locked from the read of its clicks to the claim, so a click stored meanwhile waits for the claim
+            # and opens the next window, instead of being missed by this digest without opening any
+            link = (Link.objects.select_for_update(of=("self",)).select_related("owner")
+                    .filter(id=link_id, digest_due_at__lte=now).first())
+            if link is None:
+                continue  # already sent by another runner
+            notify_digest(link, link.digest_since)
+            Link.objects.filter(id=link.id).update(digest_since=None, digest_due_at=None)
+        sent += 1
+    return sent
+
+# the jobs run by JobRunner, each one is called with a limit of rows to handle and returns the number handled
+JOBS = {
+    "check_profiles": check_profiles,
+    "delete_expired_links": delete_expired_links,
+    "send_click_digests": send_click_digests,
+    "archive_trackers": archive_trackers,
+}
@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import Link
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+import datetime
+import time
+
+# In-process cache of the links resolved by the redirect view
+
+@dataclass(frozen=True)
+class LinkRecord:
+    """
+    a compact, read-only copy of the link fields needed to serve a click
+    """
+    id: int
+    destination: str
+    date: datetime.datetime
+    expires_at: datetime.datetime | None
+    owner_id: int
+    notify: int  # effective notification mode, with the owner's default already applied
+
+    def active(self) -> bool:
+        """
+        same rule as Link.active, evaluated on the cached fields
+        """
+        if self.expires_at is None:
+            return True
+        now = timezone.now()
+        return self.expires_at >= now and self.date <= now
+
+
+def record_from_link(link:Link) -> LinkRecord:
+    """
+    build a cache record from a link loaded with its owner and profile
+    """
+    notify = link.notify_click
+    if notify == 0:  # using default preference
+        try:
+            notify = link.owner.profile.default_notify_click
+        except ObjectDoesNotExist:
+            notify = 1  # the profile will be created later, its default is to never notify
+    return LinkRecord(id=link.id, destination=link.destination, date=link.date, expires_at=link.expires_at,
+                      owner_id=link.owner_id, notify=notify)
+
+
+class LinkCache:
+    """
+    a bounded LRU cache with a time to live, mapping link ids to LinkRecord objects
+    entries are filled lazily and invalidated by the model signals of this process,
+    the time to live bounds how long other processes may serve a stale record
+    """
+    def __init__(self, max_size:int=10000, ttl:float=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[float, LinkRecord]] = OrderedDict()
+        self._lock = Lock()
+
+    def _query(self):
+        return Link.objects.select_related("owner__profile").only(
+            "id", "destination", "date", "expires_at", "notify_click", "owner__id", "owner__profile__default_notify_click")
+
+    def get(self, link_id:int) -> LinkRecord | None:
+        """
+        return the record of a link, loading it from the database on a miss, None if the link doesn't exist
+        """
+        record = self._lookup(link_id)
+        if record is not None:
+            return record
+        try:
+            link = self._query().get(id=link_id)
+        except Link.DoesNotExist:
+            return None
+        record = record_from_link(link)
+        self.put(record)
+        return record
+
+    async def aget(self, link_id:int) -> LinkRecord | None:
+        """
+        async version of get, for the async redirect view
+        """
+        record = self._lookup(link_id)
+        if record is not None:
+            return record
+        try:
+            link = await self._query().aget(id=link_id)
+        except Link.DoesNotExist:
+            return None
+        record = record_from_link(link)
+        self.put(record)
+        return record
+
+    def _lookup(self, link_id:int) -> LinkRecord | None:
+        # look for a fresh entry and count the hit or miss, never touches the database
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(link_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(link_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def put(self, record:LinkRecord):
+        """
+        store a record, evicting the least recently used entries if the cache is full
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[record.id] = (time.monotonic() + self.ttl, record)
+            self._entries.move_to_end(record.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, link_id:int):
+        """
+        drop a single link from the cache
+        """
+        with self._lock:
+            self._entries.pop(link_id, None)
+
+    def invalidate_owner(self, owner_id:int):
+        """
+        drop every cached link of a user, used when the user preferences change
+        """
+        with self._lock:
+            for link_id in [link_id for link_id, (_, record) in self._entries.items() if record.owner_id == owner_id]:
+                del self._entries[link_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def warm(self, limit:int=None) -> int:
+        """
+        preload the most recent links, returns the number of loaded links
+        """
+        limit = self.max_size if limit is None else min(limit, self.max_size)
+        if limit <= 0:
+            return 0
+        loaded = 0
+        for link in self._query().order_by("-date")[:limit]:
+            self.put(record_from_link(link))
+            loaded += 1
+        return loaded
+
+    def stats(self) -> dict:
+        """
+        counters used to size the cache
+        """
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {"size": size, "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0}
+
+
+link_cache = LinkCache(max_size=getattr(settings, "LINK_CACHE_SIZE", 10000),
+                       ttl=getattr(settings, "LINK_CACHE_TTL", 300))
+
+
+def warm_link_cache():
+    """
+    warm the cache at startup if enabled in the settings, never blocks the startup on a database error
+    """
+    if not getattr(settings, "LINK_CACHE_WARM", False):
+        return
+    try:
+        link_cache.warm()
+    except DatabaseError as e:
+        print(f"\n/!\\ Could not warm the link cache: {e}")
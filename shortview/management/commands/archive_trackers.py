@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortview.archive import archive_trackers, archive_directory
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Move the trackers older than their retention to the compressed monthly archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=getattr(settings, "TRACKER_ARCHIVE_CHUNK_SIZE", 5000),
+                            help="number of trackers archived and deleted per transaction")
+        parser.add_argument("--limit", type=int, default=None, help="maximum number of trackers to archive")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        archived = archive_trackers(limit=options["limit"], chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} trackers to {archive_directory()} "
+                                             f"in {time.perf_counter() - start:.1f} s"))
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+
+from shortview.agents import AgentFilter, DEFAULT_PREVIEW_AGENTS
+
+import json
+import random
+import time
+
+
+BROWSER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36",
+]
+
+BOT_AGENTS = [
+    "WhatsApp/2.23.20.0",
+    "Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)",
+    "Twitterbot/1.0",
+    "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+]
+
+
+def legacy_is_preview_agent(user_agent:str) -> bool:
+    # the check done by the redirect view before the compiled filter
+    agents_blacklist = ["whatsapp", "discord", "slack"]
+    return any([agent.lower() in user_agent.lower() for agent in agents_blacklist])
+
+
+class Command(BaseCommand):
+    help = "Compare the compiled preview agent filter, with a cold and a warm cache, to the former substring list"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200000, help="number of classified user agents")
+        parser.add_argument("--distinct", type=int, default=2000, help="number of distinct user agents in the traffic")
+        parser.add_argument("--json", action="store_true", help="print the results as json")
+
+    def handle(self, *args, **options):
+        # a realistic traffic: a few thousand distinct user agents, mostly browsers differing by their version
+        rng = random.Random(0)
+        distinct = [rng.choice(BROWSER_AGENTS).replace("537.36", f"537.{index}") if rng.random() < 0.9
+                    else f"{rng.choice(BOT_AGENTS)} {index}" for index in range(options["distinct"])]
+        traffic = [rng.choice(distinct) for _ in range(options["requests"])]
+
+        results = {"legacy": self.measure(legacy_is_preview_agent, traffic)}
+        uncached = AgentFilter(DEFAULT_PREVIEW_AGENTS, cache_size=0)
+        results["compiled_cold"] = self.measure(uncached.classify, traffic)
+        cached = AgentFilter(DEFAULT_PREVIEW_AGENTS)
+        self.measure(cached.classify, distinct)
+        results["compiled_warm"] = self.measure(cached.classify, traffic)
+        results["compiled_warm"]["cache"] = cached.stats()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(f"{name}: {result['ns_per_call']:.0f} ns per user agent, {result['filtered']} filtered")
+
+    def measure(self, classify, traffic:list[str]) -> dict:
+        start = time.perf_counter()
+        filtered = sum(1 for user_agent in traffic if classify(user_agent))
+        elapsed = time.perf_counter() - start
+        return {"calls": len(traffic), "filtered": filtered, "total_s": elapsed, "ns_per_call": elapsed / len(traffic) * 1e9}
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, connections, OperationalError
+from django.utils import timezone
+
+from shortview.bench import benchmark_database, summarize, format_summary
+from shortview.headers import canonical_json
+from shortview.ingest import Click, store_clicks
+from shortview.models import Link
+
+from threading import Barrier, Thread
+import json
+import time
+
+# the SQLite defaults of Django, before the tuning of SQLITE_PRAGMAS
+DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": 5000}
+DEFAULT_OPTIONS = {}
+
+
+class Command(BaseCommand):
+    help = "Measure the click write throughput of concurrent writers with the default and the tuned database settings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8, help="number of threads storing clicks concurrently")
+        parser.add_argument("--clicks", type=int, default=300, help="number of clicks stored by each writer")
+        parser.add_argument("--json", action="store_true", help="print the results as json")
+
+    def handle(self, *args, **options):
+        database = settings.DATABASES["default"]
+        tuned_pragmas = dict(getattr(settings, "SQLITE_PRAGMAS", {}))
+        tuned_options = dict(database.get("OPTIONS", {}))
+        profiles = {"default": (DEFAULT_PRAGMAS, DEFAULT_OPTIONS), "tuned": (tuned_pragmas, tuned_options)}
+        if connection.vendor != "sqlite":
+            profiles = {"current": (tuned_pragmas, tuned_options)}  # the pragmas only apply to SQLite
+
+        results = {}
+        with benchmark_database():
+            user = User.objects.create_user("bench", "bench@example.com", "bench")
+            link = Link.objects.create(owner=user, date=timezone.now(), destination="https://example.com/")
+            for name, (pragmas, database_options) in profiles.items():
+                settings.SQLITE_PRAGMAS = pragmas
+                database["OPTIONS"] = database_options
+                connections.close_all()  # the next connections are opened with the settings of this profile
+                results[name] = self.run_writers(link, options["writers"], options["clicks"])
+            settings.SQLITE_PRAGMAS = tuned_pragmas
+            database["OPTIONS"] = tuned_options
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(format_summary(f"{name} settings", result) + f", {result['errors']} failed writes")
+
+    def run_writers(self, link:Link, writers:int, clicks:int) -> dict:
+        durations = []
+        errors = []
+        barrier = Barrier(writers)
+        header = canonical_json({"User-Agent": "Mozilla/5.0 (bench)"})
+
+        def write(index:int):
+            barrier.wait()  # all the writers start together
+            for number in range(clicks):
+                start = time.perf_counter()
+                try:
+                    store_clicks([Click(link_id=link.id, notify=1, date=timezone.now(),
+                                        ip=f"10.0.{index}.{number % 256}", header=header)])
+                except OperationalError as e:
+                    errors.append(str(e))
+                else:
+                    durations.append(time.perf_counter() - start)
+            connections.close_all()
+
+        threads = [Thread(target=write, args=(index,)) for index in range(writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        summary = summarize(durations, time.perf_counter() - start)
+        summary["errors"] = len(errors)
+        return summary
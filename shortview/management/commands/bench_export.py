@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from shortview.bench import benchmark_database
+from shortview.headers import canonical_json, resolve_blobs
+from shortview.models import Link, Tracker
+
+import datetime
+import resource
+import tracemalloc
+import json
+import time
+
+
+class Command(BaseCommand):
+    help = "Measure the time to first byte and the memory used when exporting the clicks of a large link"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trackers", type=int, default=200000, help="number of clicks of the exported link")
+        parser.add_argument("--json", action="store_true", help="print the results as json")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user = User.objects.create_user("bench", "bench@example.com", "bench")
+            link = Link.objects.create(owner=user, date=timezone.now())
+            self.seed_trackers(link, options["trackers"])
+
+            client = Client()
+            client.force_login(user)
+            results = {}
+            for name, query in [("csv", "format=csv"), ("ndjson_headers", "format=ndjson&headers=1"),
+                                ("csv_headers_gzip", "format=csv&headers=1&gzip=1")]:
+                results[name] = self.measure(client, f"{reverse('export_link', args=[link.id])}?{query}")
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(f"{name}: {result['bytes']} bytes in {result['total_s']:.2f} s, "
+                              f"first byte after {result['ttfb_ms']:.1f} ms, "
+                              f"peak python memory {result['peak_python_mb']:.1f} MB, peak RSS {result['peak_rss_mb']:.1f} MB")
+
+    def seed_trackers(self, link:Link, count:int, batch_size:int=5000):
+        headers = [canonical_json({"User-Agent": f"Mozilla/5.0 (bench {index})", "Accept-Language": "fr-FR,fr;q=0.9"})
+                   for index in range(20)]
+        blob_ids, _ = resolve_blobs(headers)
+        start = timezone.now() - datetime.timedelta(seconds=count)
+        for offset in range(0, count, batch_size):
+            Tracker.objects.bulk_create([Tracker(link=link, date=start + datetime.timedelta(seconds=index),
+                                                 ip=f"10.0.{index // 256 % 256}.{index % 256}",
+                                                 header_blob_id=blob_ids[index % len(blob_ids)])
+                                         for index in range(offset, min(count, offset + batch_size))])
+
+    def measure(self, client:Client, url:str) -> dict:
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = client.get(url)
+        ttfb = None
+        size = 0
+        for chunk in response.streaming_content:
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+        total = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"bytes": size, "ttfb_ms": (ttfb or 0) * 1000, "total_s": total,
+                "peak_python_mb": peak / 2 ** 20,
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}  # kilobytes on Linux
@@ -0,0 +1,115 @@
+from django.core.management.base import BaseCommand
+
+from shortview.geoip import GeoDatabase
+
+from functools import lru_cache
+import ipaddress
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def resident_memory() -> int | None:
+    """
+    the resident memory of the whole process in bytes, None where /proc isn't available
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Measure the loading time, the memory and the lookups per second of the geolocation database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", help="database file to measure, a synthetic one of the size of the public "
+                                               "ip2asn file is generated by default")
+        parser.add_argument("--ranges", type=int, default=500000, help="number of IPv4 ranges of the synthetic database")
+        parser.add_argument("--lookups", type=int, default=200000, help="number of located addresses")
+        parser.add_argument("--distinct", type=int, default=20000, help="number of distinct addresses in the traffic")
+        parser.add_argument("--json", action="store_true", help="print the results as json")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        path = options["database"]
+        generated = path is None
+        if generated:
+            path = self.generate(rng, options["ranges"])
+        try:
+            start = time.perf_counter()
+            geo_database = GeoDatabase(path, cache_size=0)
+            results = {"load_s": time.perf_counter() - start}
+            # loaded again to trace the memory, which slows the loading down
+            del geo_database
+            tracemalloc.start()
+            geo_database = GeoDatabase(path, cache_size=0)
+            results["retained_bytes"], results["peak_bytes"] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            if generated:
+                os.remove(path)
+
+        tables = geo_database.tables.values()
+        results["ranges"] = sum(len(table) for table in tables)
+        results["table_bytes"] = sum(sys.getsizeof(values) for table in tables
+                                     for values in (table.starts, table.ends, table.countries, table.asns))
+        results["resident_bytes"] = resident_memory()
+
+        # mostly IPv4 traffic from a few thousand visitors
+        distinct = [str(ipaddress.IPv4Address(rng.getrandbits(32))) if rng.random() < 0.8
+                    else str(ipaddress.IPv6Address((0x2000 << 112) | rng.getrandbits(112))) for _ in range(options["distinct"])]
+        traffic = [rng.choice(distinct) for _ in range(options["lookups"])]
+        results["cold"] = self.measure(geo_database._locate_uncached, traffic)
+        locate = lru_cache(maxsize=len(distinct))(geo_database._locate_uncached)  # same cache as GeoDatabase.locate
+        self.measure(locate, distinct)
+        results["warm"] = self.measure(locate, traffic)
+        results["warm"]["cache"] = locate.cache_info()._asdict()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        resident = f"{results['resident_bytes'] / 2**20:.1f} MiB" if results["resident_bytes"] is not None else "unknown"
+        self.stdout.write(f"loaded {results['ranges']} ranges in {results['load_s']:.2f} s: {results['table_bytes'] / 2**20:.1f} MiB "
+                          f"of tables, {results['retained_bytes'] / 2**20:.1f} MiB retained, {results['peak_bytes'] / 2**20:.1f} MiB "
+                          f"at the peak of the loading, {resident} resident for the whole process")
+        for name in ("cold", "warm"):
+            result = results[name]
+            self.stdout.write(f"{name}: {result['lookups_per_s']:.0f} lookups per second, {result['ns_per_lookup']:.0f} ns per lookup, "
+                              f"{result['located']} located")
+
+    def generate(self, rng:random.Random, count:int) -> str:
+        """
+        write a database of contiguous IPv4 ranges, and of IPv6 ranges a third as many, in the ip2asn format
+        """
+        countries = ["US", "CN", "DE", "FR", "GB", "JP", "BR", "IN", "RU", "NL", "CA", "AU", "KR", "IT", "ES"]
+        file, path = tempfile.mkstemp(suffix=".tsv")
+        with os.fdopen(file, "w", encoding="utf-8") as output:
+            for version, bits, ranges in ((4, 32, count), (6, 48, count // 3)):
+                # the IPv6 ranges are /48 blocks at least, in the 2000::/3 space
+                bounds = sorted(rng.sample(range(1, 2 ** (bits - 3)), ranges - 1))
+                start = 0
+                for end in bounds + [2 ** (bits - 3)]:
+                    first, last = start, end - 1
+                    if version == 4:
+                        first_ip, last_ip = ipaddress.IPv4Address(first << 3), ipaddress.IPv4Address((last << 3) | 7)
+                    else:
+                        first_ip = ipaddress.IPv6Address((0x2000 << 112) | (first << 80))
+                        last_ip = ipaddress.IPv6Address((0x2000 << 112) | (last << 80) | (2 ** 80 - 1))
+                    asn = rng.randrange(1, 400000) if rng.random() < 0.9 else 0
+                    country = rng.choice(countries) if asn else "None"
+                    output.write(f"{first_ip}\t{last_ip}\t{asn}\t{country}\tAS{asn}\n")
+                    start = end
+        return path
+
+    def measure(self, locate, traffic:list[str]) -> dict:
+        start = time.perf_counter()
+        located = sum(1 for ip in traffic if locate(ip)[1] is not None)
+        elapsed = time.perf_counter() - start
+        return {"lookups": len(traffic), "located": located, "total_s": elapsed,
+                "lookups_per_s": len(traffic) / elapsed, "ns_per_lookup": elapsed / len(traffic) * 1e9}
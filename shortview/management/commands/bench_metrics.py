@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from shortview.bench import benchmark_database, summarize
+from shortview.linkcache import link_cache
+from shortview.metrics import Metrics
+from shortview.models import Link
+
+import json
+import time
+
+
+class Command(BaseCommand):
+    help = "Measure the overhead of the metrics middleware on the redirect and the home page"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000, help="number of requests per page and configuration")
+        parser.add_argument("--json", action="store_true", help="print the results as json")
+
+    def handle(self, *args, **options):
+        results = {"record_ns": self.measure_record()}
+        without_metrics = [name for name in settings.MIDDLEWARE if name != "shortview.metrics.MetricsMiddleware"]
+        with benchmark_database():
+            user = User.objects.create_user("bench", "bench@example.com", "bench")
+            link = Link.objects.create(owner=user, date=timezone.now(), destination="https://example.com/")
+            pages = {"redirect": (None, reverse("redirect_link", args=[link.id])), "index": (user, reverse("index"))}
+            for page, (page_user, url) in pages.items():
+                # alternate the configurations so that a slowdown of the machine affects both
+                durations = {"without": [], "with": []}
+                for _ in range(5):
+                    with override_settings(MIDDLEWARE=without_metrics):
+                        durations["without"] += self.run(page_user, url, options["requests"] // 5)
+                    durations["with"] += self.run(page_user, url, options["requests"] // 5)
+                without = summarize(durations["without"], sum(durations["without"]))
+                with_metrics = summarize(durations["with"], sum(durations["with"]))
+                results[page] = {"without_ms": without["mean_ms"], "with_ms": with_metrics["mean_ms"],
+                                 "overhead_us": (with_metrics["mean_ms"] - without["mean_ms"]) * 1000,
+                                 "overhead_pct": (with_metrics["mean_ms"] / without["mean_ms"] - 1) * 100}
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"recording a request: {results['record_ns']:.0f} ns")
+        for page in ("redirect", "index"):
+            result = results[page]
+            self.stdout.write(f"{page}: {result['without_ms']:.3f} ms without the middleware, {result['with_ms']:.3f} ms with it, "
+                              f"overhead {result['overhead_us']:.0f} us ({result['overhead_pct']:.1f}%)")
+
+    def measure_record(self, count:int=200000) -> float:
+        """
+        nanoseconds taken to record a request, a histogram observation and three counters
+        """
+        metrics = Metrics()
+        labels = (("view", "redirect_link"),)
+        status = labels + (("status", "3xx"),)
+        start = time.perf_counter()
+        for index in range(count):
+            metrics.observe("duration", labels, 0.003)
+            metrics.inc("requests", status)
+            metrics.inc("queries", labels, 3)
+            metrics.inc("query_seconds", labels, 0.001)
+        return (time.perf_counter() - start) / count * 1e9
+
+    def run(self, user:User, url:str, count:int) -> list[float]:
+        client = Client(headers={"User-Agent": "Mozilla/5.0 (bench)"})
+        if user is not None:
+            client.force_login(user)
+        link_cache.clear()
+        client.get(url)  # warm up
+        durations = []
+        for _ in range(count):
+            start = time.perf_counter()
+            client.get(url)
+            durations.append(time.perf_counter() - start)
+        return durations
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.test import Client, AsyncClient, override_settings
+from django.urls import path, include
+from django.utils import timezone
+
+from shortview import views
+from shortview.bench import benchmark_database, summarize, format_summary
+from shortview.linkcache import link_cache
+from shortview.models import Link
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import time
+
+
+class AsyncRedirectUrls:
+    """
+    the project urls, with the redirect served by the async view like with ASYNC_REDIRECT enabled
+    """
+    urlpatterns = [
+        path("<int:link_id>/", views.aredirect_link, name="redirect_link"),
+        path("", include("website.urls")),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compare the redirect throughput and latency of the WSGI (sync view) and ASGI (async view) handlers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000, help="number of clicks per run")
+        parser.add_argument("--concurrency", type=int, default=50, help="number of clicks in flight")
+        parser.add_argument("--links", type=int, default=100, help="number of links clicked in turn")
+        parser.add_argument("--json", action="store_true", help="print the results as json")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user = User.objects.create_user("bench", "bench@example.com", "bench")
+            links = Link.objects.bulk_create([Link(owner=user, date=timezone.now(), destination="https://example.com/")
+                                              for _ in range(options["links"])])
+            paths = [f"/{links[i % len(links)].id}/" for i in range(options["requests"])]
+
+            link_cache.clear()
+            wsgi = self.run_wsgi(paths, options["concurrency"])
+            link_cache.clear()
+            with override_settings(ROOT_URLCONF=AsyncRedirectUrls):
+                asgi = asyncio.run(self.run_asgi(paths, options["concurrency"]))
+
+        results = {"wsgi": wsgi, "asgi": asgi}
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(format_summary("WSGI, sync view", wsgi))
+            self.stdout.write(format_summary("ASGI, async view", asgi))
+
+    def run_wsgi(self, paths:list[str], concurrency:int) -> dict:
+        def click(path:str) -> float:
+            start = time.perf_counter()
+            Client().get(path, headers={"User-Agent": "Mozilla/5.0 (bench)"})
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            durations = list(executor.map(click, paths))
+        return summarize(durations, time.perf_counter() - start)
+
+    async def run_asgi(self, paths:list[str], concurrency:int) -> dict:
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def click(path:str) -> float:
+            async with semaphore:
+                start = time.perf_counter()
+                await client.get(path, headers={"User-Agent": "Mozilla/5.0 (bench)"})
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        durations = await asyncio.gather(*[click(path) for path in paths])
+        return summarize(list(durations), time.perf_counter() - start)
@@ -0,0 +1,179 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from shortview.bench import benchmark_database, summarize, format_summary
+from shortview.headers import canonical_json, resolve_blobs
+from shortview.linkcache import link_cache
+from shortview.models import Profile, Link, Tracker
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import local
+import datetime
+import json
+import random
+import time
+
+SCENARIOS = ["redirect", "index", "view_link", "view_tracker"]
+BROWSER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0"
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway database and measure the throughput, latency percentiles and queries per request "
+            "of the redirect and dashboard pages")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--links-per-user", type=int, default=20)
+        parser.add_argument("--trackers-per-link", type=int, default=100)
+        parser.add_argument("--requests", type=int, default=500, help="number of requests per scenario")
+        parser.add_argument("--concurrency", type=int, default=8, help="number of requests in flight")
+        parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument("--seed", type=int, default=0, help="seed of the random choice of the requested pages")
+        parser.add_argument("--json", action="store_true", help="print the report as json")
+        parser.add_argument("--output", help="also write the json report to this file")
+        parser.add_argument("--compare", help="json report of a previous run, fail if a scenario regressed")
+        parser.add_argument("--tolerance", type=float, default=20,
+                            help="percentage of p95 latency increase tolerated by --compare")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as file:
+                baseline = json.load(file)
+
+        rng = random.Random(options["seed"])
+        with benchmark_database():
+            start = time.perf_counter()
+            dataset = self.seed(options["users"], options["links_per_user"], options["trackers_per_link"])
+            seed_seconds = time.perf_counter() - start
+
+            report = {"dataset": {"users": options["users"], "links_per_user": options["links_per_user"],
+                                  "trackers_per_link": options["trackers_per_link"], "seed_seconds": seed_seconds},
+                      "concurrency": options["concurrency"], "scenarios": {}}
+            for scenario in options["scenarios"]:
+                link_cache.clear()
+                requests = [self.make_request(scenario, dataset, rng) for _ in range(options["requests"])]
+                report["scenarios"][scenario] = self.run(requests, options["concurrency"])
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            for scenario, summary in report["scenarios"].items():
+                self.stdout.write(format_summary(scenario, summary)
+                                  + f", {summary['queries_per_request']:.1f} queries per request, {summary['errors']} errors")
+        if baseline is not None:
+            self.compare(baseline, report, options["tolerance"])
+
+    def seed(self, users:int, links_per_user:int, trackers_per_link:int, batch_size:int=5000) -> dict:
+        """
+        create the dataset with bulk inserts, returns the ids of the users, of their links and of some trackers
+        """
+        password = make_password("bench")
+        user_objects = User.objects.bulk_create([User(username=f"bench{index}", email=f"bench{index}@example.com",
+                                                      password=password) for index in range(users)])
+        Profile.objects.bulk_create([Profile(user=user) for user in user_objects])
+
+        now = timezone.now()
+        links = Link.objects.bulk_create([Link(owner=user, description=f"link {index}", destination="https://example.com/",
+                                               date=now - datetime.timedelta(hours=index), click_count=trackers_per_link)
+                                          for user in user_objects for index in range(links_per_user)])
+
+        blob_ids, _ = resolve_blobs([canonical_json({"User-Agent": f"Mozilla/5.0 (bench {index})", "Accept-Language": "en"})
+                                     for index in range(20)])
+        trackers = (Tracker(link=link, ip=f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+                            date=now - datetime.timedelta(minutes=index), header_blob_id=blob_ids[index % len(blob_ids)])
+                    for link in links for index in range(trackers_per_link))
+        batch = []
+        for tracker in trackers:
+            batch.append(tracker)
+            if len(batch) >= batch_size:
+                Tracker.objects.bulk_create(batch)
+                batch = []
+        Tracker.objects.bulk_create(batch)
+
+        links_by_user = {user.id: [link.id for link in links if link.owner_id == user.id] for user in user_objects}
+        sample_trackers = {}
+        for link_id, tracker_id in Tracker.objects.filter(link__in=links).order_by("link", "id").values_list("link", "id"):
+            sample_trackers.setdefault(link_id, tracker_id)  # the first tracker of each link
+        return {"links_by_user": links_by_user, "trackers": sample_trackers}
+
+    def make_request(self, scenario:str, dataset:dict, rng:random.Random) -> tuple[int, str]:
+        """
+        a (user id, url) pair, the user id being None for the anonymous requests
+        """
+        user_id = rng.choice(list(dataset["links_by_user"]))
+        link_id = rng.choice(dataset["links_by_user"][user_id])
+        if scenario == "redirect":
+            return None, reverse("redirect_link", args=[link_id])
+        if scenario == "index":
+            return user_id, reverse("index")
+        if scenario == "view_link":
+            return user_id, reverse("view_link", args=[link_id])
+        return user_id, reverse("view_tracker", args=[link_id, dataset["trackers"][link_id]])
+
+    def run(self, requests:list[tuple[int, str]], concurrency:int) -> dict:
+        """
+        count the queries of a sample of requests, then time all of them with concurrent clients
+        the queries are counted in a separate pass so that logging them doesn't slow down the timed one
+        """
+        clients = local()  # one logged in client per thread and user, so the logins aren't timed
+
+        def client_for(user_id:int) -> Client:
+            if not hasattr(clients, "by_user"):
+                clients.by_user = {}
+            if user_id not in clients.by_user:
+                client = Client(headers={"User-Agent": BROWSER_AGENT})
+                if user_id is not None:
+                    client.force_login(User.objects.get(id=user_id))
+                clients.by_user[user_id] = client
+            return clients.by_user[user_id]
+
+        sample = requests[:min(20, len(requests))]
+        queries = 0
+        for user_id, url in sample:
+            client = client_for(user_id)
+            with CaptureQueriesContext(connection) as context:
+                client.get(url)
+            queries += len(context.captured_queries)
+
+        def send(request:tuple[int, str]) -> tuple[float, int]:
+            user_id, url = request
+            client = client_for(user_id)
+            start = time.perf_counter()
+            status = client.get(url).status_code
+            return time.perf_counter() - start, status
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send, requests))
+        summary = summarize([duration for duration, _ in results], time.perf_counter() - start)
+        summary["errors"] = sum(1 for _, status in results if status >= 400)
+        summary["queries_per_request"] = queries / len(sample) if sample else 0.0
+        return summary
+
+    def compare(self, baseline:dict, report:dict, tolerance:float):
+        """
+        fail if the p95 latency of a scenario grew by more than tolerance percent, or if it makes more queries
+        """
+        regressions = []
+        for scenario, summary in report["scenarios"].items():
+            previous = baseline.get("scenarios", {}).get(scenario)
+            if previous is None:
+                continue
+            if previous["p95_ms"] and summary["p95_ms"] > previous["p95_ms"] * (1 + tolerance / 100):
+                regressions.append(f"{scenario}: p95 {previous['p95_ms']:.2f} ms -> {summary['p95_ms']:.2f} ms")
+            if summary["queries_per_request"] > previous["queries_per_request"]:
+                regressions.append(f"{scenario}: {previous['queries_per_request']:.1f} -> "
+                                   f"{summary['queries_per_request']:.1f} queries per request")
+        if regressions:
+            raise CommandError("Regressions compared to the previous run:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regression compared to the previous run"))
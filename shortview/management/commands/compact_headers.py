@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from shortview.headers import canonical_json, resolve_blobs
+from shortview.models import Tracker
+
+import json
+
+
+class Command(BaseCommand):
+    help = "Move the request headers stored inline in the trackers to the deduplicated header blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="number of trackers converted per transaction")
+        parser.add_argument("--vacuum", action="store_true", help="run VACUUM at the end so that SQLite gives the space back")
+
+    def handle(self, *args, **options):
+        converted = 0
+        kept = 0
+        old_bytes = 0
+        new_bytes = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                trackers = list(Tracker.objects.filter(id__gt=last_id, header_blob__isnull=True).exclude(header="")
+                                .order_by("id").only("id", "header")[:options["chunk_size"]])
+                if not trackers:
+                    break
+                movable, canonicals = [], []
+                for tracker in trackers:
+                    try:
+                        header = json.loads(tracker.header)
+                    except ValueError:
+                        continue  # unparsable, kept inline as it is
+                    if json.dumps(header, indent=2) != tracker.header:
+                        continue  # not written by the redirect view, its blob would be shown differently
+                    movable.append(tracker)
+                    canonicals.append(canonical_json(header))
+                blob_ids, chunk_bytes = resolve_blobs(canonicals)
+                for tracker, blob_id in zip(movable, blob_ids):
+                    old_bytes += len(tracker.header.encode("utf-8"))
+                    tracker.header = ""
+                    tracker.header_blob_id = blob_id
+                Tracker.objects.bulk_update(movable, ["header", "header_blob"])
+            new_bytes += chunk_bytes
+            converted += len(movable)
+            kept += len(trackers) - len(movable)
+            last_id = trackers[-1].id
+            self.stdout.write(f"{converted} trackers converted...")
+
+        if options["vacuum"] and connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+
+        saved = old_bytes - new_bytes
+        ratio = saved / old_bytes * 100 if old_bytes else 0.0
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} trackers: {old_bytes} bytes of inline headers "
+                                             f"replaced by {new_bytes} bytes of new blobs, {saved} bytes saved ({ratio:.1f}%)"))
+        if kept:
+            self.stdout.write(f"{kept} trackers kept their inline header, which isn't the JSON written by the redirect view")
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shortview.dimensions import DIMENSIONS, click_dimensions
+from shortview.models import Tracker
+
+import json
+
+
+class Command(BaseCommand):
+    help = "Extract the referrer, browser, operating system, language and device of the trackers from their request headers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="number of trackers updated per transaction")
+        parser.add_argument("--all", action="store_true", help="also update the trackers which already have their dimensions, "
+                                                               "after a change of the user agent rules")
+
+    def handle(self, *args, **options):
+        trackers = Tracker.objects.select_related("header_blob").only("id", "header", "header_blob", *DIMENSIONS)
+        if not options["all"]:
+            trackers = trackers.filter(**{name: "" for name in DIMENSIONS})
+        checked = 0
+        updated = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                chunk = list(trackers.filter(id__gt=last_id).order_by("id")[:options["chunk_size"]])
+                if not chunk:
+                    break
+                blob_dimensions: dict[int, dict] = {}  # the trackers sharing a header are only parsed once
+                changed = []
+                for tracker in chunk:
+                    if tracker.header_blob_id is None:
+                        try:
+                            dimensions = click_dimensions(json.loads(tracker.header)) if tracker.header else {}
+                        except (ValueError, AttributeError):
+                            continue  # unparsable inline header
+                    else:
+                        if tracker.header_blob_id not in blob_dimensions:
+                            blob_dimensions[tracker.header_blob_id] = click_dimensions(json.loads(tracker.header_blob.canonical_json()))
+                        dimensions = blob_dimensions[tracker.header_blob_id]
+                    if any(getattr(tracker, name) != dimensions.get(name, "") for name in DIMENSIONS):
+                        for name in DIMENSIONS:
+                            setattr(tracker, name, dimensions.get(name, ""))
+                        changed.append(tracker)
+                Tracker.objects.bulk_update(changed, DIMENSIONS)
+            checked += len(chunk)
+            updated += len(changed)
+            last_id = chunk[-1].id
+            self.stdout.write(f"{checked} trackers checked...")
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} trackers, updated the dimensions of {updated} of them"))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shortview import geoip
+from shortview.models import Tracker
+
+
+class Command(BaseCommand):
+    help = "Fill the country and network of the trackers from the GEOIP_DATABASE file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="number of trackers updated per transaction")
+        parser.add_argument("--all", action="store_true", help="also update the trackers which were already located, "
+                                                               "after replacing the database with a newer one")
+
+    def handle(self, *args, **options):
+        geo_database = geoip.database()
+        if geo_database is None:
+            raise CommandError("No geolocation database, set GEOIP_DATABASE in the settings")
+
+        trackers = Tracker.objects.all()
+        if not options["all"]:
+            trackers = trackers.filter(country="", asn__isnull=True)
+        checked = 0
+        located = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                chunk = list(trackers.filter(id__gt=last_id).order_by("id").only("id", "ip", "country", "asn")[:options["chunk_size"]])
+                if not chunk:
+                    break
+                changed = []
+                for tracker in chunk:
+                    country, asn = geo_database.locate(tracker.ip)
+                    if (country, asn) != (tracker.country, tracker.asn):
+                        tracker.country, tracker.asn = country, asn
+                        changed.append(tracker)
+                    located += bool(country or asn)
+                Tracker.objects.bulk_update(changed, ["country", "asn"])
+            checked += len(chunk)
+            last_id = chunk[-1].id
+            self.stdout.write(f"{checked} trackers checked...")
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} trackers, {located} of them were located"))
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+from shortview import archive
+from shortview.hll import HyperLogLog
+from shortview.ingest import hour_bucket
+from shortview.models import Link, Tracker, ClickRollup
+
+import datetime
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly click rollups of the links from their trackers and their archived clicks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=200, help="number of links rebuilt per transaction")
+
+    def handle(self, *args, **options):
+        precision = getattr(settings, "ROLLUP_SKETCH_PRECISION", 10)
+        rebuilt = 0
+        buckets = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                link_ids = list(Link.objects.filter(id__gt=last_id).order_by("id")
+                                .values_list("id", flat=True)[:options["chunk_size"]])
+                if not link_ids:
+                    break
+                ClickRollup.objects.filter(link__in=link_ids).delete()
+                hours: dict[tuple, list] = {}  # (link id, start of the hour) -> [number of clicks, addresses]
+                rows = (Tracker.objects.filter(link__in=link_ids).annotate(bucket_start=TruncHour("date", tzinfo=datetime.timezone.utc))
+                        .values_list("link", "bucket_start", "ip").annotate(clicks=Count("id")).order_by())
+                for link_id, bucket_start, ip, clicks in rows:
+                    bucket = hours.setdefault((link_id, bucket_start), [0, set()])
+                    bucket[0] += clicks
+                    bucket[1].add(ip)
+                # the archived clicks were deleted from the trackers but are still in the rollups
+                for link_id in link_ids:
+                    for row in archive.read_link(link_id):
+                        bucket = hours.setdefault((link_id, hour_bucket(datetime.datetime.fromisoformat(row["date"]))), [0, set()])
+                        bucket[0] += 1
+                        bucket[1].add(row["ip"])
+                rollups = []
+                for (link_id, bucket_start), (clicks, ips) in hours.items():
+                    sketch = HyperLogLog(precision)
+                    sketch.update(ips)
+                    rollups.append(ClickRollup(link_id=link_id, bucket_start=bucket_start, count=clicks, unique_ips=len(ips),
+                                               visitors_sketch=sketch.to_bytes()))
+                ClickRollup.objects.bulk_create(rollups, batch_size=1000)
+            rebuilt += len(link_ids)
+            buckets += len(rollups)
+            last_id = link_ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {buckets} hourly rollups for {rebuilt} links"))
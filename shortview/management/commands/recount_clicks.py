@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min, Max
+
+from shortview import archive
+from shortview.hll import HyperLogLog, DEFAULT_PRECISION
+from shortview.models import Link, Tracker
+
+import datetime
+
+
+class Command(BaseCommand):
+    help = "Recompute the click counters and the visitor sketches of the links from their trackers and their archived clicks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="number of links recounted per transaction")
+
+    def handle(self, *args, **options):
+        precision = getattr(settings, "VISITOR_SKETCH_PRECISION", DEFAULT_PRECISION)
+        recounted = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                links = list(Link.objects.filter(id__gt=last_id).order_by("id")
+                             .only("id", "click_count", "first_click_at", "last_click_at", "unique_visitors")[:options["chunk_size"]])
+                if not links:
+                    break
+                counters = {row["link"]: row for row in Tracker.objects.filter(link__in=links).values("link")
+                            .annotate(clicks=Count("id"), first=Min("date"), last=Max("date")).order_by()}
+                sketches = {link.id: HyperLogLog(precision) for link in links}
+                for link_id, ip in Tracker.objects.filter(link__in=links).values_list("link", "ip").distinct().order_by():
+                    sketches[link_id].add(ip)
+                for link in links:
+                    row = counters.get(link.id)
+                    link.click_count = row["clicks"] if row else 0
+                    link.first_click_at = row["first"] if row else None
+                    link.last_click_at = row["last"] if row else None
+                    # the archived clicks were deleted from the trackers but are still counted
+                    for archived in archive.read_link(link.id):
+                        date = datetime.datetime.fromisoformat(archived["date"])
+                        link.click_count += 1
+                        link.first_click_at = min(date, link.first_click_at or date)
+                        link.last_click_at = max(date, link.last_click_at or date)
+                        sketches[link.id].add(archived["ip"])
+                    link.visitors_sketch = sketches[link.id].to_bytes()
+                    link.unique_visitors = sketches[link.id].count()
+                Link.objects.bulk_update(links, ["click_count", "first_click_at", "last_click_at", "visitors_sketch", "unique_visitors"])
+            recounted += len(links)
+            last_id = links[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f"Recounted the clicks of {recounted} links"))
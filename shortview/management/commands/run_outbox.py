@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortview.outbox import OutboxWorkerPool, process_outbox, stats
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Send the emails of the outbox with a pool of workers, until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=getattr(settings, "EMAIL_OUTBOX_WORKERS", 2))
+        parser.add_argument("--once", action="store_true", help="send what is due now, then exit")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            while process_outbox():
+                pass
+            self.stdout.write(str(stats()))
+            return
+
+        pool = OutboxWorkerPool(workers=options["workers"],
+                                batch_size=getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 20),
+                                poll_interval=getattr(settings, "EMAIL_OUTBOX_POLL_INTERVAL", 5))
+        pool.start()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            pool.stop()
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortview.jobs import job_runner, release_lease
+from shortview.models import JobRun
+from shortview.outbox import OutboxWorkerPool
+
+import signal
+
+
+class Command(BaseCommand):
+    help = "Run the background jobs and send the email outbox, until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="run every job once if no other worker holds the lease, then exit")
+        parser.add_argument("--outbox-workers", type=int, default=getattr(settings, "EMAIL_OUTBOX_WORKERS", 2),
+                            help="email sending threads, 0 to send the emails with run_outbox instead")
+
+    def handle(self, *args, **options):
+        runner = job_runner()
+        if options["once"]:
+            if not runner.run_all():
+                self.stderr.write("the jobs lease is held by another worker")
+                return
+            release_lease(runner.holder)
+            for run in JobRun.objects.order_by("name"):
+                self.stdout.write(f"{run.name}: {run.last_rows} rows in {run.last_duration:.3f} s"
+                                  + (f", failed with {run.last_error}" if run.last_error else ""))
+            return
+
+        # the outbox doesn't need the lease, the emails are claimed one batch at a time by any number of workers
+        pool = None
+        if options["outbox_workers"] > 0:
+            pool = OutboxWorkerPool(workers=options["outbox_workers"],
+                                    batch_size=getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 20),
+                                    poll_interval=getattr(settings, "EMAIL_OUTBOX_POLL_INTERVAL", 5))
+            pool.start()
+
+        # stop cleanly when systemd stops the service, so that the lease is released for the other workers
+        signal.signal(signal.SIGTERM, lambda signum, frame: runner.stop())
+        try:
+            runner.run()
+        except KeyboardInterrupt:
+            runner.stop()
+        finally:
+            if pool is not None:
+                pool.stop()
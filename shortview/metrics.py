@@ -0,0 +1,197 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock, Thread, current_thread, local
+import time
+
+# In-process request metrics, exposed in the Prometheus text format by the metrics view
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+
+
+class Metrics:
+    """
+    counters and histograms, each thread updating its own shard without lock, the shards being summed when read
+    a lock is only taken when a thread records its first metric, and when the metrics are read
+    the shards of the finished threads are folded into a single one, so that they don't pile up
+    under the servers starting a thread per connection
+    """
+    def __init__(self, buckets:tuple[float, ...]=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._shards: dict[Thread, dict] = {}
+        self._retired = {"counters": {}, "histograms": {}}  # sum of the shards of the finished threads
+        self._local = local()
+        self._lock = Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {"counters": {}, "histograms": {}}
+            with self._lock:
+                self._retire_finished()
+                self._shards[current_thread()] = shard
+            self._local.shard = shard
+        return shard
+
+    def _retire_finished(self):
+        # called with the lock held, a finished thread doesn't update its shard any more
+        for thread in [thread for thread in self._shards if not thread.is_alive()]:
+            self._add(self._retired, self._shards.pop(thread))
+
+    @staticmethod
+    def _add(total:dict, shard:dict):
+        # the shard is copied first, its thread may update it meanwhile
+        for key, value in shard["counters"].copy().items():
+            total["counters"][key] = total["counters"].get(key, 0) + value
+        for key, histogram in shard["histograms"].copy().items():
+            summed = total["histograms"].setdefault(key, [0] * len(histogram))
+            for index, value in enumerate(histogram):
+                summed[index] += value
+
+    def inc(self, name:str, labels:tuple=(), value:float=1):
+        """
+        add value to a counter, labels being a tuple of (name, value) pairs
+        """
+        counters = self._shard()["counters"]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name:str, labels:tuple, value:float):
+        """
+        record a value in a histogram
+        """
+        histograms = self._shard()["histograms"]
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]  # bucket counts, +Inf, sum
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    @contextmanager
+    def timer(self, name:str, labels:tuple=()):
+        """
+        record the duration of a block in a histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, time.perf_counter() - start)
+
+    def collect(self) -> tuple[dict, dict]:
+        """
+        the counters and the histograms summed over the threads
+        """
+        total = {"counters": {}, "histograms": {}}
+        with self._lock:
+            self._retire_finished()
+            self._add(total, self._retired)
+            shards = list(self._shards.values())
+        for shard in shards:
+            self._add(total, shard)
+        return total["counters"], total["histograms"]
+
+    def clear(self):
+        with self._lock:
+            for shard in [self._retired, *self._shards.values()]:
+                shard["counters"].clear()
+                shard["histograms"].clear()
+
+
+metrics = Metrics(getattr(settings, "METRICS_BUCKETS", DEFAULT_BUCKETS))
+
+
+def _labels(labels:tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def render_prometheus(extra_counters:dict[tuple, float]=None, gauges:dict[tuple, float]=None) -> str:
+    """
+    the metrics in the Prometheus text format, with extra counters and gauges as dicts of (name, labels) -> value
+    """
+    counters, histograms = metrics.collect()
+    counters.update(extra_counters or {})
+    lines = []
+    for kind, values in (("counter", counters), ("gauge", gauges or {})):
+        for name in sorted({name for name, _ in values}):
+            lines.append(f"# TYPE {name} {kind}")
+            for (key_name, labels), value in sorted(values.items()):
+                if key_name == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (key_name, labels), histogram in sorted(histograms.items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(metrics.buckets + ("+Inf",), histogram[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class QueryCounter:
+    """
+    a database execute wrapper counting the queries of a request and their time
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """
+    record the latency, the status and the database queries of each request, labelled with the name of the view
+    the queries of the async views run in worker threads, so only their latency is recorded
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "METRICS_ENABLED", True):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, duration:float, queries:QueryCounter=None):
+        match = request.resolver_match
+        view = (("view", match.url_name or match.view_name if match is not None else "unmatched"),)
+        metrics.observe("shortview_request_duration_seconds", view, duration)
+        metrics.inc("shortview_requests_total", view + (("status", f"{response.status_code // 100}xx"),))
+        if queries is not None:
+            metrics.inc("shortview_db_queries_total", view, queries.count)
+            metrics.inc("shortview_db_query_seconds_total", view, queries.seconds)
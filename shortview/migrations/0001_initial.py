@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:01
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Link',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(default='', max_length=255, verbose_name='description')),
+                ('date', models.DateTimeField(verbose_name='date of creation')),
+                ('lifetime', models.DurationField(default=datetime.timedelta(0), verbose_name='life duration')),
+                ('notify_click', models.IntegerField(choices=[(0, 'User preference'), (1, 'Never notify'), (2, 'Notify first click'), (3, 'Notify each click')], default=0, verbose_name='send email on link click')),
+                ('destination', models.URLField(default='https://example.com/', max_length=65535, verbose_name='destination url')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delete_expired', models.BooleanField(default=False, verbose_name='delete expired links')),
+                ('hide_expired', models.BooleanField(default=True, verbose_name='hide expired links')),
+                ('default_lifetime', models.DurationField(default=datetime.timedelta(0), verbose_name='default link life duration')),
+                ('default_notify_click', models.IntegerField(choices=[(1, 'Never notify'), (2, 'Notify first click'), (3, 'Notify each click')], default=1, verbose_name='send email on link click')),
+                ('receive_newsletters', models.BooleanField(default=True, verbose_name='receive the newsletters')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tracker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip', models.GenericIPAddressField(default='0.0.0.0', verbose_name='receiver ip')),
+                ('date', models.DateTimeField(verbose_name='date of clicking')),
+                ('header', models.TextField(default='', verbose_name='request header')),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shortview.link')),
+            ],
+        ),
+    ]
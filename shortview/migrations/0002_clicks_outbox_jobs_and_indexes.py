@@ -0,0 +1,192 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:01
+
+import datetime
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateTimeField, Exists, ExpressionWrapper, F, Max, Min, OuterRef, Subquery
+
+
+def compute_expiry_dates(apps, schema_editor):
+    """
+    the expiry date of the links created before it was stored, left null they would never expire
+    """
+    Link = apps.get_model('shortview', 'Link')
+    Link.objects.exclude(lifetime=datetime.timedelta(0)).update(
+        expires_at=ExpressionWrapper(F('date') + F('lifetime'), output_field=DateTimeField()),
+    )
+
+
+def count_existing_clicks(apps, schema_editor):
+    """
+    the counters of the links clicked before they were added, starting them at 0 would notify a first click again
+    """
+    Link = apps.get_model('shortview', 'Link')
+    Tracker = apps.get_model('shortview', 'Tracker')
+    trackers = Tracker.objects.filter(link=OuterRef('pk')).order_by().values('link')
+    Link.objects.filter(Exists(trackers)).update(
+        click_count=Subquery(trackers.annotate(clicks=Count('id')).values('clicks')),
+        first_click_at=Subquery(trackers.annotate(first=Min('date')).values('first')),
+        last_click_at=Subquery(trackers.annotate(last=Max('date')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortview', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField(verbose_name='start of the hour')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='number of clicks')),
+                ('unique_ips', models.PositiveIntegerField(default=0, verbose_name='number of different IP addresses')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=998, verbose_name='subject')),
+                ('sender', models.CharField(max_length=254, verbose_name='sender')),
+                ('recipient', models.CharField(max_length=254, verbose_name='recipient')),
+                ('text_content', models.TextField(verbose_name='text content')),
+                ('html_content', models.TextField(blank=True, default='', verbose_name='html content')),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Sending'), (2, 'Sent'), (3, 'Failed')], db_index=True, default=0, verbose_name='status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='sending attempts')),
+                ('next_attempt_at', models.DateTimeField(db_index=True, verbose_name='date of the next attempt')),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=64, verbose_name='claimed by worker')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='date of the claim')),
+                ('created_at', models.DateTimeField(verbose_name='date of creation')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='date of sending')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='last error')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HeaderBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='digest')),
+                ('compressed', models.BooleanField(default=False, verbose_name='compressed')),
+                ('data', models.BinaryField(verbose_name='data')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JobLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='name')),
+                ('holder', models.CharField(blank=True, default='', max_length=128, verbose_name='holder')),
+                ('acquired_at', models.DateTimeField(blank=True, null=True, verbose_name='date of acquisition')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='date of expiration')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='name')),
+                ('holder', models.CharField(blank=True, default='', max_length=128, verbose_name='last run by')),
+                ('last_started_at', models.DateTimeField(blank=True, null=True, verbose_name='start of the last run')),
+                ('last_duration', models.FloatField(default=0, verbose_name='duration of the last run in seconds')),
+                ('last_rows', models.PositiveIntegerField(default=0, verbose_name='rows handled by the last run')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='error of the last run')),
+                ('runs', models.PositiveIntegerField(default=0, verbose_name='number of runs')),
+                ('failures', models.PositiveIntegerField(default=0, verbose_name='number of failed runs')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='click_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='number of clicks'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='digest_due_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='date of the pending digest'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='digest_since',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='start of the pending digest'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True, verbose_name='date of expiry'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='first_click_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='date of the first click'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='last_click_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='date of the last click'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='tracker_retention',
+            field=models.PositiveIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1)], verbose_name='days before the clicks are archived'),
+        ),
+        migrations.AlterField(
+            model_name='link',
+            name='notify_click',
+            field=models.IntegerField(choices=[(0, 'User preference'), (1, 'Never notify'), (2, 'Notify first click'), (3, 'Notify each click'), (4, 'Send a digest of the clicks')], default=0, verbose_name='send email on link click'),
+        ),
+        migrations.AlterField(
+            model_name='link',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='default_notify_click',
+            field=models.IntegerField(choices=[(1, 'Never notify'), (2, 'Notify first click'), (3, 'Notify each click'), (4, 'Send a digest of the clicks')], default=1, verbose_name='send email on link click'),
+        ),
+        migrations.AlterField(
+            model_name='tracker',
+            name='header',
+            field=models.TextField(blank=True, default='', verbose_name='request header'),
+        ),
+        migrations.AlterField(
+            model_name='tracker',
+            name='link',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='shortview.link'),
+        ),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['owner', 'date'], name='link_owner_date'),
+        ),
+        migrations.AddField(
+            model_name='clickrollup',
+            name='link',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='shortview.link'),
+        ),
+        migrations.AddField(
+            model_name='tracker',
+            name='header_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='shortview.headerblob'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'date'], name='tracker_link_date'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'ip'], name='tracker_link_ip'),
+        ),
+        migrations.AddConstraint(
+            model_name='clickrollup',
+            constraint=models.UniqueConstraint(fields=('link', 'bucket_start'), name='unique_rollup_bucket'),
+        ),
+        migrations.RunPython(compute_expiry_dates, migrations.RunPython.noop),
+        migrations.RunPython(count_existing_clicks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortview', '0002_clicks_outbox_jobs_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tracker',
+            name='asn',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='autonomous system number'),
+        ),
+        migrations.AddField(
+            model_name='tracker',
+            name='country',
+            field=models.CharField(blank=True, default='', max_length=2, verbose_name='country code'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'country'], name='tracker_link_country'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'asn'], name='tracker_link_asn'),
+        ),
+    ]
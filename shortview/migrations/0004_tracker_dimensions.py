@@ -0,0 +1,58 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortview', '0003_tracker_geolocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tracker',
+            name='device',
+            field=models.CharField(blank=True, default='', max_length=16, verbose_name='device'),
+        ),
+        migrations.AddField(
+            model_name='tracker',
+            name='language',
+            field=models.CharField(blank=True, default='', max_length=8, verbose_name='language'),
+        ),
+        migrations.AddField(
+            model_name='tracker',
+            name='referer_host',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='referrer host'),
+        ),
+        migrations.AddField(
+            model_name='tracker',
+            name='ua_family',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='browser'),
+        ),
+        migrations.AddField(
+            model_name='tracker',
+            name='ua_os',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='operating system'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'referer_host'], name='tracker_link_referer'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'ua_family'], name='tracker_link_browser'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'ua_os'], name='tracker_link_os'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'language'], name='tracker_link_language'),
+        ),
+        migrations.AddIndex(
+            model_name='tracker',
+            index=models.Index(fields=['link', 'device'], name='tracker_link_device'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+from shortview.hll import DEFAULT_PRECISION, HyperLogLog
+
+
+def estimate_existing_visitors(apps, schema_editor):
+    """
+    the visitor sketches of the links clicked before they were added, from their trackers and their archived clicks
+    """
+    from shortview import archive
+    Link = apps.get_model('shortview', 'Link')
+    Tracker = apps.get_model('shortview', 'Tracker')
+    precision = getattr(settings, "VISITOR_SKETCH_PRECISION", DEFAULT_PRECISION)
+    sketches = {}
+    for link_id, ip in Tracker.objects.values_list('link', 'ip').distinct().order_by('link'):
+        sketches.setdefault(link_id, HyperLogLog(precision)).add(ip)
+    links = []
+    for link in Link.objects.only('id').order_by('id').iterator():
+        sketch = sketches.pop(link.id, None)
+        for archived in archive.read_link(link.id):
+            sketch = sketch or HyperLogLog(precision)
+            sketch.add(archived["ip"])
+        if sketch is None:
+            continue
+        link.visitors_sketch = sketch.to_bytes()
+        link.unique_visitors = sketch.count()
+        links.append(link)
+    Link.objects.bulk_update(links, ['visitors_sketch', 'unique_visitors'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortview', '0004_tracker_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clickrollup',
+            name='visitors_sketch',
+            field=models.BinaryField(blank=True, default=b'', verbose_name='sketch of the visitors'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='unique_visitors',
+            field=models.PositiveIntegerField(default=0, verbose_name='estimated number of visitors'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='visitors_sketch',
+            field=models.BinaryField(blank=True, default=b'', verbose_name='sketch of the visitors'),
+        ),
+        migrations.RunPython(estimate_existing_visitors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:40
+
+from django.db import migrations
+
+
+def create_missing_profiles(apps, schema_editor):
+    """
+    the profiles of the users created before they were made by a signal, the views expect every user to have one
+    """
+    User = apps.get_model('auth', 'User')
+    Profile = apps.get_model('shortview', 'Profile')
+    user_ids = User.objects.exclude(id__in=Profile.objects.values('user')).values_list('id', flat=True)
+    Profile.objects.bulk_create([Profile(user_id=user_id) for user_id in user_ids], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortview', '0005_visitor_sketches'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_profiles, migrations.RunPython.noop),
+    ]
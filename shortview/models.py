@@ -4,11 +4,14 @@ from django.utils import timezone
 from django.urls import reverse
 from django.contrib import admin
 from django.contrib.auth.models import User
+from django.core.validators import MinValueValidator
 from django.contrib.sites.models import Site
 from django.conf import settings
 
 from urllib.parse import urlparse
 import datetime
+import json
+import zlib
 
 # Create your models here.
 
@@ -16,7 +19,7 @@ class Profile(models.Model):
     """
     a model to store a user profile, with all its settings, data and preferences
     """
-    NOTIFY_CLICK_CHOICES = [(1, _("Never notify")), (2, _("Notify first click")), (3, _("Notify each click"))]
+    NOTIFY_CLICK_CHOICES = [(1, _("Never notify")), (2, _("Notify first click")), (3, _("Notify each click")), (4, _("Send a digest of the clicks"))]
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     delete_expired = models.BooleanField(_("delete expired links"), default=False)
@@ -24,23 +27,72 @@ class Profile(models.Model):
     default_lifetime = models.DurationField(_("default link life duration"), default=datetime.timedelta(0))
     default_notify_click = models.IntegerField(_("send email on link click"), choices=NOTIFY_CLICK_CHOICES, default=1)
     receive_newsletters = models.BooleanField(_("receive the newsletters"), default=True)
+    tracker_retention = models.PositiveIntegerField(_("days before the clicks are archived"), null=True, blank=True,
+                                                    validators=[MinValueValidator(1)])  # null to use TRACKER_RETENTION_DAYS
 
     def __str__(self):
         return str(_("%(user)s's profile") % {"user": self.user})
 
 
+class LinkQuerySet(models.QuerySet):
+    """
+    link queries filtering on the expiry date stored in the database
+    """
+    def active(self, now:datetime.datetime=None):
+        """
+        links which never expire, or which started and are not expired yet
+        """
+        now = now or timezone.now()
+        return self.filter(models.Q(expires_at__isnull=True) | models.Q(expires_at__gte=now, date__lte=now))
+
+    def expired(self, now:datetime.datetime=None):
+        now = now or timezone.now()
+        return self.filter(expires_at__lt=now)
+
+
 class Link(models.Model):
     """
     a model to represent a tracked link shortener with its attributes
     """
-    NOTIFY_CLICK_CHOICES = [(0, _("User preference")), (1, _("Never notify")), (2, _("Notify first click")), (3, _("Notify each click"))]
+    NOTIFY_CLICK_CHOICES = [(0, _("User preference")), (1, _("Never notify")), (2, _("Notify first click")), (3, _("Notify each click")), (4, _("Send a digest of the clicks"))]
 
     description = models.CharField(_("description"), default="", max_length=255)
-    owner = models.ForeignKey(User, on_delete=models.CASCADE)  # user who owns the link
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)  # user who owns the link, indexed with the date
     date = models.DateTimeField(_("date of creation"))
     lifetime = models.DurationField(_("life duration"), default=datetime.timedelta(0))  # 0 for unlimited
+    expires_at = models.DateTimeField(_("date of expiry"), null=True, blank=True, editable=False, db_index=True)  # date + lifetime, null for unlimited
     notify_click = models.IntegerField(_("send email on link click"), choices=NOTIFY_CLICK_CHOICES, default=0)
     destination = models.URLField(_("destination url"), default="https://example.com/", max_length=65535)
+    # click counters, maintained with the trackers by ingest.update_click_counters
+    click_count = models.PositiveIntegerField(_("number of clicks"), default=0)
+    first_click_at = models.DateTimeField(_("date of the first click"), null=True, blank=True)
+    last_click_at = models.DateTimeField(_("date of the last click"), null=True, blank=True)
+    # HyperLogLog sketch of the IP addresses of the clicks and its estimate, maintained by ingest.update_visitor_sketches
+    visitors_sketch = models.BinaryField(_("sketch of the visitors"), default=b"", blank=True)
+    unique_visitors = models.PositiveIntegerField(_("estimated number of visitors"), default=0)
+    # pending click digest, set by the first click of a digest window and cleared when the digest is sent
+    digest_since = models.DateTimeField(_("start of the pending digest"), null=True, blank=True)
+    digest_due_at = models.DateTimeField(_("date of the pending digest"), null=True, blank=True, db_index=True)
+
+    objects = LinkQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["owner", "date"], name="link_owner_date")]  # the links of the home page
+
+    def save(self, *args, **kwargs):
+        self.expires_at = self.compute_expires_at()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"date", "lifetime"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "expires_at"}
+        super().save(*args, **kwargs)
+
+    def compute_expires_at(self) -> datetime.datetime | None:
+        """
+        returns the date of expiry of the link, None if it never expires
+        """
+        if self.lifetime == datetime.timedelta(0):
+            return None
+        return self.date + self.lifetime
     
     def url(self):
         """
@@ -63,30 +115,155 @@ class Link(models.Model):
     
     @admin.display(
         boolean=True,
-        ordering="date",
+        ordering="expires_at",
         description=_("still active"),
     )
     def active(self) -> bool:
         """
         is the link still active, False if expired
         """
-        if self.lifetime == datetime.timedelta(0):
+        if self.expires_at is None:
             return True
         # return True if the link isn't expired and is not scheduled to be active in the future
-        return self.lifetime >= timezone.now() - self.date and self.date <= timezone.now()
+        now = timezone.now()
+        return self.expires_at >= now and self.date <= now
     
     def __str__(self):
         return f"{self.description} --> {self.short_destination()}"
 
 
+class HeaderBlob(models.Model):
+    """
+    a request header stored once and shared by every tracker with the same header, addressed by the hash of its content
+    """
+    digest = models.CharField(_("digest"), max_length=64, unique=True)  # sha256 of the canonical json
+    compressed = models.BooleanField(_("compressed"), default=False)  # data is zlib compressed
+    data = models.BinaryField(_("data"))
+
+    def canonical_json(self) -> str:
+        """
+        returns the header as compact json with sorted keys
+        """
+        data = bytes(self.data)
+        if self.compressed:
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    def __str__(self):
+        return self.digest
+
+
 class Tracker(models.Model):
     """
     a model to store the informations when a link has been clicked, a link can have multiple trackers
     """
-    link = models.ForeignKey(Link, on_delete=models.CASCADE)  # the link from which the tracking originates
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, db_index=False)  # the link from which the tracking originates
     ip = models.GenericIPAddressField(_("receiver ip"), default="0.0.0.0")
     date = models.DateTimeField(_("date of clicking"))
-    header = models.TextField(_("request header"), default="")
+    header = models.TextField(_("request header"), default="", blank=True)  # only used by trackers not yet moved to a blob
+    header_blob = models.ForeignKey(HeaderBlob, on_delete=models.PROTECT, null=True, blank=True)
+    # filled from the GEOIP_DATABASE file when the click is stored, see geoip.locate
+    country = models.CharField(_("country code"), max_length=2, default="", blank=True)
+    asn = models.PositiveIntegerField(_("autonomous system number"), null=True, blank=True)
+    # extracted from the request header when the click is logged, see dimensions.click_dimensions
+    referer_host = models.CharField(_("referrer host"), max_length=255, default="", blank=True)
+    ua_family = models.CharField(_("browser"), max_length=32, default="", blank=True)
+    ua_os = models.CharField(_("operating system"), max_length=32, default="", blank=True)
+    language = models.CharField(_("language"), max_length=8, default="", blank=True)
+    device = models.CharField(_("device"), max_length=16, default="", blank=True)
+
+    class Meta:
+        # the link alone is served by all of them, so it has no index of its own
+        # the breakdowns of the clicks of a link by one dimension are read from the index alone
+        indexes = [models.Index(fields=["link", "date"], name="tracker_link_date"),  # the timeline of a link
+                   models.Index(fields=["link", "ip"], name="tracker_link_ip"),  # the different visitors of a link
+                   models.Index(fields=["link", "country"], name="tracker_link_country"),  # the countries of the visitors
+                   models.Index(fields=["link", "asn"], name="tracker_link_asn"),  # their networks
+                   models.Index(fields=["link", "referer_host"], name="tracker_link_referer"),
+                   models.Index(fields=["link", "ua_family"], name="tracker_link_browser"),
+                   models.Index(fields=["link", "ua_os"], name="tracker_link_os"),
+                   models.Index(fields=["link", "language"], name="tracker_link_language"),
+                   models.Index(fields=["link", "device"], name="tracker_link_device")]
+
+    def header_json(self) -> str:
+        """
+        returns the request header as indented json
+        """
+        if self.header_blob_id is None:
+            return self.header
+        return json.dumps(json.loads(self.header_blob.canonical_json()), indent=2)
 
     def __str__(self):
         return f"{self.ip} | {self.date}"
+
+
+class ClickRollup(models.Model):
+    """
+    the number of clicks on a link during one hour, maintained with the trackers to draw charts without reading them
+    """
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, db_index=False)  # indexed by the unique constraint
+    bucket_start = models.DateTimeField(_("start of the hour"))  # in UTC
+    count = models.PositiveIntegerField(_("number of clicks"), default=0)
+    unique_ips = models.PositiveIntegerField(_("number of different IP addresses"), default=0)
+    visitors_sketch = models.BinaryField(_("sketch of the visitors"), default=b"", blank=True)  # merged to count the visitors of longer periods
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["link", "bucket_start"], name="unique_rollup_bucket")]
+
+    def __str__(self):
+        return f"{self.link_id} | {self.bucket_start} | {self.count}"
+
+
+class EmailOutbox(models.Model):
+    """
+    an email waiting to be sent by the outbox workers, kept after sending for the record
+    """
+    PENDING, SENDING, SENT, FAILED = 0, 1, 2, 3
+    STATUS_CHOICES = [(PENDING, _("Pending")), (SENDING, _("Sending")), (SENT, _("Sent")), (FAILED, _("Failed"))]
+
+    subject = models.CharField(_("subject"), max_length=998)
+    sender = models.CharField(_("sender"), max_length=254)
+    recipient = models.CharField(_("recipient"), max_length=254)
+    text_content = models.TextField(_("text content"))
+    html_content = models.TextField(_("html content"), default="", blank=True)
+    status = models.IntegerField(_("status"), choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(_("sending attempts"), default=0)
+    next_attempt_at = models.DateTimeField(_("date of the next attempt"), db_index=True)
+    claimed_by = models.CharField(_("claimed by worker"), max_length=64, default="", blank=True)
+    claimed_at = models.DateTimeField(_("date of the claim"), null=True, blank=True)
+    created_at = models.DateTimeField(_("date of creation"))
+    sent_at = models.DateTimeField(_("date of sending"), null=True, blank=True)
+    last_error = models.TextField(_("last error"), default="", blank=True)
+
+    def __str__(self):
+        return f"{self.recipient} | {self.subject}"
+
+
+class JobLease(models.Model):
+    """
+    a lease on the background jobs, held by a single runjobs worker at a time and renewed while it runs
+    """
+    name = models.CharField(_("name"), max_length=64, unique=True)
+    holder = models.CharField(_("holder"), max_length=128, default="", blank=True)
+    acquired_at = models.DateTimeField(_("date of acquisition"), null=True, blank=True)
+    expires_at = models.DateTimeField(_("date of expiration"), null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} | {self.holder}"
+
+
+class JobRun(models.Model):
+    """
+    the last run of a background job, to monitor how long the jobs take and how much work they do
+    """
+    name = models.CharField(_("name"), max_length=64, unique=True)
+    holder = models.CharField(_("last run by"), max_length=128, default="", blank=True)
+    last_started_at = models.DateTimeField(_("start of the last run"), null=True, blank=True)
+    last_duration = models.FloatField(_("duration of the last run in seconds"), default=0)
+    last_rows = models.PositiveIntegerField(_("rows handled by the last run"), default=0)
+    last_error = models.TextField(_("error of the last run"), default="", blank=True)
+    runs = models.PositiveIntegerField(_("number of runs"), default=0)
+    failures = models.PositiveIntegerField(_("number of failed runs"), default=0)
+
+    def __str__(self):
+        return f"{self.name} | {self.last_started_at}"
@@ -0,0 +1,169 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+from threading import Thread, Event, Lock
+import datetime
+import traceback
+import uuid
+import time
+
+# Persistent email outbox, sent in batches by a pool of worker threads
+
+_stats = {"sent": 0, "retried": 0, "failed": 0, "batches": 0, "send_seconds_total": 0.0, "last_send_seconds": 0.0}
+_stats_lock = Lock()
+
+
+def enqueue_email(subject:str, sender:str, receiver:str, text_content:str, html_content:str=None) -> EmailOutbox:
+    """
+    store an email in the outbox, it will be sent by the first available worker
+    """
+    now = timezone.now()
+    return EmailOutbox.objects.create(subject=subject, sender=sender, recipient=receiver, text_content=text_content,
+                                      html_content=html_content or "", created_at=now, next_attempt_at=now)
+
+
+def claim_batch(worker_id:str, size:int) -> list[EmailOutbox]:
+    """
+    claim up to size emails due for sending, emails claimed by a worker which died are claimed again after a timeout
+    the claim is a conditional update, so two workers never get the same email
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=getattr(settings, "EMAIL_OUTBOX_CLAIM_TIMEOUT", 600))
+    claimable = (Q(status=EmailOutbox.PENDING, next_attempt_at__lte=now)
+                 | Q(status=EmailOutbox.SENDING, claimed_at__lt=stale))
+    ids = list(EmailOutbox.objects.filter(claimable).order_by("next_attempt_at").values_list("id", flat=True)[:size])
+    if not ids:
+        return []
+    EmailOutbox.objects.filter(claimable, id__in=ids).update(status=EmailOutbox.SENDING, claimed_by=worker_id, claimed_at=now)
+    return list(EmailOutbox.objects.filter(id__in=ids, status=EmailOutbox.SENDING, claimed_by=worker_id))
+
+
+def send_batch(emails:list[EmailOutbox]):
+    """
+    send claimed emails over a single connection to the email backend, failed emails are retried later
+    """
+    if not emails:
+        return
+    start = time.perf_counter()
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        for email in emails:
+            _retry_later(email, e)
+        return
+
+    try:
+        for email in emails:
+            message = EmailMultiAlternatives(email.subject, email.text_content, email.sender, [email.recipient],
+                                             connection=connection)
+            if email.html_content:
+                message.attach_alternative(email.html_content, "text/html")
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                _retry_later(email, e)
+            else:
+                email.status = EmailOutbox.SENT
+                email.sent_at = timezone.now()
+                email.attempts += 1
+                email.save(update_fields=["status", "sent_at", "attempts"])
+                with _stats_lock:
+                    _stats["sent"] += 1
+    finally:
+        connection.close()
+
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _stats["batches"] += 1
+        _stats["send_seconds_total"] += elapsed
+        _stats["last_send_seconds"] = elapsed
+
+
+def _retry_later(email:EmailOutbox, error:Exception):
+    # exponential backoff, until the maximum number of attempts is reached
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"
+    if email.attempts >= getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 5):
+        email.status = EmailOutbox.FAILED
+        counter = "failed"
+    else:
+        delay = getattr(settings, "EMAIL_OUTBOX_RETRY_DELAY", 60) * 2 ** (email.attempts - 1)
+        email.status = EmailOutbox.PENDING
+        email.next_attempt_at = timezone.now() + datetime.timedelta(seconds=delay)
+        counter = "retried"
+    email.save(update_fields=["attempts", "last_error", "status", "next_attempt_at"])
+    with _stats_lock:
+        _stats[counter] += 1
+
+
+def process_outbox(worker_id:str=None, batch_size:int=None) -> int:
+    """
+    claim and send one batch, returns the number of emails handled
+    """
+    worker_id = worker_id or uuid.uuid4().hex
+    emails = claim_batch(worker_id, batch_size or getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 20))
+    send_batch(emails)
+    return len(emails)
+
+
+def stats() -> dict:
+    """
+    queue depth and sending counters of this process
+    """
+    with _stats_lock:
+        counters = dict(_stats)
+    counters["queue_depth"] = EmailOutbox.objects.filter(status__in=[EmailOutbox.PENDING, EmailOutbox.SENDING]).count()
+    counters["mean_send_seconds"] = counters["send_seconds_total"] / counters["batches"] if counters["batches"] else 0.0
+    return counters
+
+
+class OutboxWorkerPool:
+    """
+    a pool of threads sending the outbox, each one reusing a single backend connection per batch
+    """
+    def __init__(self, workers:int=2, batch_size:int=20, poll_interval:float=5):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = Event()
+        self._threads: list[Thread] = []
+
+    def start(self):
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = Thread(target=self._run, name=f"outbox-worker-{index}")
+            thread.daemon = True  # avoid blocking shutdown, unsent emails stay in the outbox
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout:float=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        worker_id = uuid.uuid4().hex
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                handled = process_outbox(worker_id, self.batch_size)
+            except Exception as e:
+                print(f"\n/!\\ Error in outbox worker: {e}:\n{traceback.format_exc()}")
+                handled = 0
+            if handled < self.batch_size:
+                self._stop.wait(self.poll_interval)  # the outbox is drained, wait for new emails
+
+
+def start_outbox_workers() -> OutboxWorkerPool:
+    pool = OutboxWorkerPool(workers=getattr(settings, "EMAIL_OUTBOX_WORKERS", 2),
+                            batch_size=getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 20),
+                            poll_interval=getattr(settings, "EMAIL_OUTBOX_POLL_INTERVAL", 5))
+    pool.start()
+    return pool
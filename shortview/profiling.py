@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+
+from asgiref.sync import iscoroutinefunction
+from itertools import count
+from pathlib import Path
+import cProfile
+import datetime
+import os
+import pstats
+
+# Sampled profiling of the requests, dumped as pstats files for the staff
+
+
+def profile_directory() -> Path:
+    return Path(getattr(settings, "PROFILER_DIR", settings.BASE_DIR / "profiles"))
+
+
+def list_profiles() -> list[Path]:
+    """
+    the profile dumps, the newest first
+    """
+    directory = profile_directory()
+    if not directory.is_dir():
+        return []
+    return sorted(directory.glob("*.prof"), key=lambda path: path.stat().st_mtime, reverse=True)
+
+
+def rotate_profiles(keep:int):
+    """
+    delete the oldest dumps, keeping the newest ones
+    """
+    for path in list_profiles()[keep:]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass  # already deleted by another worker
+
+
+def top_functions(path:Path, limit:int=50) -> list[dict]:
+    """
+    the functions of a dump with the highest cumulative time
+    """
+    stats = pstats.Stats(str(path))
+    rows = [{"function": pstats.func_std_string(function), "calls": calls, "primitive_calls": primitive_calls,
+             "total_ms": total * 1000, "cumulative_ms": cumulative * 1000}
+            for function, (primitive_calls, calls, total, cumulative, _) in stats.stats.items()]
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:limit]
+
+
+class ProfilerMiddleware(MiddlewareMixin):
+    """
+    profile one request out of PROFILER_SAMPLE_RATE for the views named in PROFILER_URL_NAMES,
+    and the requests of staff users carrying the PROFILER_HEADER header
+    must be the last middleware, as the view is called from process_view, removed when PROFILER_ENABLED is False
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, "PROFILER_ENABLED", False):
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+        self.sample_rate = max(0, getattr(settings, "PROFILER_SAMPLE_RATE", 100))  # 0 to only profile with the header
+        self.url_names = set(getattr(settings, "PROFILER_URL_NAMES", []))
+        self.header = getattr(settings, "PROFILER_HEADER", "X-Profile")
+        self.keep = getattr(settings, "PROFILER_KEEP", 50)
+        self._requests = {url_name: count() for url_name in self.url_names}  # sampled separately for each view
+
+    def should_profile(self, request, view_func) -> bool:
+        if iscoroutinefunction(view_func):
+            return False  # cProfile only follows the code run synchronously
+        if self.header and request.headers.get(self.header) and request.user.is_staff:
+            return True
+        requests = self._requests.get(request.resolver_match.url_name)
+        return requests is not None and self.sample_rate > 0 and next(requests) % self.sample_rate == 0
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.should_profile(request, view_func):
+            return None
+        profiler = cProfile.Profile()
+        response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+        try:
+            self.dump(profiler, request.resolver_match.url_name or "view")
+        except OSError as e:
+            print(f"\n/!\\ Could not write the request profile: {e}")
+        return response
+
+    def dump(self, profiler:cProfile.Profile, url_name:str):
+        directory = profile_directory()
+        directory.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        profiler.dump_stats(directory / f"{timestamp}-{url_name}-{os.getpid()}.prof")
+        rotate_profiles(self.keep)
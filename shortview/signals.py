@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+
+from .models import Profile, Link
+from .linkcache import link_cache
+from . import archive
+
+# Signal handlers, connected when the app is ready
+
+@receiver([post_save, post_delete], sender=Link)
+def invalidate_cached_link(sender, instance:Link, **kwargs):
+    """
+    drop a link from the redirect cache when it is modified or deleted
+    """
+    link_cache.invalidate(instance.id)
+
+
+@receiver(post_delete, sender=Link)
+def forget_archived_clicks(sender, instance:Link, **kwargs):
+    """
+    purge the archived clicks of a deleted link, whether it was deleted alone, with its owner or as expired
+    """
+    link_id = instance.id
+    if archive.archived_count(link_id):
+        transaction.on_commit(lambda: archive.forget_links([link_id]))
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def invalidate_cached_owner_links(sender, instance:Profile, **kwargs):
+    """
+    drop the links of a user from the redirect cache when the default notification mode may have changed
+    """
+    link_cache.invalidate_owner(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance:User, created:bool, **kwargs):
+    """
+    give every new user a profile with the default preferences
+    """
+    if created:
+        Profile.objects.get_or_create(user=instance)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """
+    apply the SQLITE_PRAGMAS setting to each new SQLite connection
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
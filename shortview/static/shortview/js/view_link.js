@@ -24,3 +24,131 @@ var notify_form = document.getElementById("link_notify_form");
 function change_notify() {
     notify_form.submit();
 }
+
+
+// load the next trackers when the end of the table is reached
+var load_more = document.getElementById("load_more");
+var trackers_body = document.getElementById("trackers_body");
+var loading_trackers = false;
+
+function add_tracker_row(number, tracker) {
+    var row = trackers_body.insertRow();
+    row.insertCell().textContent = number;
+    row.insertCell().textContent = tracker.date;
+    var ip_link = document.createElement("a");
+    ip_link.target = "_blank";
+    ip_link.href = "https://whatismyipaddress.com/ip/" + encodeURIComponent(tracker.ip);
+    ip_link.textContent = tracker.ip;
+    row.insertCell().appendChild(ip_link);
+    row.insertCell().textContent = tracker.country || "-";
+    row.insertCell().textContent = tracker.asn ? "AS" + tracker.asn : "-";
+    var header_link = document.createElement("a");
+    header_link.target = "_blank";
+    header_link.href = tracker.header_url;
+    header_link.className = "headerlink";
+    header_link.textContent = gettext("See headers content");
+    row.insertCell().appendChild(header_link);
+}
+
+function load_trackers() {
+    if (loading_trackers || !load_more.dataset.cursor) {
+        return;
+    }
+    loading_trackers = true;
+    fetch(load_more.dataset.url + "?cursor=" + encodeURIComponent(load_more.dataset.cursor))
+        .then((response) => response.json())
+        .then((data) => {
+            var offset = parseInt(load_more.dataset.offset);
+            data.trackers.forEach((tracker, index) => add_tracker_row(offset + index + 1, tracker));
+            load_more.dataset.offset = offset + data.trackers.length;
+            if (data.next) {
+                load_more.dataset.cursor = data.next;
+            } else {
+                load_more.remove();
+                load_more.dataset.cursor = "";
+            }
+        })
+        .finally(() => {
+            loading_trackers = false;
+            // keep loading if the new rows don't fill the screen
+            if (load_more.dataset.cursor && load_more.getBoundingClientRect().top < window.innerHeight) {
+                load_trackers();
+            }
+        });
+}
+
+if (load_more !== null && "IntersectionObserver" in window) {
+    new IntersectionObserver((entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) {
+            load_trackers();
+        }
+    }).observe(load_more);
+}
+
+
+// draw the number of clicks over time as a bar chart
+var clicks_chart = document.getElementById("clicks_chart");
+var chart_interval = document.getElementById("chart_interval");
+
+function draw_chart(series) {
+    var context = clicks_chart.getContext("2d");
+    var width = clicks_chart.width, height = clicks_chart.height - 20;
+    context.clearRect(0, 0, clicks_chart.width, clicks_chart.height);
+    if (series.length === 0) {
+        return;
+    }
+    var max_clicks = Math.max(...series.map((point) => point.clicks));
+    var bar_width = width / series.length;
+    context.fillStyle = getComputedStyle(clicks_chart).color;
+    context.font = "12px sans-serif";
+    series.forEach((point, index) => {
+        var bar_height = point.clicks / max_clicks * (height - 15);
+        context.fillRect(index * bar_width + 1, height - bar_height, Math.max(bar_width - 2, 1), bar_height);
+    });
+    context.fillText(max_clicks, 2, 12);
+    context.fillText(new Date(series[0].start).toLocaleString(), 2, clicks_chart.height - 4);
+    var last_label = new Date(series[series.length - 1].start).toLocaleString();
+    context.fillText(last_label, width - context.measureText(last_label).width - 2, clicks_chart.height - 4);
+}
+
+function load_chart() {
+    fetch(clicks_chart.dataset.url + "?interval=" + chart_interval.value)
+        .then((response) => response.json())
+        .then((data) => draw_chart(data.series));
+}
+
+if (clicks_chart !== null) {
+    load_chart();
+}
+
+
+// show the most frequent referrers, browsers, languages... of the clicks
+var breakdown_dimension = document.getElementById("breakdown_dimension");
+var breakdown_body = document.getElementById("breakdown_body");
+
+function add_breakdown_row(label, clicks, total) {
+    var row = breakdown_body.insertRow();
+    row.insertCell().textContent = label;
+    row.insertCell().textContent = clicks;
+    row.insertCell().textContent = (clicks / total * 100).toFixed(1) + " %";
+}
+
+function load_breakdown() {
+    var dimension = breakdown_dimension.value;
+    fetch(breakdown_dimension.dataset.url + "?dimension=" + dimension)
+        .then((response) => response.json())
+        .then((data) => {
+            breakdown_body.replaceChildren();
+            data.values.forEach((item) => {
+                var label = item.value === "" || item.value === null ? gettext("Unknown") : (dimension === "asn" ? "AS" + item.value : item.value);
+                add_breakdown_row(label, item.clicks, data.total);
+            });
+            if (data.other > 0) {
+                add_breakdown_row(gettext("Others"), data.other, data.total);
+            }
+        });
+}
+
+if (breakdown_dimension !== null) {
+    load_breakdown();
+}
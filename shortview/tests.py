@@ -1,3 +1,1473 @@
-from django.test import TestCase
+from django.test import TestCase, Client, AsyncClient, override_settings
+from unittest import skipUnless, mock
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, DatabaseError
+from django.core.cache import cache
+from django.core import mail, signing
+from django.core.management import call_command
+from django.core.exceptions import MiddlewareNotUsed
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.urls import reverse, resolve, clear_url_caches
+from django.apps import apps
+from django.utils import timezone
+from django.utils.formats import date_format
+
+from .models import Profile, Link, Tracker, ClickRollup, EmailOutbox, HeaderBlob, JobLease, JobRun
+from .linkcache import LinkCache, link_cache
+from .agents import AgentFilter, DEFAULT_PREVIEW_AGENTS
+from .headers import canonical_json, resolve_blobs
+from .hll import HyperLogLog
+from .dimensions import DIMENSIONS, UserAgentParser, click_dimensions, primary_language, referer_host
+from .metrics import Metrics, metrics
+from .outbox import enqueue_email, claim_batch, process_outbox
+from .jobs import send_click_digests, delete_expired_links, acquire_lease, release_lease, JobRunner, JOBS
+from . import archive, geoip, profiling, urls, views
+from .ingest import Click, ClickBuffer, store_clicks, hour_bucket
+from website import urls as website_urls
+
+import csv
+import datetime
+import gzip
+import importlib
+import io
+import json
+import math
+import os
+import tempfile
+import re
+from threading import Thread
+from urllib.parse import urlencode
 
 # Create your tests here.
+
+class HousekeepingTests(TestCase):
+    """
+    the housekeeping done for authenticated users must not make the pages slower as the user creates links
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "password")
+        self.user.profile.delete_expired = True
+        self.user.profile.save()
+        self.client.force_login(self.user)
+
+    def create_links(self, count:int):
+        now = timezone.now()
+        for index in range(count):
+            Link(owner=self.user, description=f"link {index}", date=now - datetime.timedelta(minutes=index),
+                 lifetime=datetime.timedelta(days=30)).save()
+
+    def count_queries(self, url:str) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_profile_created_with_user(self):
+        user = User.objects.create_user("bob", "bob@example.com", "password")
+        self.assertTrue(Profile.objects.filter(user=user).exists())
+
+    def test_migration_creates_missing_profiles(self):
+        create_missing_profiles = importlib.import_module("shortview.migrations.0006_create_missing_profiles").create_missing_profiles
+        Profile.objects.filter(user=self.user).delete()
+        create_missing_profiles(apps, None)
+        create_missing_profiles(apps, None)
+        self.assertEqual(Profile.objects.filter(user=self.user).count(), 1)
+
+    def test_query_count_independent_of_link_count(self):
+        for url in [reverse("index"), reverse("preferences"), reverse("new_link")]:
+            with self.subTest(url=url):
+                cache.clear()
+                self.create_links(2)
+                few_links = self.count_queries(url)
+                cache.clear()
+                self.create_links(50)
+                many_links = self.count_queries(url)
+                self.assertEqual(few_links, many_links)
+
+    def test_cleanup_is_throttled(self):
+        self.create_links(10)
+        first = self.count_queries(reverse("preferences"))
+        second = self.count_queries(reverse("preferences"))
+        self.assertLess(second, first)
+
+    def test_cleanup_deletes_expired_links(self):
+        Link(owner=self.user, date=timezone.now() - datetime.timedelta(days=2), lifetime=datetime.timedelta(days=1)).save()
+        Link(owner=self.user, date=timezone.now(), lifetime=datetime.timedelta(days=1)).save()
+        self.client.get(reverse("index"))
+        self.assertEqual(self.user.link_set.count(), 1)
+
+
+class PreviewAgentTests(TestCase):
+    """
+    the apps building link previews and the crawlers must be recognized, and real browsers must not
+    """
+    PREVIEW_AGENTS = [
+        "WhatsApp/2.23.20.0",
+        "WhatsApp/2.2407.3 i",
+        "Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)",
+        "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)",
+        "Slack-ImgProxy (+https://api.slack.com/robots)",
+        "TelegramBot (like TwitterBot)",
+        "Twitterbot/1.0",
+        "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+        "facebookexternalhit/1.1 Facebot Twitterbot/1.0",
+        "LinkedInBot/1.0 (compatible; Mozilla/5.0; Apache-HttpClient +http://www.linkedin.com)",
+        "Mozilla/5.0 (Windows NT 6.1; WOW64) SkypeUriPreview Preview/0.5 skype-url-preview@microsoft.com",
+        "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+        "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.1.1 Safari/605.1.15 (Applebot/0.1; +http://www.apple.com/go/applebot)",
+        "Mozilla/5.0 (compatible; Pinterestbot/1.0; +http://www.pinterest.com/bot.html)",
+        "Pinterest/0.2 (+https://www.pinterest.com/bot.html)",
+        "Viber-Url-Downloader",
+        "Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; GPTBot/1.1; +https://openai.com/gptbot)",
+        "curl/8.5.0",
+        "python-requests/2.32.3",
+    ]
+    BROWSER_AGENTS = [
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+        "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1",
+        "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36 Edg/126.0.2592.87",
+        "Mozilla/5.0 (Linux; Android 13; SM-S911B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/25.0 Chrome/121.0.0.0 Mobile Safari/537.36",
+        "Mozilla/5.0 (Linux; Android 10; CUBOT_X30) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15",
+        # in-app browsers of the apps which also have a preview bot
+        "Mozilla/5.0 (Linux; Android 13; SM-A536B Build/TP1A.220624.014; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/120.0.6099.230 Mobile Safari/537.36 [Pinterest/Android]",
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 17_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 [Pinterest/iOS]",
+        "Mozilla/5.0 (Linux; Android 12; Pixel 6 Build/SQ3A.220705.004; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/120.0.6099.144 Mobile Safari/537.36 Viber/21.0.0.0",
+    ]
+
+    def setUp(self):
+        link_cache.clear()
+        self.filter = AgentFilter(DEFAULT_PREVIEW_AGENTS)
+        owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = Link.objects.create(owner=owner, destination="https://example.com/", date=timezone.now())
+
+    def test_preview_agents_are_filtered(self):
+        for user_agent in self.PREVIEW_AGENTS:
+            with self.subTest(user_agent=user_agent):
+                self.assertIsNotNone(self.filter.classify(user_agent))
+
+    def test_browsers_are_not_filtered(self):
+        for user_agent in self.BROWSER_AGENTS:
+            with self.subTest(user_agent=user_agent):
+                self.assertIsNone(self.filter.classify(user_agent))
+
+    def test_filtered_requests_are_counted_by_rule(self):
+        self.filter.filter("WhatsApp/2.23.20.0")
+        self.filter.filter("WhatsApp/2.23.20.0")
+        self.filter.filter("Twitterbot/1.0")
+        self.filter.filter(self.BROWSER_AGENTS[0])
+        self.assertEqual(self.filter.stats()["filtered"], {"whatsapp": 2, "twitter": 1})
+
+    def test_redirect_without_user_agent(self):
+        response = self.client.get(reverse("redirect_link", args=[self.link.id]))
+        self.assertRedirects(response, "https://example.com/", fetch_redirect_response=False)
+        self.assertEqual(Tracker.objects.count(), 0)
+
+    def test_preview_is_not_logged(self):
+        self.client.get(reverse("redirect_link", args=[self.link.id]), HTTP_USER_AGENT=self.PREVIEW_AGENTS[0])
+        self.client.get(reverse("redirect_link", args=[self.link.id]), HTTP_USER_AGENT=self.BROWSER_AGENTS[0])
+        self.assertEqual(Tracker.objects.count(), 1)
+
+
+@skipUnless(connection.vendor == "sqlite", "the query plans are checked with SQLite")
+class QueryPlanTests(TestCase):
+    """
+    the queries of the main views must search the links and trackers through an index, never scan their tables
+    """
+    def setUp(self):
+        cache.clear()
+        link_cache.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "password")
+        self.client.force_login(self.user)
+        now = timezone.now()
+        self.link = Link.objects.create(owner=self.user, destination="https://example.com/", date=now - datetime.timedelta(days=1))
+        blob_ids, _ = resolve_blobs([canonical_json({"User-Agent": "Mozilla/5.0"})])
+        self.trackers = Tracker.objects.bulk_create([Tracker(link=self.link, ip=f"10.0.0.{index}", header_blob_id=blob_ids[0],
+                                                             date=now - datetime.timedelta(minutes=index)) for index in range(5)])
+
+    def table_scans(self, url:str) -> list[str]:
+        """
+        the lines of the query plans of a page showing a full scan of the links or trackers
+        """
+        def get():
+            response = self.client.get(url)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        return self.function_table_scans(get)
+
+    def function_table_scans(self, function, sorts:bool=False) -> list[str]:
+        """
+        the lines of the query plans of the queries made by a function showing a full scan of the links or trackers,
+        and a sort if sorts is True
+        """
+        with CaptureQueriesContext(connection) as context:
+            function()
+        scans = []
+        for query in context.captured_queries:
+            if not query["sql"].startswith("SELECT"):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                for row in cursor.fetchall():
+                    if re.match(r"SCAN (shortview_link|shortview_tracker)\b", row[-1]) or (sorts and "TEMP B-TREE" in row[-1]):
+                        scans.append(f"{row[-1]} in {query['sql']}")
+        return scans
+
+    def test_views_use_indexes(self):
+        for url in [reverse("index"), reverse("view_link", args=[self.link.id]), reverse("link_trackers", args=[self.link.id]),
+                    reverse("link_stats", args=[self.link.id]), reverse("link_breakdown", args=[self.link.id]) + "?dimension=ua_family",
+                    reverse("view_tracker", args=[self.link.id, self.trackers[0].id]),
+                    reverse("export_link", args=[self.link.id]) + "?format=ndjson&headers=1"]:
+            with self.subTest(url=url):
+                self.assertEqual(self.table_scans(url), [])
+
+    def test_redirect_uses_indexes(self):
+        self.client.logout()
+        self.assertEqual(self.table_scans(reverse("redirect_link", args=[self.link.id])), [])
+
+    def test_archive_uses_indexes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(TRACKER_ARCHIVE_DIR=directory, TRACKER_RETENTION_DAYS=0):
+            self.assertEqual(self.function_table_scans(lambda: archive.archive_trackers(chunk_size=2), sorts=True), [])
+        self.assertFalse(Tracker.objects.exists())
+
+
+class QueryBudgetTests(TestCase):
+    """
+    each view has a fixed query budget, checked with a small and a larger dataset,
+    so that a query made for each link or tracker fails the test
+    """
+    SIZES = [(2, 3), (40, 60)]  # number of links, number of trackers per link
+
+    def setUp(self):
+        self.blob_ids, _ = resolve_blobs([canonical_json({"User-Agent": f"Mozilla/5.0 ({index})"}) for index in range(5)])
+
+    def seed(self, links:int, trackers:int) -> dict:
+        """
+        a user owning links with trackers, logged in the test client
+        """
+        user = User.objects.create_user(f"user{links}", f"user{links}@example.com", "password")
+        now = timezone.now()
+        link_objects = Link.objects.bulk_create([Link(owner=user, description=f"link {index}", date=now - datetime.timedelta(hours=index),
+                                                      destination="https://example.com/", click_count=trackers)
+                                                 for index in range(links)])
+        tracker_objects = Tracker.objects.bulk_create([Tracker(link=link, ip=f"10.0.{index // 256}.{index % 256}",
+                                                               date=now - datetime.timedelta(minutes=index),
+                                                               header_blob_id=self.blob_ids[index % len(self.blob_ids)])
+                                                       for link in link_objects for index in range(trackers)])
+        hours: dict[tuple[int, datetime.datetime], int] = {}
+        for tracker in tracker_objects:
+            hours[(tracker.link_id, hour_bucket(tracker.date))] = hours.get((tracker.link_id, hour_bucket(tracker.date)), 0) + 1
+        ClickRollup.objects.bulk_create([ClickRollup(link_id=link_id, bucket_start=bucket_start, count=count, unique_ips=count)
+                                         for (link_id, bucket_start), count in hours.items()])
+        self.client.force_login(user)
+        return {"link": link_objects[0], "tracker": tracker_objects[0]}
+
+    def check_budget(self, budget:int, request, status:int=200, warm_up:bool=False):
+        """
+        request the view with each dataset size, request being a function of the seeded data returning the response
+        with warm_up, the view is requested once before counting, to count the queries of the following requests
+        """
+        for links, trackers in self.SIZES:
+            with self.subTest(links=links, trackers=trackers):
+                data = self.seed(links, trackers)
+                if warm_up:
+                    request(data)
+                cache.clear()  # the expired links cleanup runs on the first request of a user, it is part of the budget
+                link_cache.clear()
+                Site.objects.clear_cache()
+                with self.assertNumQueries(budget):
+                    response = request(data)
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                self.assertEqual(response.status_code, status)
+
+    def test_index(self):
+        self.check_budget(5, lambda data: self.client.get(reverse("index")))
+
+    def test_preferences(self):
+        self.check_budget(4, lambda data: self.client.get(reverse("preferences")))
+
+    def test_new_link(self):
+        self.check_budget(4, lambda data: self.client.get(reverse("new_link")))
+
+    def test_view_link(self):
+        self.check_budget(6, lambda data: self.client.get(reverse("view_link", args=[data["link"].id])))
+
+    def test_link_trackers(self):
+        self.check_budget(5, lambda data: self.client.get(reverse("link_trackers", args=[data["link"].id])))
+
+    def test_link_stats(self):
+        # the visitor sketches of the rollups are read by a second query to count the visitors of each day
+        self.check_budget(6, lambda data: self.client.get(reverse("link_stats", args=[data["link"].id])))
+
+    def test_link_breakdown(self):
+        self.check_budget(5, lambda data: self.client.get(reverse("link_breakdown", args=[data["link"].id]) + "?dimension=language"))
+
+    def test_export_link(self):
+        self.check_budget(5, lambda data: self.client.get(reverse("export_link", args=[data["link"].id]) + "?format=ndjson&headers=1"))
+
+    def test_view_tracker(self):
+        self.check_budget(4, lambda data: self.client.get(reverse("view_tracker", args=[data["link"].id, data["tracker"].id])))
+
+    def test_link_change_notify(self):
+        self.check_budget(5, lambda data: self.client.post(reverse("link_change_notify", args=[data["link"].id]), {"notify": 3}),
+                          status=302)
+
+    def test_delete_link(self):
+        self.check_budget(7, lambda data: self.client.post(reverse("delete_link", args=[data["link"].id]), {"confirm_delete": "true"}),
+                          status=302)
+
+    def test_redirect(self):
+        # warmed up so that the header blob and the rollup of the hour exist, like for most clicks
+        self.check_budget(10, lambda data: Client(headers={"User-Agent": "Mozilla/5.0"}).get(reverse("redirect_link", args=[data["link"].id])),
+                          status=302, warm_up=True)
+
+
+class VisitorSketchTests(TestCase):
+    """
+    the estimated numbers of visitors must stay close to the exact numbers of different addresses
+    """
+    def addresses(self, count:int, start:int=0) -> list[str]:
+        return [f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}" for index in range(start, start + count)]
+
+    def assertEstimate(self, sketch:HyperLogLog, exact:int):
+        # three standard errors, the estimates are deterministic so this never fails by chance
+        tolerance = 3 * 1.04 / math.sqrt(len(sketch.registers)) * exact
+        self.assertLessEqual(abs(sketch.count() - exact), max(tolerance, 1), f"estimated {sketch.count()} instead of {exact}")
+
+    def test_estimate_matches_exact_count(self):
+        for exact in [1, 10, 100, 1000, 10000, 50000]:
+            with self.subTest(exact=exact):
+                sketch = HyperLogLog(12)
+                sketch.update(self.addresses(exact))
+                sketch.update(self.addresses(exact // 2))  # visitors coming back are not counted again
+                self.assertEstimate(sketch, exact)
+
+    def test_merged_buckets_match_union(self):
+        buckets = [self.addresses(3000, start) for start in range(0, 24000, 2000)]  # each bucket shares visitors with the next
+        merged = HyperLogLog(10)
+        for addresses in buckets:
+            sketch = HyperLogLog(10)
+            sketch.update(addresses)
+            merged.merge(HyperLogLog.from_bytes(sketch.to_bytes()))
+        union = HyperLogLog(10)
+        union.update({address for addresses in buckets for address in addresses})
+        self.assertEqual(merged.registers, union.registers)
+        self.assertEstimate(merged, 25000)
+
+    def test_merge_folds_to_lowest_precision(self):
+        precise, coarse = HyperLogLog(12), HyperLogLog(10)
+        precise.update(self.addresses(5000))
+        coarse.update(self.addresses(5000))
+        self.assertEqual(precise.fold(10).registers, coarse.registers)
+        coarse.update(self.addresses(5000, 5000))
+        self.assertEstimate(precise.merge(coarse), 10000)
+        self.assertEqual(precise.precision, 10)
+
+    def test_clicks_update_sketches(self):
+        owner = User.objects.create_user("alice", "alice@example.com", "password")
+        link = Link.objects.create(owner=owner, destination="https://example.com/", date=timezone.now())
+        start = timezone.now().replace(hour=10, minute=0) - datetime.timedelta(days=1)
+        addresses = self.addresses(40)
+        # 40 visitors during the first hour, half of them coming back during the second one
+        store_clicks([Click(link_id=link.id, notify=1, date=start + datetime.timedelta(minutes=index), ip=ip, header="{}")
+                      for index, ip in enumerate(addresses)])
+        store_clicks([Click(link_id=link.id, notify=1, date=start + datetime.timedelta(hours=1, minutes=index), ip=ip, header="{}")
+                      for index, ip in enumerate(addresses[:20])])
+        link.refresh_from_db()
+        self.assertEqual(link.click_count, 60)
+        self.assertAlmostEqual(link.unique_visitors, 40, delta=1)
+        self.assertEqual(ClickRollup.objects.filter(link=link).count(), 2)
+
+        self.client.force_login(owner)
+        series = self.client.get(reverse("link_stats", args=[link.id]) + "?interval=day").json()["series"]
+        self.assertEqual(sum(point["clicks"] for point in series), 60)
+        self.assertAlmostEqual(sum(point["unique_ips"] for point in series), 40, delta=1)
+        hours = self.client.get(reverse("link_stats", args=[link.id]) + "?interval=hour").json()["series"]
+        self.assertEqual([point["unique_ips"] for point in hours], [40, 20])
+
+
+class ClickBufferTests(TestCase):
+    """
+    the queued and spilled clicks must all be stored, once, even when storing them fails halfway
+    """
+    def setUp(self):
+        owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = Link.objects.create(owner=owner, destination="https://example.com/", date=timezone.now())
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spill_path = os.path.join(directory.name, "spill.ndjson")
+
+    def create_buffer(self, **options) -> ClickBuffer:
+        # the flusher thread only wakes up for a full batch, which the tests never queue, the clicks are flushed by the test itself
+        buffer = ClickBuffer(flush_interval=600, **options)
+        self.addCleanup(buffer.stop)
+        return buffer
+
+    def clicks(self, count:int, notify:int=1) -> list[Click]:
+        start = timezone.now() - datetime.timedelta(hours=1)
+        return [Click(link_id=self.link.id, notify=notify, date=start + datetime.timedelta(seconds=index), ip=f"10.0.0.{index}", header="{}")
+                for index in range(count)]
+
+    def test_flush_stores_queued_clicks(self):
+        buffer = self.create_buffer(batch_size=100)
+        for click in self.clicks(5):
+            buffer.put(click)
+        self.assertEqual(buffer.flush(), 5)
+        self.assertEqual(Tracker.objects.count(), 5)
+        self.assertEqual(buffer.stats(), {"size": 0, "queued": 5, "stored": 5, "dropped": 0, "spilled": 0, "failed_flushes": 0})
+
+    def test_full_queue_drops_clicks(self):
+        buffer = self.create_buffer(batch_size=100, max_size=3)
+        for click in self.clicks(5):
+            buffer.put(click)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(buffer.stats()["dropped"], 2)
+
+    def test_failed_flush_keeps_clicks(self):
+        buffer = self.create_buffer(batch_size=100)
+        for click in self.clicks(5):
+            buffer.put(click)
+        with mock.patch("shortview.ingest.store_clicks", side_effect=DatabaseError("database is locked")):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.stats()["size"], 5)
+        self.assertEqual(buffer.flush(), 5)
+        self.assertEqual(Tracker.objects.count(), 5)
+
+    def test_spilled_clicks_are_replayed(self):
+        buffer = self.create_buffer(batch_size=2, max_size=1, overflow="spill", spill_path=self.spill_path)
+        for click in self.clicks(7):
+            buffer.put(click)
+        self.assertEqual(buffer.stats()["spilled"], 6)
+        self.assertEqual(buffer.flush(), 7)
+        self.assertEqual(Tracker.objects.count(), 7)
+        self.assertFalse(os.listdir(os.path.dirname(self.spill_path)))
+
+    def test_failed_replay_resumes_after_stored_clicks(self):
+        buffer = self.create_buffer(batch_size=2, max_size=0, overflow="spill", spill_path=self.spill_path)
+        clicks = self.clicks(7)
+        for click in clicks:
+            buffer.put(click)
+        calls = []
+        def fail_second_batch(batch:list[Click]):
+            calls.append(batch)
+            if len(calls) == 2:
+                raise DatabaseError("database is locked")
+            return store_clicks(batch)
+        with mock.patch("shortview.ingest.store_clicks", side_effect=fail_second_batch):
+            self.assertRaises(DatabaseError, buffer.flush)
+        self.assertEqual(Tracker.objects.count(), 2)
+        late_click = self.clicks(1)[0]
+        buffer.put(late_click)  # spilled while the previous file is still being loaded
+        self.assertEqual(buffer.flush(), 5)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(sorted(Tracker.objects.values_list("date", flat=True)), sorted([click.date for click in clicks + [late_click]]))
+
+    def test_clicks_of_deleted_link_are_dropped(self):
+        deleted = Link.objects.create(owner=self.link.owner, destination="https://example.org/", date=timezone.now())
+        clicks = self.clicks(4)
+        clicks[1].link_id = deleted.id
+        buffer = self.create_buffer(batch_size=100)
+        for click in clicks:
+            buffer.put(click)
+        deleted.delete()
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(buffer.stats()["size"], 0)
+        self.assertEqual(Tracker.objects.count(), 3)
+        self.assertEqual(Link.objects.get(id=self.link.id).click_count, 3)
+
+    def test_spilled_clicks_of_deleted_link_are_dropped(self):
+        deleted = Link.objects.create(owner=self.link.owner, destination="https://example.org/", date=timezone.now())
+        clicks = self.clicks(3)
+        clicks[0].link_id = deleted.id
+        buffer = self.create_buffer(batch_size=2, max_size=0, overflow="spill", spill_path=self.spill_path)
+        for click in clicks:
+            buffer.put(click)
+        deleted.delete()
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(Tracker.objects.count(), 2)
+        self.assertFalse(os.listdir(os.path.dirname(self.spill_path)))
+
+    def test_failed_notification_keeps_stored_clicks(self):
+        buffer = self.create_buffer(batch_size=100)
+        buffer.put(self.clicks(1, notify=3)[0])  # always notify
+        with mock.patch("shortview.ingest.notify_click", side_effect=DatabaseError("database is locked")), mock.patch("builtins.print"):
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.stats()["size"], 0)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(Tracker.objects.count(), 1)
+        self.assertEqual(Link.objects.get(id=self.link.id).click_count, 1)
+
+
+@override_settings(EMAIL_OUTBOX_RETRY_DELAY=60, EMAIL_OUTBOX_MAX_ATTEMPTS=3)
+class OutboxTests(TestCase):
+    """
+    each email of the outbox must be sent once, and the failed ones retried later until the maximum number of attempts
+    """
+    def enqueue(self, count:int) -> list[EmailOutbox]:
+        return [enqueue_email(f"subject {index}", "shortview@example.com", "alice@example.com", "text") for index in range(count)]
+
+    def test_emails_are_sent_once(self):
+        self.enqueue(3)
+        self.assertEqual(process_outbox(batch_size=10), 3)
+        self.assertEqual(process_outbox(batch_size=10), 0)
+        self.assertEqual(sorted(message.subject for message in mail.outbox), ["subject 0", "subject 1", "subject 2"])
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.SENT).count(), 3)
+
+    def test_claimed_emails_are_not_claimed_again(self):
+        self.enqueue(3)
+        self.assertEqual(len(claim_batch("first", 2)), 2)
+        self.assertEqual(len(claim_batch("second", 10)), 1)
+        self.assertEqual(claim_batch("third", 10), [])
+
+    def test_stale_claims_are_claimed_again(self):
+        self.enqueue(1)
+        claim_batch("dead worker", 10)
+        EmailOutbox.objects.update(claimed_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual([email.claimed_by for email in claim_batch("worker", 10)], ["worker"])
+
+    def test_failed_emails_are_retried_then_abandoned(self):
+        email, = self.enqueue(1)
+        backend = mock.Mock()
+        backend.send_messages.side_effect = ConnectionError("connection refused")
+        with mock.patch("shortview.outbox.get_connection", return_value=backend):
+            for attempt in range(1, 4):
+                EmailOutbox.objects.filter(id=email.id).update(next_attempt_at=timezone.now())  # skip the backoff
+                self.assertEqual(process_outbox(batch_size=10), 1)
+                email.refresh_from_db()
+                self.assertEqual(email.attempts, attempt)
+                if attempt < 3:
+                    self.assertEqual(email.status, EmailOutbox.PENDING)
+                    self.assertGreater(email.next_attempt_at, timezone.now() + datetime.timedelta(seconds=60 * 2 ** (attempt - 1) - 5))
+        self.assertEqual(email.status, EmailOutbox.FAILED)
+        self.assertEqual(email.last_error, "ConnectionError: connection refused")
+        self.assertEqual(process_outbox(batch_size=10), 0)
+        self.assertEqual(mail.outbox, [])
+
+
+class DigestTests(TestCase):
+    """
+    every click of a link sending digests must be in exactly one digest
+    """
+    def setUp(self):
+        owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = Link.objects.create(owner=owner, destination="https://example.com/", date=timezone.now(), notify_click=4)
+
+    def click(self, date:datetime.datetime, ip:str="10.0.0.1"):
+        store_clicks([Click(link_id=self.link.id, notify=4, date=date, ip=ip, header="{}")])
+
+    def digest_subjects(self) -> list[str]:
+        return list(EmailOutbox.objects.order_by("id").values_list("subject", flat=True))
+
+    def test_digest_sent_once_window_is_over(self):
+        start = timezone.now() - datetime.timedelta(hours=2)
+        self.click(start)
+        self.click(start + datetime.timedelta(minutes=5), "10.0.0.2")
+        self.assertEqual(send_click_digests(), 1)
+        self.assertEqual(send_click_digests(), 0)
+        self.assertEqual(len(self.digest_subjects()), 1)
+        self.assertIn("clicked 2 times", self.digest_subjects()[0])
+        self.link.refresh_from_db()
+        self.assertIsNone(self.link.digest_due_at)
+
+    def test_window_not_over(self):
+        self.click(timezone.now())
+        self.assertEqual(send_click_digests(), 0)
+
+    def test_late_clicks_are_in_a_digest(self):
+        start = timezone.now() - datetime.timedelta(hours=2)
+        self.click(start)
+        # stored after the window is over but before the digest is sent, with a date after the start of the job
+        self.click(timezone.now() + datetime.timedelta(seconds=1))
+        send_click_digests()
+        self.assertIn("clicked 2 times", self.digest_subjects()[0])
+        self.click(timezone.now())
+        self.link.refresh_from_db()
+        self.assertIsNotNone(self.link.digest_due_at)  # the next click opens a new window
+
+
+class ExportTests(TestCase):
+    """
+    the exported click logs must hold every click of the link in the requested range, in chronological order
+    """
+    def setUp(self):
+        self.owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = Link.objects.create(owner=self.owner, destination="https://example.com/", date=timezone.now())
+        self.start = timezone.now().replace(microsecond=0) - datetime.timedelta(days=3)
+        store_clicks([Click(link_id=self.link.id, notify=1, date=self.start + datetime.timedelta(days=index), ip=f"10.0.0.{index}",
+                            header=canonical_json({"User-Agent": f"agent {index % 2}"})) for index in range(3)])
+        self.client.force_login(self.owner)
+
+    def export(self, query:str) -> bytes:
+        response = self.client.get(reverse("export_link", args=[self.link.id]) + query)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export("?format=csv").decode("utf-8"))))
+        self.assertEqual([row["ip"] for row in rows], ["10.0.0.0", "10.0.0.1", "10.0.0.2"])
+        self.assertEqual(list(rows[0]), ["id", "date", "ip", "country", "asn"])
+
+    def test_ndjson_with_headers_and_gzip(self):
+        rows = [json.loads(line) for line in gzip.decompress(self.export("?format=ndjson&headers=1&gzip=1")).splitlines()]
+        self.assertEqual([row["header"] for row in rows], [{"User-Agent": "agent 0"}, {"User-Agent": "agent 1"}, {"User-Agent": "agent 0"}])
+
+    def test_legacy_inline_headers(self):
+        Tracker.objects.filter(ip="10.0.0.1").update(header_blob=None, header=json.dumps({"User-Agent": "legacy"}, indent=2))
+        Tracker.objects.filter(ip="10.0.0.2").update(header_blob=None, header="{'not': json}")
+        rows = [json.loads(line) for line in self.export("?format=ndjson&headers=1").splitlines()]
+        self.assertEqual([row["header"] for row in rows], [{"User-Agent": "agent 0"}, {"User-Agent": "legacy"}, {"raw": "{'not': json}"}])
+
+    def test_date_range(self):
+        day = timezone.localtime(self.start + datetime.timedelta(days=1))
+        # a date as end bound includes the whole day
+        rows = [json.loads(line) for line in self.export(f"?format=ndjson&start={day.date()}&end={day.date()}").splitlines()]
+        self.assertEqual([row["ip"] for row in rows], ["10.0.0.1"])
+        query = urlencode({"format": "ndjson", "start": (day - datetime.timedelta(days=1)).isoformat(), "end": day.isoformat()})
+        rows = [json.loads(line) for line in self.export(f"?{query}").splitlines()]
+        self.assertEqual([row["ip"] for row in rows], ["10.0.0.0"])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(reverse("export_link", args=[self.link.id]) + "?format=xml").status_code, 400)
+        self.assertEqual(self.client.get(reverse("export_link", args=[self.link.id]) + "?start=yesterday").status_code, 400)
+        self.client.force_login(User.objects.create_user("bob", "bob@example.com", "password"))
+        self.assertEqual(self.client.get(reverse("export_link", args=[self.link.id])).status_code, 403)
+
+
+class ArchiveTests(TestCase):
+    """
+    the archived clicks must be read back and still counted, and purged with their link
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(TRACKER_ARCHIVE_DIR=directory.name, TRACKER_RETENTION_DAYS=30)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = self.create_link(self.owner)
+
+    def create_link(self, owner:User, **fields) -> Link:
+        link = Link.objects.create(owner=owner, destination="https://example.com/", date=timezone.now() - datetime.timedelta(days=90), **fields)
+        old = timezone.now().replace(minute=0) - datetime.timedelta(days=40)
+        # 35 old clicks from 7 visitors over 3 hours, 5 recent ones from 2 of them
+        store_clicks([Click(link_id=link.id, notify=1, date=old + datetime.timedelta(minutes=5 * index), ip=f"10.0.0.{index % 7}",
+                            header=canonical_json({"User-Agent": f"agent {index}"})) for index in range(35)])
+        store_clicks([Click(link_id=link.id, notify=1, date=timezone.now() - datetime.timedelta(hours=index), ip=f"10.0.0.{index % 2}",
+                            header="{}") for index in range(5)])
+        return link
+
+    def counters(self, link:Link) -> tuple:
+        link.refresh_from_db()
+        rollups = list(ClickRollup.objects.filter(link=link).order_by("bucket_start").values_list("bucket_start", "count", "unique_ips"))
+        return link.click_count, link.first_click_at, link.last_click_at, link.unique_visitors, rollups
+
+    def test_archive_and_read_back(self):
+        self.assertEqual(archive.archive_trackers(chunk_size=10), 35)
+        self.assertEqual(Tracker.objects.filter(link=self.link).count(), 5)
+        self.assertEqual(archive.archived_count(self.link.id), 35)
+        rows = list(archive.read_link(self.link.id))
+        self.assertEqual([row["header"]["User-Agent"] for row in rows], [f"agent {index}" for index in range(35)])
+        self.assertEqual(archive.archive_trackers(), 0)
+        self.assertEqual(self.counters(self.link)[0], 40)
+
+    def test_retention_of_owner(self):
+        self.owner.profile.tracker_retention = 60
+        self.owner.profile.save()
+        self.assertEqual(archive.archive_trackers(), 0)
+
+    def test_recount_includes_archived_clicks(self):
+        before = self.counters(self.link)
+        archive.archive_trackers()
+        call_command("recount_clicks", stdout=io.StringIO())
+        call_command("rebuild_rollups", stdout=io.StringIO())
+        self.assertEqual(self.counters(self.link), before)
+        self.assertEqual(before[0], 40)
+        self.assertEqual(len(before[4]), 8)
+
+    def assertPurged(self, link_id:int, entries:list):
+        self.assertEqual(archive.archived_count(link_id), 0)
+        self.assertEqual(list(archive.read_link(link_id)), [])
+        for month, offset, length in entries:
+            if archive.data_path(month).exists():
+                with open(archive.data_path(month), "rb") as file:
+                    file.seek(offset)
+                    self.assertEqual(file.read(length), bytes(length))
+
+    def archived_entries(self, link_id:int) -> list:
+        return [(month, offset, length) for month in archive.archived_months()
+                for offset, length, _ in archive.load_index(month).get(str(link_id), [])]
+
+    def test_deleted_link_is_purged(self):
+        other_link = self.create_link(self.owner)
+        archive.archive_trackers()
+        entries = self.archived_entries(self.link.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.delete()
+        self.assertPurged(self.link.id, entries)
+        self.assertEqual(len(list(archive.read_link(other_link.id))), 35)
+        with self.captureOnCommitCallbacks(execute=True):
+            other_link.delete()
+        self.assertEqual(archive.archived_months(), [])
+
+    def test_links_of_deleted_owner_are_purged(self):
+        archive.archive_trackers()
+        entries = self.archived_entries(self.link.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.delete()
+        self.assertPurged(self.link.id, entries)
+
+    def test_expired_links_are_purged(self):
+        self.owner.profile.delete_expired = True
+        self.owner.profile.save()
+        expired_link = self.create_link(self.owner, lifetime=datetime.timedelta(days=1))
+        archive.archive_trackers()
+        entries = self.archived_entries(expired_link.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(delete_expired_links(self.owner), 1)
+        self.assertPurged(expired_link.id, entries)
+        self.assertEqual(archive.archived_count(self.link.id), 35)
+
+    def test_interrupted_purge_is_resumed(self):
+        archive.archive_trackers()
+        entries = self.archived_entries(self.link.id)
+        with mock.patch("shortview.archive.purge_deleted"), self.captureOnCommitCallbacks(execute=True):
+            self.link.delete()
+        self.assertEqual(list(archive.read_link(self.link.id)), [])
+        archive.archive_trackers()
+        self.assertEqual(archive.archived_months(), [])
+        self.assertPurged(self.link.id, entries)
+
+
+class GeoIPTests(TestCase):
+    """
+    the clicks must be located from the database file, and an unreadable file must not break the ingestion
+    """
+    DATABASE = ("range_start\trange_end\tAS_number\tcountry_code\tAS_description\n"
+                "1.0.0.0\t1.0.0.255\t13335\tUS\tCLOUDFLARENET\n"
+                "2.0.0.0\t2.15.255.255\t3215\tFR\tOrange\n"
+                "10.0.0.0\t10.255.255.255\t0\tNone\tNot routed\n"
+                "2a01:cb00::\t2a01:cbff:ffff:ffff:ffff:ffff:ffff:ffff\t3215\tFR\tOrange\n")
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.addCleanup(geoip.reset)
+
+    def use_database(self, name:str, data:bytes):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as file:
+            file.write(gzip.compress(data) if name.endswith(".gz") else data)
+        settings = override_settings(GEOIP_DATABASE=path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        geoip.reset()
+
+    def test_locate(self):
+        for name in ["ip2asn-combined.tsv", "ip2asn-combined.tsv.gz"]:
+            with self.subTest(name=name):
+                self.use_database(name, self.DATABASE.encode("utf-8"))
+                self.assertEqual(geoip.locate("1.0.0.1"), ("US", 13335))
+                self.assertEqual(geoip.locate("2.3.4.5"), ("FR", 3215))
+                self.assertEqual(geoip.locate("::ffff:2.3.4.5"), ("FR", 3215))
+                self.assertEqual(geoip.locate("2a01:cb00:1234::1"), ("FR", 3215))
+                self.assertEqual(geoip.locate("10.1.2.3"), geoip.UNKNOWN)
+                self.assertEqual(geoip.locate("not an address"), geoip.UNKNOWN)
+
+    def test_unreadable_database(self):
+        for name, data in [("latin1.tsv", "1.0.0.0\t1.0.0.255\t1\tUS\tSoci\xe9t\xe9\n".encode("latin-1")),
+                           ("truncated.tsv.gz", self.DATABASE.encode("utf-8") * 100)]:
+            with self.subTest(name=name):
+                self.use_database(name, data)
+                if name.endswith(".gz"):
+                    os.truncate(os.path.join(self.directory, name), 100)
+                with mock.patch("builtins.print"):  # the error is logged
+                    self.assertEqual(geoip.locate("1.0.0.1"), geoip.UNKNOWN)
+                self.assertIsNone(geoip.database())
+
+    def test_preload_at_startup(self):
+        self.use_database("ip2asn-combined.tsv", self.DATABASE.encode("utf-8"))
+        apps.get_app_config("shortview").ready()
+        self.assertIsNotNone(geoip._database)
+        with mock.patch.object(geoip, "GeoDatabase") as load:
+            self.assertEqual(geoip.locate("2.3.4.5"), ("FR", 3215))
+        load.assert_not_called()
+        geoip.reset()
+        with override_settings(GEOIP_DATABASE=None):
+            geoip.preload_database()
+        self.assertIsNone(geoip._database)
+        with override_settings(GEOIP_DATABASE=os.path.join(self.directory, "missing.tsv")), mock.patch("builtins.print"):
+            geoip.preload_database()  # doesn't break the startup
+        self.assertIsNone(geoip.database())
+
+    def test_clicks_are_located(self):
+        self.use_database("ip2asn-combined.tsv", self.DATABASE.encode("utf-8"))
+        owner = User.objects.create_user("alice", "alice@example.com", "password")
+        link = Link.objects.create(owner=owner, destination="https://example.com/", date=timezone.now())
+        store_clicks([Click(link_id=link.id, notify=1, date=timezone.now(), ip=ip, header="{}") for ip in ["2.3.4.5", "10.0.0.1"]])
+        self.assertEqual(list(Tracker.objects.order_by("id").values_list("country", "asn")), [("FR", 3215), ("", None)])
+
+
+class AsyncRedirectTests(TestCase):
+    """
+    the async redirect view served with ASYNC_REDIRECT must behave like the sync one
+    """
+    def setUp(self):
+        link_cache.clear()
+        with self.settings(ASYNC_REDIRECT=True):
+            self.reload_urls()
+        self.addCleanup(self.reload_urls)
+        self.owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = Link.objects.create(owner=self.owner, destination="https://example.com/", date=timezone.now())
+        self.url = reverse("redirect_link", args=[self.link.id])
+        self.client = AsyncClient()
+
+    @staticmethod
+    def reload_urls():
+        # the view is chosen when the url patterns are imported
+        importlib.reload(urls)
+        importlib.reload(website_urls)
+        clear_url_caches()
+
+    async def test_async_view_is_used(self):
+        self.assertIs(resolve(self.url).func, views.aredirect_link)
+
+    async def test_click_is_stored(self):
+        response = await self.client.get(self.url, headers={"User-Agent": PreviewAgentTests.BROWSER_AGENTS[0], "Referer": "https://news.example.org/a"})
+        self.assertRedirects(response, "https://example.com/", fetch_redirect_response=False)
+        tracker = await Tracker.objects.aget(link=self.link)
+        self.assertEqual((tracker.ua_family, tracker.referer_host), ("Chrome", "news.example.org"))
+        self.assertEqual((await Link.objects.aget(id=self.link.id)).click_count, 1)
+
+    async def test_cache_miss_then_hit(self):
+        await self.client.get(self.url, headers={"User-Agent": PreviewAgentTests.BROWSER_AGENTS[0]})
+        self.assertEqual((link_cache.hits, link_cache.misses), (0, 1))
+        await self.client.get(self.url, headers={"User-Agent": PreviewAgentTests.BROWSER_AGENTS[0]})
+        self.assertEqual((link_cache.hits, link_cache.misses), (1, 1))
+        self.assertEqual(await Tracker.objects.filter(link=self.link).acount(), 2)
+
+    async def test_unknown_link(self):
+        response = await self.client.get(reverse("redirect_link", args=[self.link.id + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_expired_link(self):
+        expired = await Link.objects.acreate(owner=self.owner, destination="https://example.com/",
+                                             date=timezone.now() - datetime.timedelta(days=2), lifetime=datetime.timedelta(days=1))
+        response = await self.client.get(reverse("redirect_link", args=[expired.id]), headers={"User-Agent": PreviewAgentTests.BROWSER_AGENTS[0]})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(await Tracker.objects.aexists())
+
+    async def test_preview_agent_is_not_logged(self):
+        response = await self.client.get(self.url, headers={"User-Agent": PreviewAgentTests.PREVIEW_AGENTS[0]})
+        self.assertRedirects(response, "https://example.com/", fetch_redirect_response=False)
+        self.assertFalse(await Tracker.objects.aexists())
+
+    async def test_owner_click_is_not_logged(self):
+        await self.client.aforce_login(self.owner)
+        response = await self.client.get(self.url, headers={"User-Agent": PreviewAgentTests.BROWSER_AGENTS[0]})
+        self.assertRedirects(response, "https://example.com/", fetch_redirect_response=False)
+        self.assertFalse(await Tracker.objects.aexists())
+
+
+class JobTests(TestCase):
+    """
+    a single runner must hold the jobs lease at a time, and each run must be recorded
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(TRACKER_ARCHIVE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_lease_is_exclusive(self):
+        self.assertTrue(acquire_lease("first", 60))
+        self.assertFalse(acquire_lease("second", 60))
+        self.assertEqual(JobLease.objects.get().holder, "first")
+
+    def test_lease_is_renewed_by_its_holder(self):
+        self.assertTrue(acquire_lease("first", 60))
+        lease = JobLease.objects.get()
+        self.assertTrue(acquire_lease("first", 600))
+        renewed = JobLease.objects.get()
+        self.assertEqual(renewed.acquired_at, lease.acquired_at)
+        self.assertGreater(renewed.expires_at, lease.expires_at)
+
+    def test_expired_lease_is_taken_over(self):
+        self.assertTrue(acquire_lease("first", 60))
+        JobLease.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertTrue(acquire_lease("second", 60))
+        self.assertFalse(acquire_lease("first", 60))
+        self.assertEqual(JobLease.objects.get().holder, "second")
+
+    def test_released_lease_is_taken_over(self):
+        self.assertTrue(acquire_lease("first", 60))
+        release_lease("second")  # only the holder can release it
+        self.assertFalse(acquire_lease("second", 60))
+        release_lease("first")
+        self.assertTrue(acquire_lease("second", 60))
+
+    def test_runs_are_recorded(self):
+        runner = JobRunner(holder="first")
+        self.assertEqual(runner.run_job("test", lambda limit: 7), 7)
+        self.assertEqual(runner.run_job("test", lambda limit: 3), 3)
+        run = JobRun.objects.get(name="test")
+        self.assertEqual((run.holder, run.runs, run.failures, run.last_rows, run.last_error), ("first", 2, 0, 3, ""))
+
+    def test_failed_runs_are_recorded(self):
+        def failing_job(limit:int) -> int:
+            raise ValueError("no more space")
+        runner = JobRunner(holder="first")
+        with mock.patch("builtins.print"):
+            self.assertEqual(runner.run_job("test", failing_job), 0)
+        run = JobRun.objects.get(name="test")
+        self.assertEqual((run.runs, run.failures, run.last_rows, run.last_error), (1, 1, 0, "ValueError: no more space"))
+        runner.run_job("test", lambda limit: 1)
+        run = JobRun.objects.get(name="test")
+        self.assertEqual((run.runs, run.failures, run.last_rows, run.last_error), (2, 1, 1, ""))
+
+    def test_job_is_skipped_without_the_lease(self):
+        self.assertTrue(acquire_lease("first", 60))
+        job = mock.Mock(return_value=5)
+        self.assertEqual(JobRunner(holder="second").run_job("test", job), 0)
+        job.assert_not_called()
+        self.assertFalse(JobRun.objects.exists())
+
+    def test_batch_size_is_the_limit(self):
+        job = mock.Mock(return_value=5)
+        JobRunner(holder="first", batch_size=5).run_job("test", job)
+        job.assert_called_once_with(limit=5)
+
+    def test_runjobs_once(self):
+        output = io.StringIO()
+        call_command("runjobs", "--once", stdout=output)
+        self.assertEqual(set(JobRun.objects.values_list("name", flat=True)), set(JOBS))
+        self.assertIn("check_profiles: 0 rows", output.getvalue())
+        self.assertEqual(JobLease.objects.get().holder, "")  # released for the long running workers
+
+    def test_runjobs_once_without_the_lease(self):
+        self.assertTrue(acquire_lease("worker", 60))
+        errors = io.StringIO()
+        call_command("runjobs", "--once", stdout=io.StringIO(), stderr=errors)
+        self.assertIn("held by another worker", errors.getvalue())
+        self.assertFalse(JobRun.objects.exists())
+
+
+class LinkStatsTests(TestCase):
+    """
+    the click series must have a point for each period, with or without clicks, so that the chart keeps the time scale
+    """
+    def setUp(self):
+        user = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = Link.objects.create(owner=user, destination="https://example.com/", date=timezone.now() - datetime.timedelta(days=30))
+        self.client.force_login(user)
+
+    def add_rollup(self, date:datetime.datetime, count:int):
+        ClickRollup.objects.create(link=self.link, bucket_start=hour_bucket(date), count=count, unique_ips=count)
+
+    def series(self, **parameters) -> list[dict]:
+        response = self.client.get(reverse("link_stats", args=[self.link.id]) + "?" + urlencode(parameters))
+        self.assertEqual(response.status_code, 200)
+        return response.json()["series"]
+
+    def test_gap_is_filled_with_zeros(self):
+        now = timezone.now()
+        self.add_rollup(now - datetime.timedelta(days=7), 3)
+        self.add_rollup(now, 2)
+        series = self.series(interval="day")
+        self.assertEqual([point["clicks"] for point in series], [3, 0, 0, 0, 0, 0, 0, 2])
+        starts = [datetime.datetime.fromisoformat(point["start"]) for point in series]
+        self.assertEqual(starts[0], timezone.localtime(now - datetime.timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0))
+        self.assertTrue(all(timezone.localtime(start).time() == datetime.time() for start in starts))
+
+    def test_requested_range_is_filled(self):
+        # the days keep starting at midnight when the clocks go back, on the 25th
+        self.add_rollup(timezone.make_aware(datetime.datetime(2026, 10, 22, 12)), 4)
+        series = self.series(interval="day", start="2026-10-20", end="2026-10-27")
+        self.assertEqual([point["start"][:10] for point in series], [f"2026-10-{day}" for day in range(20, 28)])
+        self.assertEqual([point["clicks"] for point in series], [0, 0, 4, 0, 0, 0, 0, 0])
+        self.assertEqual(series[0]["start"], "2026-10-20T00:00:00+02:00")
+        self.assertEqual(series[-1]["start"], "2026-10-27T00:00:00+01:00")
+
+    def test_hours_and_weeks(self):
+        self.add_rollup(timezone.make_aware(datetime.datetime(2026, 10, 22, 12)), 4)
+        hours = self.series(interval="hour", start="2026-10-22T10:00", end="2026-10-22T14:00")
+        self.assertEqual([point["clicks"] for point in hours], [0, 0, 4, 0])
+        weeks = self.series(interval="week", start="2026-10-12", end="2026-10-31")
+        self.assertEqual([(point["start"][:10], point["clicks"]) for point in weeks],
+                         [("2026-10-12", 0), ("2026-10-19", 4), ("2026-10-26", 0)])
+
+    def test_range_too_long(self):
+        self.add_rollup(timezone.now(), 1)
+        response = self.client.get(reverse("link_stats", args=[self.link.id]) + "?interval=hour&start=2000-01-01")
+        self.assertEqual(response.status_code, 400)
+
+
+class MetricsTests(TestCase):
+    """
+    the request metrics must be served to the staff and to the scraper only, in the Prometheus text format
+    """
+    def setUp(self):
+        metrics.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "password")
+        self.staff = User.objects.create_user("admin", "admin@example.com", "password", is_staff=True)
+
+    def test_anonymous_and_users_are_forbidden(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get(reverse("metrics"), headers={"Authorization": "Bearer secret"}).status_code, 200)
+        self.assertEqual(self.client.get(reverse("metrics"), headers={"Authorization": "Bearer wrong"}).status_code, 403)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_no_token_configured(self):
+        self.assertEqual(self.client.get(reverse("metrics"), headers={"Authorization": "Bearer "}).status_code, 403)
+
+    def test_requests_are_counted(self):
+        self.client.force_login(self.staff)
+        for _ in range(3):
+            self.client.get(reverse("index"))
+        self.client.get("/unknown-page/")
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        lines = response.content.decode().splitlines()
+        self.assertIn("# TYPE shortview_requests_total counter", lines)
+        self.assertIn('shortview_requests_total{view="index",status="2xx"} 3', lines)
+        self.assertIn('shortview_requests_total{view="unmatched",status="4xx"} 1', lines)
+        self.assertIn('shortview_request_duration_seconds_count{view="index"} 3', lines)
+        self.assertIn('shortview_request_duration_seconds_bucket{view="index",le="+Inf"} 3', lines)
+        self.assertTrue(any(line.startswith('shortview_db_queries_total{view="index"} ') for line in lines))
+        self.assertIn("shortview_link_cache_size 0", lines)
+
+    def test_shards_of_finished_threads_are_folded(self):
+        counters = Metrics()
+        threads = [Thread(target=counters.inc, args=("test_total",)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counters.inc("test_total")
+        counters.observe("test_seconds", (), 0.002)
+        self.assertEqual(counters.collect()[0], {("test_total", ()): 21})
+        self.assertEqual(len(counters._shards), 1)
+        self.assertEqual(counters.collect()[1][("test_seconds", ())][-1], 0.002)
+
+
+class ProfilerTests(TestCase):
+    """
+    the sampled requests must be profiled and dumped, the dumps rotated, and only shown to the staff
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(PROFILER_ENABLED=True, PROFILER_DIR=self.directory, PROFILER_URL_NAMES=["index"],
+                                     PROFILER_SAMPLE_RATE=1, PROFILER_KEEP=3)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user("alice", "alice@example.com", "password")
+        self.staff = User.objects.create_user("admin", "admin@example.com", "password", is_staff=True)
+
+    def dumps(self) -> list[str]:
+        return sorted(path.name for path in profiling.list_profiles())
+
+    def test_disabled(self):
+        with override_settings(PROFILER_ENABLED=False):
+            self.assertRaises(MiddlewareNotUsed, profiling.ProfilerMiddleware, lambda request: None)
+            self.client.force_login(self.user)
+            self.client.get(reverse("index"))
+        self.assertEqual(self.dumps(), [])
+
+    def test_every_request_is_profiled_with_a_rate_of_1(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("index")).status_code, 200)
+        self.client.get(reverse("preferences"))  # not in PROFILER_URL_NAMES
+        dumps = self.dumps()
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].endswith(f"-index-{os.getpid()}.prof"))
+        functions = profiling.top_functions(profiling.list_profiles()[0])
+        self.assertTrue(any("index" in row["function"] for row in functions))
+
+    @override_settings(PROFILER_SAMPLE_RATE=0)
+    def test_no_request_is_sampled_with_a_rate_of_0(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse("index"))
+        self.assertEqual(self.dumps(), [])
+        self.client.get(reverse("index"), headers={"X-Profile": "1"})  # the header only works for the staff
+        self.assertEqual(self.dumps(), [])
+        self.client.force_login(self.staff)
+        self.client.get(reverse("preferences"), headers={"X-Profile": "1"})
+        self.assertEqual(len(self.dumps()), 1)
+
+    @override_settings(PROFILER_SAMPLE_RATE=2)
+    def test_one_request_out_of_the_rate_is_profiled(self):
+        self.client.force_login(self.user)
+        for _ in range(4):
+            self.client.get(reverse("index"))
+        self.assertEqual(len(self.dumps()), 2)
+
+    def test_oldest_dumps_are_deleted(self):
+        self.client.force_login(self.user)
+        for index in range(5):
+            self.client.get(reverse("index"))
+            for path in profiling.list_profiles():  # the dumps of a fast test would share their modification time
+                os.utime(path, (path.stat().st_mtime - 1, path.stat().st_mtime - 1))
+        self.assertEqual(len(self.dumps()), 3)
+
+    def test_profiles_are_only_shown_to_the_staff(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse("index"))
+        name = self.dumps()[0]
+        self.assertEqual(self.client.get(reverse("profiles")).status_code, 403)
+        self.assertEqual(self.client.get(reverse("profiles") + f"?name={name}&download=1").status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("profiles") + f"?name={name}")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, name)
+        self.assertTrue(response.context["functions"])
+        download = self.client.get(reverse("profiles") + f"?name={name}&download=1")
+        self.assertEqual(download.status_code, 200)
+        with open(os.path.join(self.directory, name), "rb") as file:
+            self.assertEqual(b"".join(download.streaming_content), file.read())
+        self.assertEqual(self.client.get(reverse("profiles") + "?name=../settings.py").status_code, 404)
+
+
+class ClickDimensionTests(TestCase):
+    """
+    the dimensions of a click must be extracted from its header, when it is logged and by the backfill command
+    """
+    USER_AGENTS = [
+        ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+         ("Chrome", "Windows", "desktop")),
+        ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36 Edg/126.0.2592.87",
+         ("Edge", "Windows", "desktop")),
+        ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36 OPR/111.0.0.0",
+         ("Opera", "Windows", "desktop")),
+        ("Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0", ("Firefox", "Linux", "desktop")),
+        ("Mozilla/5.0 (X11; CrOS x86_64 14541.0.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+         ("Chrome", "ChromeOS", "desktop")),
+        ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15",
+         ("Safari", "macOS", "desktop")),
+        ("Mozilla/5.0 (Windows NT 10.0; WOW64; Trident/7.0; rv:11.0) like Gecko", ("Internet Explorer", "Windows", "desktop")),
+        ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1",
+         ("Safari", "iOS", "mobile")),
+        ("Mozilla/5.0 (iPad; CPU OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/126.0.6478.54 Mobile/15E148 Safari/604.1",
+         ("Chrome", "iOS", "tablet")),
+        ("Mozilla/5.0 (Linux; Android 13; SM-S911B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/25.0 Chrome/121.0.0.0 Mobile Safari/537.36",
+         ("Samsung Internet", "Android", "mobile")),
+        ("Mozilla/5.0 (Linux; Android 13; SM-X710) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+         ("Chrome", "Android", "tablet")),
+        ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", ("Bot", "Other", "bot")),
+        ("curl/8.5.0", ("Bot", "Other", "bot")),
+        ("SomethingElse/1.0", ("Other", "Other", "")),
+        ("", ("", "", "")),
+    ]
+    REFERERS = [
+        ("https://news.example.org/a?b=c", "news.example.org"),
+        ("HTTPS://WWW.Example.COM:8080/", "www.example.com"),
+        ("android-app://com.slack/", "com.slack"),
+        ("not a url", ""),
+        ("http://[::1/", ""),
+        ("", ""),
+    ]
+    LANGUAGES = [
+        ("fr-CH, fr;q=0.9, en;q=0.8, de;q=0.7, *;q=0.5", "fr"),
+        ("en-US,en;q=0.5", "en"),
+        ("de;q=0.2, es", "es"),
+        ("en;q=abc, it;q=0.1", "it"),
+        ("*", ""),
+        ("", ""),
+    ]
+
+    def test_user_agents(self):
+        parser = UserAgentParser()
+        for user_agent, expected in self.USER_AGENTS:
+            with self.subTest(user_agent=user_agent):
+                self.assertEqual(parser.parse(user_agent), expected)
+
+    def test_referer_hosts(self):
+        for referer, expected in self.REFERERS:
+            with self.subTest(referer=referer):
+                self.assertEqual(referer_host(referer), expected)
+
+    def test_primary_languages(self):
+        for accept_language, expected in self.LANGUAGES:
+            with self.subTest(accept_language=accept_language):
+                self.assertEqual(primary_language(accept_language), expected)
+
+    def test_header_names_are_case_insensitive(self):
+        self.assertEqual(click_dimensions({"USER-AGENT": self.USER_AGENTS[0][0], "referer": "https://example.org/", "Accept-Language": "nl"}),
+                         {"referer_host": "example.org", "ua_family": "Chrome", "ua_os": "Windows", "language": "nl", "device": "desktop"})
+
+    def test_backfill_fills_old_trackers(self):
+        owner = User.objects.create_user("alice", "alice@example.com", "password")
+        link = Link.objects.create(owner=owner, destination="https://example.com/", date=timezone.now())
+        header = {"User-Agent": self.USER_AGENTS[7][0], "Referer": "https://news.example.org/", "Accept-Language": "de-DE"}
+        blob_ids, _ = resolve_blobs([canonical_json(header)])
+        trackers = [Tracker.objects.create(link=link, ip="10.0.0.1", date=timezone.now(), header=json.dumps(header)),  # inline legacy header
+                    Tracker.objects.create(link=link, ip="10.0.0.2", date=timezone.now(), header_blob_id=blob_ids[0]),
+                    Tracker.objects.create(link=link, ip="10.0.0.3", date=timezone.now(), header="not json")]
+        output = io.StringIO()
+        call_command("fill_click_dimensions", "--chunk-size", "2", stdout=output)
+        self.assertIn("updated the dimensions of 2 of them", output.getvalue())
+        expected = ("news.example.org", "Safari", "iOS", "de", "mobile")
+        for tracker, dimensions in zip(trackers, [expected, expected, ("", "", "", "", "")]):
+            tracker.refresh_from_db()
+            self.assertEqual(tuple(getattr(tracker, name) for name in DIMENSIONS), dimensions)
+        output = io.StringIO()
+        call_command("fill_click_dimensions", stdout=output)
+        self.assertIn("Checked 1 trackers, updated the dimensions of 0 of them", output.getvalue())
+
+
+class LinkCacheTests(TestCase):
+    """
+    the redirects must be served from the cache, and never from a stale record once the link or its owner changed
+    """
+    def setUp(self):
+        link_cache.clear()
+        self.owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = Link.objects.create(owner=self.owner, destination="https://example.com/", date=timezone.now())
+        self.url = reverse("redirect_link", args=[self.link.id])
+
+    def redirect(self, user_agent:str=PreviewAgentTests.BROWSER_AGENTS[0]):
+        return self.client.get(self.url, headers={"User-Agent": user_agent})
+
+    def test_cached_link_is_not_queried(self):
+        self.redirect()
+        with self.assertNumQueries(0):
+            response = self.redirect(PreviewAgentTests.PREVIEW_AGENTS[0])  # a preview isn't stored, so it needs no query at all
+        self.assertRedirects(response, "https://example.com/", fetch_redirect_response=False)
+        with CaptureQueriesContext(connection) as context:
+            self.redirect()
+        self.assertFalse([query for query in context.captured_queries if '"shortview_link"."destination"' in query["sql"]])
+        self.assertEqual((link_cache.hits, link_cache.misses), (2, 1))
+
+    def test_saved_link_is_reloaded(self):
+        self.redirect()
+        self.link.destination = "https://example.org/"
+        self.link.save()
+        self.assertRedirects(self.redirect(), "https://example.org/", fetch_redirect_response=False)
+        self.link.date = timezone.now() - datetime.timedelta(days=2)
+        self.link.lifetime = datetime.timedelta(days=1)
+        self.link.save()
+        self.assertEqual(self.redirect().status_code, 404)
+
+    def test_deleted_link_is_not_served(self):
+        self.redirect()
+        self.link.delete()
+        self.assertEqual(self.redirect().status_code, 404)
+
+    def test_links_deleted_by_a_query_are_not_served(self):
+        self.redirect()
+        Link.objects.filter(owner=self.owner).delete()
+        self.assertEqual(self.redirect().status_code, 404)
+
+    def test_owner_preferences_are_reloaded(self):
+        self.assertEqual(link_cache.get(self.link.id).notify, 1)  # the link uses the default of its owner
+        profile = Profile.objects.get(user=self.owner)
+        profile.default_notify_click = 3
+        profile.save()
+        self.assertEqual(link_cache.get(self.link.id).notify, 3)
+        self.redirect()
+        self.assertEqual(EmailOutbox.objects.count(), 1)  # notified as the owner now asks for each click
+
+    def test_expired_entries_are_reloaded(self):
+        cache = LinkCache(ttl=0)
+        cache.get(self.link.id)
+        cache.get(self.link.id)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+
+class ClickCounterTests(TestCase):
+    """
+    the click counters of the links must match their trackers, and the first click must be notified once
+    """
+    def setUp(self):
+        self.owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.link = Link.objects.create(owner=self.owner, destination="https://example.com/", date=timezone.now(), notify_click=2)
+        self.other = Link.objects.create(owner=self.owner, destination="https://example.org/", date=timezone.now())
+        self.start = timezone.now() - datetime.timedelta(hours=1)
+
+    def click(self, link:Link, minutes:int, notify:int=1) -> Click:
+        return Click(link_id=link.id, notify=notify, date=self.start + datetime.timedelta(minutes=minutes), ip=f"10.0.0.{minutes}", header="{}")
+
+    def test_batch_with_several_clicks_per_link(self):
+        store_clicks([self.click(self.link, 5), self.click(self.other, 1), self.click(self.link, 2), self.click(self.link, 9)])
+        store_clicks([self.click(self.link, 7)])  # late click, older than the last one
+        link, other = Link.objects.get(id=self.link.id), Link.objects.get(id=self.other.id)
+        self.assertEqual((link.click_count, link.first_click_at, link.last_click_at),
+                         (4, self.start + datetime.timedelta(minutes=2), self.start + datetime.timedelta(minutes=9)))
+        self.assertEqual((other.click_count, other.first_click_at), (1, self.start + datetime.timedelta(minutes=1)))
+
+    def test_first_click_is_notified_once(self):
+        store_clicks([self.click(self.link, 3, notify=2), self.click(self.link, 1, notify=2)])
+        store_clicks([self.click(self.link, 5, notify=2)])
+        self.assertEqual(EmailOutbox.objects.count(), 1)
+        tracker = Tracker.objects.get(link=self.link, date=self.start + datetime.timedelta(minutes=1))
+        self.assertIn(reverse("view_tracker", args=[self.link.id, tracker.id]), EmailOutbox.objects.get().text_content)
+
+    def test_recount_repairs_drifted_counters(self):
+        store_clicks([self.click(self.link, 4), self.click(self.link, 6), self.click(self.other, 2)])
+        Link.objects.filter(id=self.link.id).update(click_count=99, first_click_at=None, last_click_at=None, unique_visitors=0)
+        Link.objects.filter(id=self.other.id).update(click_count=0)
+        unclicked = Link.objects.create(owner=self.owner, destination="https://example.net/", date=timezone.now(), click_count=5)
+        with tempfile.TemporaryDirectory() as directory, override_settings(TRACKER_ARCHIVE_DIR=directory):
+            call_command("recount_clicks", "--chunk-size", "2", stdout=io.StringIO())
+        link, other, unclicked = (Link.objects.get(id=link.id) for link in (self.link, self.other, unclicked))
+        self.assertEqual((link.click_count, link.first_click_at, link.last_click_at, link.unique_visitors),
+                         (2, self.start + datetime.timedelta(minutes=4), self.start + datetime.timedelta(minutes=6), 2))
+        self.assertEqual(other.click_count, 1)
+        self.assertEqual((unclicked.click_count, unclicked.first_click_at), (0, None))
+
+
+@override_settings(HOME_PAGE_SIZE=2)
+class HomePaginationTests(TestCase):
+    """
+    the pages of the home page must list each link once, the active ones first, even when links share their date
+    """
+    def setUp(self):
+        self.user = User.objects.create_user("alice", "alice@example.com", "password")
+        self.client.force_login(self.user)
+        now = timezone.now()
+        same_date = now - datetime.timedelta(hours=1)
+        newest = Link.objects.create(owner=self.user, description="newest", date=now - datetime.timedelta(minutes=1))
+        same_date_links = [Link.objects.create(owner=self.user, description=f"active {index}", date=same_date) for index in range(3)]
+        expired = [Link.objects.create(owner=self.user, description=f"expired {index}", date=now - datetime.timedelta(days=3),
+                                       lifetime=datetime.timedelta(days=1)) for index in range(2)]
+        Link.objects.create(owner=self.user, description="scheduled", date=now + datetime.timedelta(days=1))
+        Link.objects.create(owner=User.objects.create_user("bob", "bob@example.com", "password"), date=now)
+        # the links with the same date come by decreasing id
+        self.active = [newest.id] + [link.id for link in reversed(same_date_links)]
+        self.expired = [link.id for link in reversed(expired)]
+
+    def set_hide_expired(self, hide:bool):
+        Profile.objects.filter(user=self.user).update(hide_expired=hide)
+
+    def walk(self) -> list[list[int]]:
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(reverse("index") + (f"?{urlencode({'cursor': cursor})}" if cursor else ""))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context["first_page"], cursor is None)
+            pages.append([link.id for link in response.context["links"]])
+            cursor = response.context["next_cursor"]
+            if cursor is None:
+                return pages
+
+    def test_pages_with_equal_dates(self):
+        self.set_hide_expired(False)
+        self.assertEqual(self.walk(), [self.active[:2], self.active[2:], self.expired])
+
+    def test_expired_links_are_hidden(self):
+        self.set_hide_expired(True)
+        self.assertEqual(self.walk(), [self.active[:2], self.active[2:]])
+
+    def test_tampered_cursor_shows_the_first_page(self):
+        self.set_hide_expired(False)
+        cursor = self.client.get(reverse("index")).context["next_cursor"]
+        values = signing.loads(cursor, salt="shortview.keyset")
+        for bad_cursor in [cursor[:-2], "not a cursor", signing.dumps(values, salt="another salt"),
+                           signing.dumps(values[:1], salt="shortview.keyset")]:
+            with self.subTest(cursor=bad_cursor):
+                response = self.client.get(reverse("index"), {"cursor": bad_cursor})
+                self.assertEqual([link.id for link in response.context["links"]], self.active[:2])
+
+
+@override_settings(TRACKER_PAGE_SIZE=2)
+class TrackerPaginationTests(TestCase):
+    """
+    the tracker table of a link must load each click once, in click order, even when clicks share their date
+    """
+    def setUp(self):
+        self.owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.client.force_login(self.owner)
+        self.link = Link.objects.create(owner=self.owner, destination="https://example.com/", date=timezone.now())
+        other = Link.objects.create(owner=self.owner, destination="https://example.org/", date=timezone.now())
+        same_date = timezone.now() - datetime.timedelta(hours=1)
+        Tracker.objects.create(link=other, ip="10.0.0.9", date=same_date)
+        later = Tracker.objects.create(link=self.link, ip="10.0.0.0", date=same_date + datetime.timedelta(minutes=1))
+        self.trackers = [Tracker.objects.create(link=self.link, ip=f"10.0.0.{index}", date=same_date).id for index in range(1, 5)]
+        self.trackers.append(later.id)
+
+    def test_pages_with_equal_dates(self):
+        response = self.client.get(reverse("view_link", args=[self.link.id]))
+        pages = [[tracker.id for tracker in response.context["trackers"]]]
+        cursor = response.context["next_cursor"]
+        while cursor is not None:
+            data = self.client.get(reverse("link_trackers", args=[self.link.id]), {"cursor": cursor}).json()
+            pages.append([tracker["id"] for tracker in data["trackers"]])
+            cursor = data["next"]
+        self.assertEqual(pages, [self.trackers[:2], self.trackers[2:4], self.trackers[4:]])
+
+    def test_json_page(self):
+        data = self.client.get(reverse("link_trackers", args=[self.link.id])).json()
+        tracker = Tracker.objects.get(id=self.trackers[0])
+        self.assertEqual(data["trackers"][0], {"id": tracker.id, "ip": tracker.ip, "country": "", "asn": None,
+                                               "date": date_format(timezone.localtime(tracker.date), "DATETIME_FORMAT"),
+                                               "header_url": reverse("view_tracker", args=[self.link.id, tracker.id])})
+        self.assertIsNotNone(data["next"])
+
+    def test_tampered_cursor_loads_the_first_page(self):
+        cursor = self.client.get(reverse("link_trackers", args=[self.link.id])).json()["next"]
+        for bad_cursor in [cursor[:-2], signing.dumps([0, 0], salt="another salt")]:
+            with self.subTest(cursor=bad_cursor):
+                data = self.client.get(reverse("link_trackers", args=[self.link.id]), {"cursor": bad_cursor}).json()
+                self.assertEqual([tracker["id"] for tracker in data["trackers"]], self.trackers[:2])
+
+    def test_other_users_are_forbidden(self):
+        self.client.force_login(User.objects.create_user("bob", "bob@example.com", "password"))
+        self.assertEqual(self.client.get(reverse("link_trackers", args=[self.link.id])).status_code, 403)
+        self.assertEqual(self.client.get(reverse("view_link", args=[self.link.id])).status_code, 403)
+
+
+class HeaderBlobTests(TestCase):
+    """
+    the headers moved to the deduplicated blobs must be shown exactly as they were stored inline
+    """
+    HEADERS = [
+        {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0", "Accept-Language": "fr-FR",
+         "Referer": "https://exemple.fr/é", "Cookie": "[REDACTED]"},
+        {"Host": "short.example.com", "User-Agent": "curl/8.5.0", "Cookie": "[REDACTED]"},
+    ]
+
+    def setUp(self):
+        self.owner = User.objects.create_user("alice", "alice@example.com", "password")
+        self.client.force_login(self.owner)
+        self.link = Link.objects.create(owner=self.owner, destination="https://example.com/", date=timezone.now())
+
+    def add_tracker(self, header:str) -> Tracker:
+        return Tracker.objects.create(link=self.link, ip="10.0.0.1", date=timezone.now(), header=header)
+
+    def pages(self, trackers:list[Tracker]) -> list[bytes]:
+        return [self.client.get(reverse("view_tracker", args=[self.link.id, tracker.id])).content for tracker in trackers]
+
+    def test_compact_headers(self):
+        # the inline headers were written with json.dumps(header, indent=2) by the redirect view
+        trackers = [self.add_tracker(json.dumps(header, indent=2)) for header in self.HEADERS + self.HEADERS[:1]]
+        trackers.append(self.add_tracker("{'not': json}"))
+        trackers.append(self.add_tracker(json.dumps(self.HEADERS[1], indent=4)))
+        before = self.pages(trackers)
+        output = io.StringIO()
+        call_command("compact_headers", "--chunk-size", "2", stdout=output)
+        self.assertIn("Converted 3 trackers", output.getvalue())
+        self.assertIn("2 trackers kept their inline header", output.getvalue())
+        self.assertEqual(self.pages(trackers), before)
+        blob_ids = [Tracker.objects.get(id=tracker.id).header_blob_id for tracker in trackers]
+        self.assertEqual(blob_ids[0], blob_ids[2])
+        self.assertEqual(len(set(blob_ids[:3])), 2)
+        self.assertEqual(blob_ids[3:], [None, None])
+        self.assertEqual(HeaderBlob.objects.count(), 2)
+
+    def test_new_clicks_keep_the_order_of_their_header(self):
+        header = {"User-Agent": "curl/8.5.0", "Accept": "*/*", "X-Forwarded-For": "10.0.0.1"}
+        store_clicks([Click(link_id=self.link.id, notify=1, date=timezone.now(), ip="10.0.0.1", header=canonical_json(header))])
+        self.assertEqual(self.pages([Tracker.objects.get()])[0].decode(), json.dumps(header, indent=2))
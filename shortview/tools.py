@@ -1,6 +1,11 @@
 from django.shortcuts import render
 from django.http import HttpRequest
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
 from django.core.mail import EmailMultiAlternatives
+from django.db import models
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
 
 from . import jobs
 
@@ -19,9 +24,8 @@ def regular_jobs(func):
     def wrapper(*args, **kwargs):
         request: HttpRequest = args[0]
         if request.user.is_authenticated:
-            # Ensure the user has a profile and delete expired links
-            jobs.check_profiles(request.user)
-            jobs.delete_expired_links(request.user)
+            # delete expired links, at most once every few minutes per user
+            jobs.throttled_delete_expired_links(request.user)
         return func(*args, **kwargs)
     
     return wrapper
@@ -36,3 +40,65 @@ def render_error(request: HttpRequest, template:str, error:str, post_args:tuple,
     if sup_context is not None:
         context.update(sup_context)
     return render(request, template, context)
+
+
+def keyset_page(queryset:QuerySet, ordering:list[str], cursor:str=None, size:int=50) -> tuple[list, str]:
+    """
+    returns a page of the queryset in the given ordering, starting after the position stored in the cursor,
+    and the cursor of the next page (None on the last page)
+    the ordering fields must all be ascending or all descending, and end with a unique field such as the id
+    """
+    descending = ordering[0].startswith("-")
+    names = [field.lstrip("-") for field in ordering]
+    queryset = queryset.order_by(*ordering)
+
+    values = decode_cursor(queryset.model, names, cursor)
+    if values is not None:
+        lookup = "lt" if descending else "gt"
+        after = Q()
+        for index, name in enumerate(names):
+            # rows equal on the previous fields and after the cursor on this one
+            condition = Q(**{f"{name}__{lookup}": values[index]})
+            for previous_name, previous_value in zip(names[:index], values[:index]):
+                condition &= Q(**{previous_name: previous_value})
+            after |= condition
+        queryset = queryset.filter(after)
+
+    items = list(queryset[:size + 1])
+    if len(items) <= size:
+        return items, None
+    items = items[:size]
+    return items, encode_cursor(names, items[-1])
+
+
+def encode_cursor(names:list[str], item) -> str:
+    """
+    a signed, url safe cursor storing the position of an item in a keyset pagination
+    """
+    values = []
+    for name in names:
+        value = getattr(item, name)
+        values.append(value.isoformat() if hasattr(value, "isoformat") else value)
+    return signing.dumps(values, salt="shortview.keyset")
+
+
+def decode_cursor(model, names:list[str], cursor:str) -> list | None:
+    """
+    read the values stored by encode_cursor, None if there is no valid cursor
+    """
+    if not cursor:
+        return None
+    try:
+        values = signing.loads(cursor, salt="shortview.keyset")
+    except signing.BadSignature:
+        return None
+    if not isinstance(values, list) or len(values) != len(names):
+        return None
+    for index, name in enumerate(names):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue  # an annotation, stored as is
+        if isinstance(field, models.DateTimeField) and isinstance(values[index], str):
+            values[index] = parse_datetime(values[index])
+    return values
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
@@ -11,8 +12,15 @@ urlpatterns = [
     path("info/conditions/", views.conditions, name="conditions"),
     path("preferences/", views.preferences, name="preferences"),
     path("link/new/", views.new_link, name="new_link"),
-    path("<int:link_id>/", views.redirect_link, name="redirect_link"),
+    path("metrics/", views.metrics_view, name="metrics"),
+    path("profiles/", views.profiles, name="profiles"),
+    path("<int:link_id>/", views.aredirect_link if getattr(settings, "ASYNC_REDIRECT", False) else views.redirect_link,
+         name="redirect_link"),
     path("<int:link_id>/edit/", views.view_link, name="view_link"),
+    path("<int:link_id>/trackers/", views.link_trackers, name="link_trackers"),
+    path("<int:link_id>/stats/", views.link_stats, name="link_stats"),
+    path("<int:link_id>/breakdown/", views.link_breakdown, name="link_breakdown"),
+    path("<int:link_id>/export/", views.export_link, name="export_link"),
     path("<int:link_id>/delete/", views.delete_link, name="delete_link"),
     path("<int:link_id>/change_notify/", views.link_change_notify, name="link_change_notify"),
     path("<int:link_id>/tracker/<int:tracker_id>/", views.view_tracker, name="view_tracker"),
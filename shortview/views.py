@@ -1,28 +1,41 @@
 from django.shortcuts import redirect, render, get_object_or_404
 from django.conf import settings
-from django.http import HttpRequest, HttpResponse, Http404
+from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse, FileResponse, Http404
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.urls import resolve, reverse, Resolver404
 from django.utils.translation import gettext as _
 from django.utils import timezone
-from django.template.loader import render_to_string
+from django.utils.formats import date_format
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import Case, When, Q, F, Value, Sum, Count
+from django.db.models.functions import TruncDay, TruncWeek
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.models import User
-from django.contrib.sites.models import Site
 
-from .models import Profile, Link, Tracker
-from .tools import regular_jobs, send_email, render_error
+from .models import Profile, Link, Tracker, ClickRollup, EmailOutbox
+from .linkcache import link_cache
+from .agents import agent_filter
+from .metrics import metrics, render_prometheus
+from .ingest import Click, record_click, arecord_click, click_buffer, hour_bucket
+from .headers import canonical_json
+from .dimensions import DIMENSIONS, click_dimensions
+from .hll import HyperLogLog
+from . import archive, export, profiling
+from .tools import regular_jobs, render_error, keyset_page
 
 from urllib.parse import urlparse
-from threading import Thread
+from itertools import chain, islice
 import datetime
+import hmac
 import json
 import re
 
 # Create your views here.
 
+BREAKDOWN_DIMENSIONS = DIMENSIONS + ("country", "asn")  # the indexed columns of the trackers served by link_breakdown
+
 @regular_jobs
 def index(request: HttpRequest):
     """
@@ -31,20 +44,21 @@ def index(request: HttpRequest):
     if not request.user.is_authenticated:
         return render(request, "shortview/index.html")
 
-    # sort links
-    links = request.user.link_set.all().order_by("-date")
-    active, expired = [], []
-    for link in links:
-        if not link.date > timezone.now():
-            if link.active():
-                active.append(link)
-            else:
-                expired.append(link)
+    # sort links in the database, active ones first, the ones scheduled in the future are not shown yet
+    profile:Profile = request.user.profile
+    now = timezone.now()
+    links = request.user.link_set.filter(date__lte=now).defer("visitors_sketch").annotate(
+        is_active=Case(When(Q(expires_at__isnull=True) | Q(expires_at__gte=now), then=Value(1)), default=Value(0)))
+    if profile.hide_expired:
+        links = links.filter(is_active=1)
     
-    sorted_links = active + expired
+    page, next_cursor = keyset_page(links, ["-is_active", "-date", "-id"], request.GET.get("cursor"),
+                                    getattr(settings, "HOME_PAGE_SIZE", 50))
     return render(request, "shortview/home.html", {"user": request.user,
-                                                   "profile": request.user.profile,
-                                                   "links": sorted_links,
+                                                   "profile": profile,
+                                                   "links": page,
+                                                   "first_page": not request.GET.get("cursor"),
+                                                   "next_cursor": next_cursor,
                                                    })
 
 
@@ -104,9 +118,7 @@ def register(request: HttpRequest):
                             _("The password you entered is not valid. %(errors)s") % {"errors": ' '.join(e.messages)},
                             ("username", "email"))
     else:
-        user = User.objects.create_user(username, email, password)
-        profile = Profile(user=user)
-        profile.save()
+        user = User.objects.create_user(username, email, password)  # the profile is created by signals.create_profile
         login(request, user)
         return redirect("index")
 
@@ -244,7 +256,7 @@ def preferences(request: HttpRequest):
                             {"profile": profile})
     
     else:
-        if not 1 <= notify <= 3:
+        if not 1 <= notify <= 4:
             return render_error(request, "shortview/preferenes.html",
                                 _("The value for the notification preference is invalid."),
                                 ("notify", "newsletter", "delete_expired", "never_expire", "days", "hours", "minutes", "seconds"),
@@ -325,7 +337,7 @@ def new_link(request: HttpRequest):
                             ("description", "destination", "notify", "never_expire", "days", "hours", "minutes", "seconds"))
     
     else:
-        if not 0 <= notify <= 3:
+        if not 0 <= notify <= 4:
             return render_error(request, "shortview/new_link.html",
                                 _("The value for the notification preference is invalid."),
                                 ("description", "destination", "notify", "never_expire", "days", "hours", "minutes", "seconds"))
@@ -360,12 +372,247 @@ def view_link(request: HttpRequest, link_id: int):
     link_object = get_object_or_404(Link, id=link_id)
     
     # check that the user owns the link, then display the page
-    if link_object.owner == request.user:
-        return render(request, "shortview/view_link.html",
-                        {"link": link_object, "trackers": link_object.tracker_set.all()})
-    else:
+    if link_object.owner_id != request.user.id:
+        raise PermissionDenied("You are not the owner of this link")
+    
+    # only show a page of trackers, without their header which is loaded by view_tracker
+    trackers, next_cursor = tracker_page(link_object, request.GET.get("cursor"))
+    try:
+        offset = max(0, int(request.GET.get("offset", 0)))
+        archive_offset = max(0, int(request.GET.get("archive_offset", 0)))
+    except ValueError:
+        offset, archive_offset = 0, 0
+
+    # the archived clicks are only read from the disk when asked
+    context = {"link": link_object, "trackers": trackers, "offset": offset,
+               "next_cursor": next_cursor, "next_offset": offset + len(trackers),
+               "archived_count": archive.archived_count(link_object.id)}
+    if request.GET.get("archived") == "1" and context["archived_count"]:
+        page_size = getattr(settings, "TRACKER_PAGE_SIZE", 100)
+        rows = list(islice(archive.read_link(link_object.id), archive_offset, archive_offset + page_size + 1))
+        context["archived_trackers"] = [{"date": datetime.datetime.fromisoformat(row["date"]), "ip": row["ip"],
+                                         "country": row.get("country", ""), "asn": row.get("asn"),
+                                         "header": json.dumps(row.get("header", {}), indent=2)} for row in rows[:page_size]]
+        context["archive_offset"] = archive_offset
+        context["next_archive_offset"] = archive_offset + page_size if len(rows) > page_size else None
+    return render(request, "shortview/view_link.html", context)
+
+
+def tracker_page(link_object:Link, cursor:str=None) -> tuple[list[Tracker], str]:
+    """
+    a page of the trackers of a link in click order, without their headers
+    """
+    trackers = Tracker.objects.filter(link=link_object).only("id", "link_id", "ip", "date", "country", "asn")
+    return keyset_page(trackers, ["date", "id"], cursor, getattr(settings, "TRACKER_PAGE_SIZE", 100))
+
+
+@login_required
+@regular_jobs
+def link_trackers(request: HttpRequest, link_id: int):
+    """
+    the next page of trackers of a link as json, used to load the tracker table while scrolling
+    """
+    link_object:Link = get_object_or_404(Link.objects.only("id", "owner_id"), id=link_id)
+    if link_object.owner_id != request.user.id:
+        raise PermissionDenied("You are not the owner of this link")
+    
+    trackers, next_cursor = tracker_page(link_object, request.GET.get("cursor"))
+    return JsonResponse({"trackers": [{"id": tracker.id, "ip": tracker.ip, "country": tracker.country, "asn": tracker.asn,
+                                       "date": date_format(timezone.localtime(tracker.date), "DATETIME_FORMAT"),
+                                       "header_url": reverse("view_tracker", args=[link_object.id, tracker.id])}
+                                      for tracker in trackers],
+                         "next": next_cursor})
+
+
+@login_required
+@regular_jobs
+def link_stats(request: HttpRequest, link_id: int):
+    """
+    the clicks of a link over time as json, by hour, day or week, summed from the hourly rollups
+    the unique IP addresses of a day or a week are estimated by merging the visitor sketches of its hours,
+    or summed from the hourly ones, so an upper bound, if some of its rollups were built without sketch
+    """
+    link_object:Link = get_object_or_404(Link.objects.only("id", "owner_id"), id=link_id)
+    if link_object.owner_id != request.user.id:
+        raise PermissionDenied("You are not the owner of this link")
+
+    periods = {"hour": F("bucket_start"), "day": TruncDay("bucket_start"), "week": TruncWeek("bucket_start")}
+    interval = request.GET.get("interval", "day")
+    if interval not in periods:
+        return HttpResponseBadRequest("The interval must be hour, day or week")
+    try:
+        start, end = parse_date_range(request.GET.get("start"), request.GET.get("end"))
+    except ValueError:
+        return HttpResponseBadRequest("The dates must be formatted as YYYY-MM-DD or as ISO 8601 date and time")
+
+    rollups = ClickRollup.objects.filter(link=link_object)
+    if start is not None:
+        rollups = rollups.filter(bucket_start__gte=start)
+    if end is not None:
+        rollups = rollups.filter(bucket_start__lt=end)
+    rows = list(rollups.values(period=periods[interval])
+                .annotate(clicks=Sum("count"), visitors=Sum("unique_ips")).order_by("period"))
+    if not rows:
+        return JsonResponse({"interval": interval, "series": []})
+    points = {row["period"]: {"clicks": row["clicks"], "unique_ips": row["visitors"]} for row in rows}
+    if interval != "hour":
+        sketches = period_sketches(rollups, periods[interval])
+        for row in rows:
+            sketch = sketches.get(row["period"])
+            if sketch is not None:
+                # the sum of the hourly counts is an upper bound, which the estimate may exceed by its error
+                points[row["period"]]["unique_ips"] = min(sketch.count(), row["visitors"])
+
+    # the periods without clicks are included, so that the points are evenly spaced in time
+    step = STATS_STEPS[interval]
+    period = period_start(start, interval) if start is not None else rows[0]["period"]
+    stop = end if end is not None else rows[-1]["period"] + step
+    if (stop - period) / step > getattr(settings, "LINK_STATS_MAX_POINTS", 10000):
+        return HttpResponseBadRequest("The date range is too long for this interval")
+    series = []
+    while period < stop:
+        series.append({"start": period.isoformat(), **points.get(period, {"clicks": 0, "unique_ips": 0})})
+        period += step
+    return JsonResponse({"interval": interval, "series": series})
+
+
+STATS_STEPS = {"hour": datetime.timedelta(hours=1), "day": datetime.timedelta(days=1), "week": datetime.timedelta(weeks=1)}
+
+
+def period_start(date:datetime.datetime, interval:str) -> datetime.datetime:
+    """
+    the start of the hour, day or week containing a date, as truncated by the queries of link_stats
+    the days and weeks start at midnight in the current time zone, and adding a step to them keeps them at midnight
+    """
+    if interval == "hour":
+        return hour_bucket(date)
+    day = timezone.localtime(date).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "week":
+        day -= datetime.timedelta(days=day.weekday())
+    return day
+
+
+def period_sketches(rollups, period) -> dict[datetime.datetime, HyperLogLog]:
+    """
+    the visitor sketches of the rollups merged by period, None for the periods with rollups built without sketch
+    """
+    sketches: dict[datetime.datetime, HyperLogLog] = {}
+    for start, sketch_data in rollups.values_list(period, "visitors_sketch"):
+        if not sketch_data:
+            sketches[start] = None
+        elif start not in sketches:
+            sketches[start] = HyperLogLog.from_bytes(sketch_data)
+        elif sketches[start] is not None:
+            sketches[start].merge(HyperLogLog.from_bytes(sketch_data))
+    return sketches
+
+
+@login_required
+@regular_jobs
+def link_breakdown(request: HttpRequest, link_id: int):
+    """
+    the clicks of a link grouped by one of their dimensions as json, most frequent values first, optionally between two dates
+    the values after the limit are summed in "other"
+    """
+    link_object:Link = get_object_or_404(Link.objects.only("id", "owner_id"), id=link_id)
+    if link_object.owner_id != request.user.id:
         raise PermissionDenied("You are not the owner of this link")
 
+    dimension = request.GET.get("dimension", "referer_host")
+    if dimension not in BREAKDOWN_DIMENSIONS:
+        return HttpResponseBadRequest(f"The dimension must be one of {', '.join(BREAKDOWN_DIMENSIONS)}")
+    try:
+        limit = min(max(1, int(request.GET.get("limit", 10))), 100)
+        start, end = parse_date_range(request.GET.get("start"), request.GET.get("end"))
+    except ValueError:
+        return HttpResponseBadRequest("The limit must be a number, and the dates must be formatted as YYYY-MM-DD or as ISO 8601 date and time")
+
+    trackers = Tracker.objects.filter(link=link_object)
+    if start is not None:
+        trackers = trackers.filter(date__gte=start)
+    if end is not None:
+        trackers = trackers.filter(date__lt=end)
+    # a single GROUP BY, read from the index of the link and the dimension when there are no dates
+    rows = list(trackers.values_list(dimension).annotate(clicks=Count("id")).order_by("-clicks", dimension))
+    top = rows[:limit]
+    return JsonResponse({"dimension": dimension, "total": sum(clicks for _, clicks in rows),
+                         "other": sum(clicks for _, clicks in rows[limit:]),
+                         "values": [{"value": value, "clicks": clicks} for value, clicks in top]})
+
+
+@login_required
+@regular_jobs
+def export_link(request: HttpRequest, link_id: int):
+    """
+    stream the clicks of a link as csv or ndjson, optionally between two dates, with the headers, the archived clicks
+    and gzip compressed
+    """
+    link_object:Link = get_object_or_404(Link.objects.only("id", "owner_id"), id=link_id)
+    if link_object.owner_id != request.user.id:
+        raise PermissionDenied("You are not the owner of this link")
+
+    export_format = request.GET.get("format", "csv")
+    if export_format not in ("csv", "ndjson"):
+        return HttpResponseBadRequest("The format must be csv or ndjson")
+    include_headers = request.GET.get("headers") == "1"
+    include_archived = request.GET.get("archived") == "1"
+    compress = request.GET.get("gzip") == "1"
+
+    trackers = Tracker.objects.filter(link=link_object).order_by("date", "id")
+    try:
+        start, end = parse_date_range(request.GET.get("start"), request.GET.get("end"))
+    except ValueError:
+        return HttpResponseBadRequest("The dates must be formatted as YYYY-MM-DD or as ISO 8601 date and time")
+    if start is not None:
+        trackers = trackers.filter(date__gte=start)
+    if end is not None:
+        trackers = trackers.filter(date__lt=end)
+    if include_headers:
+        trackers = trackers.select_related("header_blob")
+    else:
+        trackers = trackers.only("id", "date", "ip", "country", "asn")
+
+    rows = export.tracker_rows(trackers.iterator(chunk_size=getattr(settings, "EXPORT_CHUNK_SIZE", 2000)), include_headers)
+    if include_archived:  # the archived clicks are older than the ones still in the database
+        rows = chain(export.archived_rows(archive.read_link(link_object.id, start, end), include_headers), rows)
+    lines = export.csv_lines(rows, include_headers) if export_format == "csv" else export.ndjson_lines(rows)
+    content = export.buffered(lines)
+    filename = f"link-{link_object.id}-clicks.{export_format}"
+    if compress:
+        content = export.gzipped(content)
+        filename += ".gz"
+        content_type = "application/gzip"
+    else:
+        content_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def parse_date_range(start:str=None, end:str=None) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    parse the bounds of a date range given as dates or datetimes, a date as end bound includes the whole day
+    raises ValueError if a bound is invalid
+    """
+    bounds = []
+    for value, is_end in ((start, False), (end, True)):
+        if not value:
+            bounds.append(None)
+            continue
+        # the dates are parsed first, parse_datetime also accepts them but as the start of the day
+        day = parse_date(value)
+        if day is not None:
+            parsed = datetime.datetime.combine(day + datetime.timedelta(days=1 if is_end else 0), datetime.time())
+        else:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValueError(value)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        bounds.append(parsed)
+    return bounds[0], bounds[1]
+
 
 @login_required
 @regular_jobs
@@ -379,7 +626,7 @@ def delete_link(request: HttpRequest, link_id: int):
     except Link.DoesNotExist:
         ok = False
 
-    if not "confirm_delete" in request.POST or request.user != link_object.owner:
+    if not ok or not "confirm_delete" in request.POST or request.user.id != link_object.owner_id:
         ok = False
     
     if not ok:
@@ -402,7 +649,7 @@ def link_change_notify(request: HttpRequest, link_id: int):
     except Link.DoesNotExist:
         ok = False
 
-    if "notify" not in request.POST or request.user != link_object.owner:
+    if not ok or "notify" not in request.POST or request.user.id != link_object.owner_id:
         ok = False
     
     if not ok:
@@ -413,82 +660,94 @@ def link_change_notify(request: HttpRequest, link_id: int):
         notify = int(notify)
     except ValueError:
         ok = False
-    if not (0 <= notify <= 3):
+    if not (0 <= notify <= 4):
         ok = False
     
     if not ok:
         return redirect("view_link", link_id)
     
     link_object.notify_click = notify
-    link_object.save()
+    link_object.save(update_fields=["notify_click"])  # don't overwrite the counters and sketch updated by the clicks meanwhile
     return redirect("view_link", link_id)
 
 
+def client_ip(request: HttpRequest) -> str:
+    """
+    get the ip address (ipv6 or ipv4) of the client, behind the reverse proxy if any
+    """
+    ip = request.META.get("HTTP_X_FORWARDED_FOR")
+    if ip:
+        return ip.split(",")[0]
+    return request.META.get("REMOTE_ADDR")
+
+
+def click_header(request: HttpRequest) -> dict:
+    """
+    get the request header as a dict, without the sensitive data
+    """
+    header = dict(request.headers)
+    header["Cookie"] = "[REDACTED]"
+    return header
+
+
 def redirect_link(request: HttpRequest, link_id: int):
     """
     log the request by creating a tracker and serve the destination page to the client
     """
-    # get the link if it exists
-    link_object:Link = get_object_or_404(Link, id=link_id)
+    # recognize the app agents generating a link preview before any database work, they are not logged
+    with metrics.timer("shortview_click_phase_seconds", (("phase", "bot_filter"),)):
+        preview_agent = agent_filter.filter(request.headers.get("User-Agent"))
+
+    # get the link if it exists, from the cache when possible
+    with metrics.timer("shortview_click_phase_seconds", (("phase", "link_lookup"),)):
+        link_record = link_cache.get(link_id)
+    if link_record is None:
+        raise Http404("link not found")
 
     # check that the link is active
-    if not link_object.active():
+    if not link_record.active():
         raise Http404("link expired")
+    if preview_agent is not None:
+        return redirect(link_record.destination)
     # do not log if the link is clicked by the owner
-    if request.user.is_authenticated and request.user == link_object.owner:
-        return redirect(link_object.destination)
-
-    # get the ip address (ipv6 or ipv4)
-    ip = request.META.get("HTTP_X_FORWARDED_FOR")
-    if ip:
-        ip = ip.split(",")[0]
-    else:
-        ip = request.META.get("REMOTE_ADDR")
+    if request.user.is_authenticated and request.user.id == link_record.owner_id:
+        return redirect(link_record.destination)
+
+    # log the click with its dimensions, the notifications are sent once it is stored
+    with metrics.timer("shortview_click_phase_seconds", (("phase", "dimensions"),)):
+        dimensions = click_dimensions(request.headers)
+    record_click(Click(link_id=link_record.id, notify=link_record.notify, date=timezone.now(),
+                       ip=client_ip(request), header=canonical_json(click_header(request)), **dimensions))
     
-    # get the header as json and remove sensitive data
-    header = dict(request.headers)
-    header["Cookie"] = "[REDACTED]"
-    header_json = json.dumps(header, indent=2)
+    return redirect(link_record.destination)
+
 
-    # do not log if the link has been opened by an app agent to generate a preview
-    agents_blacklist = ["whatsapp", "discord", "slack"]
-    if any([agent.lower() in header["User-Agent"].lower() for agent in agents_blacklist]):
-        return redirect(link_object.destination)
+async def aredirect_link(request: HttpRequest, link_id: int):
+    """
+    async version of redirect_link, used when the ASYNC_REDIRECT setting is enabled under an ASGI server
+    """
+    with metrics.timer("shortview_click_phase_seconds", (("phase", "bot_filter"),)):
+        preview_agent = agent_filter.filter(request.headers.get("User-Agent"))
 
-    # log the click
-    tracker:Tracker = Tracker(link=link_object, date=timezone.now(), ip=ip, header=header_json)
-    tracker.save()
+    with metrics.timer("shortview_click_phase_seconds", (("phase", "link_lookup"),)):
+        link_record = await link_cache.aget(link_id)
+    if link_record is None:
+        raise Http404("link not found")
 
-    # notify by email depending on preferences
-    if link_object.notify_click == 0:  # using default preference
-        notify = link_object.owner.profile.default_notify_click
-    else:
-        notify = link_object.notify_click
-    
-    if (notify == 2 and link_object.tracker_set.count() == 1) or notify == 3:  # if notify first click and it is, or always notify
-        # send an email notification
-        domain = Site.objects.get_current().domain
-        scheme = "https" if getattr(settings, "SECURE_SSL_REDIRECT", False) else "http"
-        base_url = f"{scheme}://{domain}"
-        link_page = f"{base_url}{reverse('view_link', args=[link_object.id])}"
-        tracker_page = f"{base_url}{reverse('view_tracker', args=[link_object.id, tracker.id])}"
-        preferences_page = f"{base_url}{reverse('preferences')}"
-
-        #TODO: cleaner email sending system
-        text_content = render_to_string("shortview/emails/notify_click.txt",
-                                        context={"link": link_object, "tracker": tracker, "link_page": link_page,
-                                                 "tracker_page": tracker_page, "preferences_page": preferences_page,
-                                                 "mail_domain": settings.DOMAIN, "username": link_object.owner.username})
-        html_content = render_to_string("shortview/emails/notify_click.html",
-                                        context={"link": link_object, "tracker": tracker, "link_page": link_page,
-                                                 "tracker_page": tracker_page, "preferences_page": preferences_page,
-                                                 "mail_domain": settings.DOMAIN, "username": link_object.owner.username})
-        email_thread = Thread(target=send_email, args=[f"ShortView | Your link was clicked | {link_object.description}",
-                                                           settings.DEFAULT_FROM_EMAIL, link_object.owner.email, text_content, html_content])
-        email_thread.daemon = True
-        email_thread.start()
+    if not link_record.active():
+        raise Http404("link expired")
+    if preview_agent is not None:
+        return redirect(link_record.destination)
+    user = await request.auser()
+    if user.is_authenticated and user.id == link_record.owner_id:
+        return redirect(link_record.destination)
+
+    with metrics.timer("shortview_click_phase_seconds", (("phase", "dimensions"),)):
+        dimensions = click_dimensions(request.headers)
+    await arecord_click(Click(link_id=link_record.id, notify=link_record.notify, date=timezone.now(),
+                              ip=client_ip(request), header=canonical_json(click_header(request)), **dimensions))
     
-    return redirect(link_object.destination)
+    return redirect(link_record.destination)
 
 
 @login_required
@@ -498,17 +757,65 @@ def view_tracker(request: HttpRequest, link_id:int, tracker_id:int):
     view the full header of a request to the tracked link, also verifies if the page url is consistent
     the used page url contains the link id for the sake of easy navigation for the user
     """
-    # get the link if it exists
-    link_object:Link = get_object_or_404(Link, id=link_id)
-
-    # get the tracker if it exists
-    tracker_object:Tracker = get_object_or_404(Tracker, id=tracker_id)
+    # get the tracker if it exists and belongs to the link, with its link and header in the same query
+    tracker_object:Tracker = get_object_or_404(Tracker.objects.select_related("link", "header_blob"), id=tracker_id, link_id=link_id)
     
-    # verify that the tracker belongs to the link
-    if tracker_object not in link_object.tracker_set.all():
-        raise Http404("The tracker is not from the given link")
     # check that the user owns the link, then display the header in plaintext
-    if link_object.owner != request.user:
+    if tracker_object.link.owner_id != request.user.id:
         raise PermissionDenied("You are not the owner of the link associated to this tracker")
     else:
-        return HttpResponse(tracker_object.header, content_type="application/json")
+        return HttpResponse(tracker_object.header_json(), content_type="application/json")
+
+
+def metrics_view(request: HttpRequest):
+    """
+    the request metrics and the statistics of the caches in the Prometheus text format,
+    for the staff users or for a scraper sending the METRICS_TOKEN setting as bearer token
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if not (token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")):
+        if not request.user.is_staff:
+            raise PermissionDenied("The metrics are only available to the staff")
+
+    link_stats = link_cache.stats()
+    agent_stats = agent_filter.stats()
+    buffer_stats = click_buffer.stats()
+    counters = {("shortview_link_cache_hits_total", ()): link_stats["hits"],
+                ("shortview_link_cache_misses_total", ()): link_stats["misses"],
+                ("shortview_agent_cache_hits_total", ()): agent_stats["cache_hits"],
+                ("shortview_agent_cache_misses_total", ()): agent_stats["cache_misses"]}
+    for rule, count in agent_stats["filtered"].items():
+        counters[("shortview_filtered_clicks_total", (("rule", rule),))] = count
+    for name in ("queued", "stored", "dropped", "spilled"):
+        counters[(f"shortview_click_buffer_{name}_total", ())] = buffer_stats[name]
+    gauges = {("shortview_link_cache_size", ()): link_stats["size"],
+              ("shortview_link_cache_hit_ratio", ()): link_stats["hit_ratio"],
+              ("shortview_agent_cache_size", ()): agent_stats["cache_size"],
+              ("shortview_click_buffer_size", ()): buffer_stats["size"],
+              ("shortview_email_outbox_depth", ()): EmailOutbox.objects.filter(
+                  status__in=[EmailOutbox.PENDING, EmailOutbox.SENDING]).count()}
+    return HttpResponse(render_prometheus(counters, gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@login_required
+def profiles(request: HttpRequest):
+    """
+    the list of the request profiles for the staff, with the top functions of the selected one, or the selected dump itself
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied("The profiles are only available to the staff")
+
+    dumps = profiling.list_profiles()
+    selected = None
+    name = request.GET.get("name")
+    if name is not None:
+        selected = next((path for path in dumps if path.name == name), None)  # never opens a path given by the client
+        if selected is None:
+            raise Http404("profile not found")
+        if request.GET.get("download") == "1":
+            return FileResponse(open(selected, "rb"), as_attachment=True, filename=selected.name)
+
+    return render(request, "shortview/profiles.html",
+                  {"profiles": [path.name for path in dumps], "selected": selected.name if selected else None,
+                   "functions": profiling.top_functions(selected) if selected else [],
+                   "enabled": getattr(settings, "PROFILER_ENABLED", False)})
@@ -55,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shortview.metrics.MetricsMiddleware',  # first, to time the whole request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shortview.profiling.ProfilerMiddleware',  # last, as it calls the profiled views itself
 ]
 
 ROOT_URLCONF = 'website.urls'
@@ -88,11 +90,42 @@ WSGI_APPLICATION = 'website.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default, set DATABASE_SHORTVIEW = 'postgresql' in the .env file to use PostgreSQL (see DEPLOYMENT.md)
+if os.getenv('DATABASE_SHORTVIEW') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_NAME_SHORTVIEW', 'shortview'),
+            'USER': os.getenv('POSTGRES_USER_SHORTVIEW', 'shortview'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD_SHORTVIEW', ''),
+            'HOST': os.getenv('POSTGRES_HOST_SHORTVIEW', ''),  # empty to connect through the local unix socket
+            'PORT': os.getenv('POSTGRES_PORT_SHORTVIEW', ''),
+            # a pool of connections shared by the threads of each worker, requires psycopg[pool]
+            # and replaces the persistent connections, so CONN_MAX_AGE must stay 0
+            'OPTIONS': {'pool': {'min_size': 2, 'max_size': 10, 'timeout': 10}},
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': 600,  # seconds a connection is reused by the following requests of a thread
+            'CONN_HEALTH_CHECKS': True,
+            # take the write lock when a transaction starts, rather than failing with "database is locked"
+            # without waiting for the busy timeout when a read transaction needs to write
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        }
+    }
+
+# Pragmas applied to each new SQLite connection, by shortview.signals.tune_sqlite_connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # the readers don't block the writer, and the other way around
+    'synchronous': 'NORMAL',  # safe with WAL, a power loss can only lose the last transactions
+    'busy_timeout': 20000,  # milliseconds a writer waits for the lock before "database is locked"
+    'mmap_size': 268435456,  # bytes of the database read through memory mapping
+    'cache_size': -65536,  # page cache of each connection, negative values are in KiB
+    'temp_store': 'MEMORY',
 }
 
 # Password hashing functions
@@ -163,9 +196,96 @@ EMAIL_HOST_USER = 'shortview@ilwan.woah.pw'
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD_SHORTVIEW')
 DEFAULT_FROM_EMAIL = 'shortview@ilwan.woah.pw'
 
+# Email outbox: notifications are stored, then sent in batches by a pool of worker threads
+EMAIL_OUTBOX_WORKERS = 2  # sending threads
+EMAIL_OUTBOX_BATCH_SIZE = 20  # emails sent over one backend connection
+EMAIL_OUTBOX_POLL_INTERVAL = 5  # seconds between two checks of an empty outbox
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5  # attempts before an email is marked as failed
+EMAIL_OUTBOX_RETRY_DELAY = 60  # seconds before the first retry, doubled for each following one
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 600  # seconds before an email claimed by a dead worker is claimed again
+
+# Retention of the clicks: the trackers older than the retention of their owner's profile, or than this number of days
+# if it isn't set, are moved to compressed monthly archives by the archive_trackers job, None keeps them in the database
+TRACKER_RETENTION_DAYS = None
+TRACKER_ARCHIVE_DIR = BASE_DIR / 'archive'
+TRACKER_ARCHIVE_CHUNK_SIZE = 5000  # trackers archived and deleted per transaction
+
+# Background jobs, run by the runjobs command on a single server at a time
+JOB_INTERVAL = 60  # seconds between two runs of each job
+JOB_BATCH_SIZE = 1000  # rows handled by one run of a job, the rest is left to the next run
+JOB_LEASE_DURATION = 120  # seconds before the lease of a worker which stopped responding can be taken by another one
+
+# Click digests: the clicks on a link are summarized in one email per window
+NOTIFY_DIGEST_WINDOW = 60  # minutes between the first click of a window and the digest
+NOTIFY_DIGEST_TOP_IPS = 5  # number of most active IP addresses listed in a digest
+
 # Site ID
 SITE_ID = 1
 
+# Number of links per page on the home page
+HOME_PAGE_SIZE = 50
+
+# Number of trackers loaded at once in the tracker table of a link
+TRACKER_PAGE_SIZE = 100
+
+# Number of trackers read from the database at once when exporting the clicks of a link
+EXPORT_CHUNK_SIZE = 2000
+
+# Maximum number of points of the click chart of a link, the periods without clicks included
+LINK_STATS_MAX_POINTS = 10000
+
+# Minutes between two cleanups of the expired links of a user, triggered by the pages they load
+EXPIRED_CLEANUP_INTERVAL = 5
+
+# In-process cache of the links served by the redirect view
+LINK_CACHE_SIZE = 10000  # maximum number of cached links per process, 0 to disable
+LINK_CACHE_TTL = 300  # seconds before a cached link is loaded again from the database
+LINK_CACHE_WARM = False  # preload the most recent links when the app starts
+
+# Click ingestion: "sync" stores each click before redirecting (strict durability),
+# "buffered" redirects right away and stores the clicks in batches from a background thread
+CLICK_INGEST_MODE = 'sync'
+CLICK_BUFFER_BATCH_SIZE = 500  # clicks written per bulk insert
+CLICK_BUFFER_FLUSH_INTERVAL = 2  # maximum seconds a click waits in the queue
+CLICK_BUFFER_MAX_SIZE = 50000  # clicks kept in memory before the overflow policy applies
+CLICK_BUFFER_OVERFLOW = 'drop'  # "drop" counts and discards new clicks, "spill" appends them to the spill file
+CLICK_BUFFER_SPILL_PATH = BASE_DIR / 'clicks_spill.ndjson'
+
+# Precision of the HyperLogLog sketches counting the different visitors, 2**precision bytes at most per sketch
+VISITOR_SKETCH_PRECISION = 12  # sketch of each link, a standard error of 1.6%
+ROLLUP_SKETCH_PRECISION = 10  # sketch of each hourly rollup, merged by day or week for the charts, a standard error of 3.2%
+
+# Compress the deduplicated request headers with zlib when it makes them smaller
+HEADER_COMPRESSION = True
+
+# Request metrics, served in the Prometheus text format at /metrics/ to the staff users
+METRICS_ENABLED = True
+METRICS_TOKEN = os.getenv('METRICS_TOKEN_SHORTVIEW', '')  # lets a scraper read the metrics with an "Authorization: Bearer" header
+
+# Sampled profiling of the requests, the dumps are listed at /profiles/ for the staff users
+PROFILER_ENABLED = False
+PROFILER_SAMPLE_RATE = 100  # one request profiled out of this number, for each of the following views, 0 for none
+PROFILER_URL_NAMES = ['redirect_link', 'index']
+PROFILER_HEADER = 'X-Profile'  # the requests of staff users with this header are always profiled
+PROFILER_DIR = BASE_DIR / 'profiles'
+PROFILER_KEEP = 50  # number of dumps kept, the oldest ones are deleted
+
+# Offline geolocation of the clicks: path of a tab separated file of IP ranges in the format of https://iptoasn.com
+# (ip2asn-combined.tsv, optionally gzipped), None to not fill the country and network of the trackers
+GEOIP_DATABASE = None
+GEOIP_CACHE_SIZE = 65536  # addresses whose location is kept in memory
+
+# Detection of the apps and bots fetching links to build previews, their requests are not logged as clicks
+# set PREVIEW_AGENTS to a dict of rule name -> regex to replace shortview.agents.DEFAULT_PREVIEW_AGENTS
+PREVIEW_AGENTS_CACHE_SIZE = 4096  # user agents whose verdict is kept in memory
+PREVIEW_AGENTS_FILTER_EMPTY = True  # also ignore the requests without user agent
+
+# Browser, operating system and device of the clicks, found by the rules of shortview.dimensions
+USER_AGENT_CACHE_SIZE = 4096  # user agents whose parsing is kept in memory
+
+# Serve the redirect view natively async, enable it when deploying with website.asgi under an ASGI server
+ASYNC_REDIRECT = False
+
 # Some URLs
 LOGIN_URL = 'loginpage'
 